@@ -7,31 +7,78 @@
 # ---------------------------------------------------------------------------
 """Sentinel 1 RTC Correction module """  
 # ---------------------------------------------------------------------------
-import os,sys,datetime,time,glob,shutil,zipfile,re
+import os,sys,datetime,time,glob,shutil,zipfile,re,math
+import xml.etree.ElementTree as ET
 from shapely.geometry import Polygon
-from subprocess import Popen, PIPE, STDOUT
+import shapely.wkt
+import shlex
 import geopandas as gpd
 import argparse,ast
 
 from datetime import datetime
 
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import snap_worker
+import stage_ledger
+import footprint_index
+import stage_metrics
+import resource_planner
+import proc_runner
+import orbit_cache
+
 # --------------------------------------------------------------------------- 
 # Where the Sentinel 1 Toolbox graphing tool exe and GDAL is located
 baseSNAP = '/home/rcassotto/snap/bin/gpt'
 gdal_translate = '/usr/local/bin/gdal_translate'
+# if None, use the gdalbuildvrt in the folder of gdal_translate
+gdalbuildvrt = None
+# if True, run graphs in a long-lived SNAP worker instead of starting gpt each time
+use_snap_worker = False
+# gpt options planned for this host (threads, tile cache, and JVM heap), e.g., '-q 8 -c 9830M -J-Xmx16384M ',
+# empty for using the settings in gpt.vmoptions
+gpt_options = ''
+# the folder of log files (one for each granule), if None, save the log file in the folder of each granule
+log_dir = None
+# timeouts of stages in seconds, e.g., {'terrain_correction': 7200, 'default': 3600}, no timeout if not set
+stage_timeouts = {}
+# near-real-time mode, use restituted orbits (or the annotated state vectors) if precise orbits are not available yet
+nrt_mode = False
+# clip the external DEM (or mosaic SRTM tiles in a folder) to the footprint of each granule
+clip_dem = True
 
 def timestamp(date):
     return time.mktime(date.timetuple())
 
-def run_pOpen(cmd_str):
-    ps = Popen(cmd_str, shell=True, stdin=PIPE, stdout=PIPE, stderr=STDOUT)
-    out, err = ps.communicate()
-    returncode = ps.returncode
-    if returncode != 0:
-        print(out.decode())
-        # print(p.stdout.read())
-        print(err)
-        sys.exit(1)
+def run_pOpen(cmd, log_path=None, timeout=None):
+    # cmd is an argument list, or a command string (split into arguments, not run by a shell)
+    args = shlex.split(cmd) if isinstance(cmd, str) else cmd
+    try:
+        proc_runner.run_command(args, log_path=log_path, timeout=timeout)
+    except proc_runner.CommandError as e:
+        print(''.join(e.tail_lines))
+        raise
+
+# ---------------------------------------------------------------------------
+# argument lists of the external tools, a tool setting may contain arguments (e.g., 'python fake_tools.py gpt')
+def gpt_args(operator_or_graph):
+    return shlex.split(baseSNAP) + [operator_or_graph] + shlex.split(gpt_options)
+
+def gdal_translate_args(in_path, out_path):
+    return shlex.split(gdal_translate) + ['-of', 'GTiff', in_path, out_path]
+
+def granule_log_path(new_dir, granule):
+    # the output of all the commands of a granule
+    if log_dir is None:
+        return os.path.join(new_dir, granule + '_log.txt')
+    if not os.path.exists(log_dir):
+        os.makedirs(log_dir, exist_ok=True)
+    return os.path.join(log_dir, granule + '.log')
+
+def stage_timeout(stage):
+    return stage_timeouts.get(stage, stage_timeouts.get('default'))
+
+def run_stage_cmd(args, new_dir, granule, stage):
+    run_pOpen(args, log_path=granule_log_path(new_dir, granule), timeout=stage_timeout(stage))
 
 # ---------------------------------------------------------------------------
 # making the output directory
@@ -41,74 +88,314 @@ def output_dir(output_dir,gran):
         os.makedirs(Output_Directory)
     return Output_Directory
 
+# ---------------------------------------------------------------------------
+# parameters of the SNAP operators, shared by the stage-by-stage processing
+# (one gpt run per operator) and the single graph processing
+def orbit_parameters(nrt_orbit=False):
+    if nrt_orbit:
+        # use the orbit state vectors in the product if no restituted orbit file
+        return [('orbitType', 'Sentinel Restituted (Auto Download)'), ('continueOnFail', 'true')]
+    return [('orbitType', 'Sentinel Precise (Auto Download)'), ('continueOnFail', 'false')]
+
+def use_nrt_orbit(granule_path_zip):
+    # in the near-real-time mode, use restituted orbits if a precise orbit file of any slice is not on disk
+    if nrt_mode is False:
+        return False
+    zip_list = granule_path_zip if isinstance(granule_path_zip, list) else [granule_path_zip]
+    return None in [orbit_cache.find_snap_orbit(get_granule_name(item), 'POEORB') for item in zip_list]
+
+def calibration_parameters():
+    return [('outputBetaBand', 'false'), ('outputSigmaBand', 'true')]
+
+def speckle_parameters():
+    return [('filter', 'Refined Lee')]
+
+def terrain_correction_parameters(pixsiz, extDEM):
+    parameters = [('saveDEM', 'false'),
+                  ('saveIncidenceAngleFromEllipsoid', 'true'),  # RKC added on Jan 26, 2022
+                  ('pixelSpacingInMeter', str(pixsiz))]
+    if extDEM != " ":
+        parameters += [('demName', 'External DEM'), ('externalDEMFile', extDEM), ('externalDEMNoDataValue', '0')]
+    else:
+        parameters += [('demName', 'SRTM 1Sec HGT')]
+    return parameters
+
+def subset_parameters(geo_region):
+    # geo_region: a polygon in WKT (lon lat), only the part of the scene covering it is processed
+    return [('geoRegion', geo_region), ('copyMetadata', 'true')]
+
+def parameters_to_args(parameters):
+    return ['-P%s=%s' % (key, value) for key, value in parameters]
+
 # ---------------------------------------------------------------------------
 # Apply precise orbit file
-def applyOrbit(new_dir, granule_path_zip, granule):
-    aoFlag = ' Apply-Orbit-File '
-    oType = '-PcontinueOnFail=\"false\" -PorbitType=\'Sentinel Precise (Auto Download)\' '
-    out = '-t ' + new_dir + '/' + granule + '_OB '
-    cmd = baseSNAP + aoFlag + out + oType + granule_path_zip
-    run_pOpen(cmd)
+def applyOrbit(new_dir, granule_path_zip, granule, nrt_orbit=False):
+    out = os.path.join(new_dir, granule + '_OB')
+    args = gpt_args('Apply-Orbit-File') + ['-t', out] + parameters_to_args(orbit_parameters(nrt_orbit)) + \
+           [granule_path_zip]
+    run_stage_cmd(args, new_dir, granule, 'orbit')
     orbit_corrected_file_path = os.path.join(new_dir, granule + '_OB.dim')
     return orbit_corrected_file_path
 
 # ---------------------------------------------------------------------------
 # remove border noise
 def applyremovebordernoise(new_dir, in_data_path, baseGran):
-    Noise_flag = '  Remove-GRD-Border-Noise '
-    out = '-t ' + new_dir + '/' + baseGran + '_OB_GBN '
-    in_data_cmd = '-SsourceProduct=' + in_data_path
-    cmd = baseSNAP + Noise_flag + out + in_data_cmd
+    out = os.path.join(new_dir, baseGran + '_OB_GBN')
+    args = gpt_args('Remove-GRD-Border-Noise') + ['-t', out, '-SsourceProduct=' + in_data_path]
     print(datetime.now(), 'Removing Border Noise')
-    run_pOpen(cmd)
+    run_stage_cmd(args, new_dir, baseGran, 'border_noise')
     border_noise_file_path = os.path.join(new_dir, baseGran + '_OB_GBN.dim')
     return border_noise_file_path
 
 # ---------------------------------------------------------------------------
 # apply calibrations
 def applyCal(new_dir, in_data_path, baseGran):
-    calFlag = ' Calibration -PoutputBetaBand=false -PoutputSigmaBand=true '
-    out = '-t ' + new_dir + '/' + baseGran + '_OB_GBN_CAL '
-    in_data_cmd = '-Ssource=' + in_data_path
-    cmd = baseSNAP + calFlag + out + in_data_cmd
+    out = os.path.join(new_dir, baseGran + '_OB_GBN_CAL')
+    args = gpt_args('Calibration') + parameters_to_args(calibration_parameters()) + \
+           ['-t', out, '-Ssource=' + in_data_path]
     print(datetime.now(),'Applying Calibration')
-    run_pOpen(cmd)
+    run_stage_cmd(args, new_dir, baseGran, 'calibration')
     calibrated_file_path = os.path.join(new_dir, baseGran + '_OB_GBN_CAL.dim')
-    return calibrated_file_path# -*- coding: utf-8 -*-
+    return calibrated_file_path
+
+# ---------------------------------------------------------------------------
+# assemble consecutive slices of the same data take into one product
+def applySliceAssembly(new_dir, in_data_paths, baseGran):
+    out = os.path.join(new_dir, baseGran + '_OB_GBN_CAL_SA')
+    # gpt takes the source products as arguments
+    args = gpt_args('SliceAssembly') + ['-t', out] + in_data_paths
+    print(datetime.now(),'Applying Slice Assembly')
+    run_stage_cmd(args, new_dir, baseGran, 'slice_assembly')
+    assembled_file_path = os.path.join(new_dir, baseGran + '_OB_GBN_CAL_SA.dim')
+    return assembled_file_path
+
+# ---------------------------------------------------------------------------
+# subset to a geographic region
+def applySubset(new_dir, in_data_path, baseGran, geo_region):
+    out = os.path.join(new_dir, baseGran + '_OB_GBN_CAL_SUB')
+    args = gpt_args('Subset') + parameters_to_args(subset_parameters(geo_region)) + \
+           ['-t', out, '-Ssource=' + in_data_path]
+    print(datetime.now(),'Applying Subset')
+    run_stage_cmd(args, new_dir, baseGran, 'subset')
+    subset_file_path = os.path.join(new_dir, baseGran + '_OB_GBN_CAL_SUB.dim')
+    return subset_file_path
 
 # ---------------------------------------------------------------------------
 # apply a speckle filter
 def applySpeckle(new_dir, in_data_path, baseGran):
-    speckle_flag = ' Speckle-Filter -Pfilter="Refined Lee" '
-    out = '-t ' + new_dir + '/' + baseGran + '_OB_GBN_CAL_SP '
-    in_data_cmd = '-Ssource=' + in_data_path
-    cmd = baseSNAP + speckle_flag + out + in_data_cmd
+    out = os.path.join(new_dir, baseGran + '_OB_GBN_CAL_SP')
+    args = gpt_args('Speckle-Filter') + parameters_to_args(speckle_parameters()) + \
+           ['-t', out, '-Ssource=' + in_data_path]
     print(datetime.now(),'Applying Speckle')
-    run_pOpen(cmd)
+    run_stage_cmd(args, new_dir, baseGran, 'speckle')
     speckle_filter_file_path = os.path.join(new_dir, baseGran + '_OB_GBN_CAL_SP.dim')
     return speckle_filter_file_path
 
 # ---------------------------------------------------------------------------
 # Apply range doppler terrain correction
-def applyTC(new_dir, in_data_path, baseGran, pixsiz, extDEM):
-    tcFlag = ' Terrain-Correction '
-    out = '-t ' + new_dir + '/' + baseGran + '_OB_GBN_CAL_SP_TC '
-    in_data_cmd = '-Ssource=' + in_data_path + ' '
-    in_data_cmd = in_data_cmd + '-PsaveDEM=false '
-    in_data_cmd = in_data_cmd + '-PsaveIncidenceAngleFromEllipsoid=true ' # RKC added on Jan 26, 2022
-    
-    in_data_cmd = in_data_cmd + '-PpixelSpacingInMeter=' + str(pixsiz) + ' '
-    
-    if extDEM != " ":
-        in_data_cmd = in_data_cmd + ' -PdemName=\"External DEM\" -PexternalDEMFile=%s -PexternalDEMNoDataValue=0 ' % extDEM
-    else:
-        in_data_cmd = in_data_cmd + ' -PdemName=\"SRTM 1Sec HGT\" '
-    cmd = baseSNAP + tcFlag + out + in_data_cmd
+def applyTC(new_dir, in_data_path, baseGran, pixsiz, extDEM, nrt_orbit=False):
+    out = os.path.join(new_dir, baseGran + '_OB_GBN_CAL_SP_TC')
+    args = gpt_args('Terrain-Correction') + ['-t', out, '-Ssource=' + in_data_path] + \
+           parameters_to_args(terrain_correction_parameters(pixsiz, extDEM))
     print(datetime.now(),'Applying Terrain Correction -- This will take some time')
-    run_pOpen(cmd)
+    run_stage_cmd(args, new_dir, baseGran, 'terrain_correction')
     terrain_correction_file_path = new_dir + '/' + baseGran + '_OB_GBN_CAL_SP_TC.dim'
+    write_orbit_metadata(terrain_correction_file_path.replace('.dim', '.data'), nrt_orbit=nrt_orbit)
+    return terrain_correction_file_path
+
+# ---------------------------------------------------------------------------
+# write a graph containing the whole chain: Read -> Apply-Orbit-File -> Remove-GRD-Border-Noise
+# -> Calibration -> Speckle-Filter -> Terrain-Correction -> Write
+def add_graph_node(graph, node_id, operator, sources, parameters):
+    node = ET.SubElement(graph, 'node', id=node_id)
+    ET.SubElement(node, 'operator').text = operator
+    sources_element = ET.SubElement(node, 'sources')
+    for name, ref_id in sources:
+        ET.SubElement(sources_element, name, refid=ref_id)
+    parameters_element = ET.SubElement(node, 'parameters')
+    for key, value in parameters:
+        ET.SubElement(parameters_element, key).text = value
+    return node_id
+
+def write_GRD_graph_xml(graph_xml, granule_path_zip, out_product, pixsiz, extDEM, geo_region=None, nrt_orbit=False):
+    graph = ET.Element('graph', id='GRD_preprocessing')
+    ET.SubElement(graph, 'version').text = '1.0'
+    # granule_path_zip can be a list of consecutive slices, they are assembled after calibration
+    zip_list = granule_path_zip if isinstance(granule_path_zip, list) else [granule_path_zip]
+    calibration_nodes = []
+    for idx, zip_path in enumerate(zip_list):
+        suffix = '' if idx == 0 else '(%d)' % (idx + 1)
+        node = add_graph_node(graph, 'Read' + suffix, 'Read', [], [('file', zip_path)])
+        node = add_graph_node(graph, 'Apply-Orbit-File' + suffix, 'Apply-Orbit-File', [('sourceProduct', node)],
+                              orbit_parameters(nrt_orbit))
+        node = add_graph_node(graph, 'Remove-GRD-Border-Noise' + suffix, 'Remove-GRD-Border-Noise',
+                              [('sourceProduct', node)], [])
+        node = add_graph_node(graph, 'Calibration' + suffix, 'Calibration', [('sourceProduct', node)],
+                              calibration_parameters())
+        calibration_nodes.append(node)
+    if len(calibration_nodes) > 1:
+        sources = [('sourceProduct' if idx == 0 else 'sourceProduct.%d' % idx, item)
+                   for idx, item in enumerate(calibration_nodes)]
+        node = add_graph_node(graph, 'SliceAssembly', 'SliceAssembly', sources, [])
+    if geo_region is not None:
+        node = add_graph_node(graph, 'Subset', 'Subset', [('sourceProduct', node)], subset_parameters(geo_region))
+    node = add_graph_node(graph, 'Speckle-Filter', 'Speckle-Filter', [('sourceProduct', node)], speckle_parameters())
+    node = add_graph_node(graph, 'Terrain-Correction', 'Terrain-Correction', [('sourceProduct', node)],
+                          terrain_correction_parameters(pixsiz, extDEM))
+    add_graph_node(graph, 'Write', 'Write', [('sourceProduct', node)],
+                   [('file', out_product), ('formatName', 'BEAM-DIMAP')])
+    ET.indent(graph)
+    ET.ElementTree(graph).write(graph_xml, encoding='UTF-8', xml_declaration=True)
+    return graph_xml
+
+# ---------------------------------------------------------------------------
+# Apply the whole chain in a single gpt run, no intermediate products written to disk
+def applyGraph(new_dir, granule_path_zip, granule, pixsiz, extDEM, geo_region=None, nrt_orbit=False):
+    graph_xml = os.path.join(new_dir, granule + '_graph.xml')
+    terrain_correction_file_path = new_dir + '/' + granule + '_OB_GBN_CAL_SP_TC.dim'
+    write_GRD_graph_xml(graph_xml, granule_path_zip, terrain_correction_file_path, pixsiz, extDEM,
+                        geo_region=geo_region, nrt_orbit=nrt_orbit)
+    print(datetime.now(),'Applying Orbit, Border Noise, Calibration, Speckle, and Terrain Correction in a single graph')
+    run_graph(graph_xml, log_path=granule_log_path(new_dir, granule), timeout=stage_timeout('graph'))
+    write_orbit_metadata(terrain_correction_file_path.replace('.dim', '.data'), nrt_orbit=nrt_orbit)
     return terrain_correction_file_path
 
+# ---------------------------------------------------------------------------
+# run a graph in the SNAP worker if it is enabled, otherwise in a new gpt run
+def run_graph(graph_xml, log_path=None, timeout=None):
+    global use_snap_worker
+    if use_snap_worker:
+        try:
+            worker = snap_worker.get_snap_worker()
+        except RuntimeError as e:
+            print(datetime.now(), 'Warning, %s, use gpt instead' % str(e))
+            use_snap_worker = False
+        else:
+            # a hung graph is killed with the worker, the same timeout as gpt
+            seconds = worker.run_graph(graph_xml, log_path=log_path, timeout=timeout)
+            print(datetime.now(), 'SNAP worker completed %s in %s seconds' % (os.path.basename(graph_xml), seconds))
+            return
+    run_pOpen(gpt_args(graph_xml), log_path=log_path, timeout=timeout)
+
+# ---------------------------------------------------------------------------
+# Apply the chain stage by stage, each operator in a separate gpt run.
+# If a ledger is given, stages completed in a previous run are skipped
+def applyStages(new_dir, granule_path_zip, granule, pixsiz, extDEM, ledger=None, geo_region=None, nrt_orbit=False):
+    run_stage = stage_ledger.run_stage
+    # granule_path_zip can be a list of consecutive slices, they are assembled after calibration
+    zip_list = granule_path_zip if isinstance(granule_path_zip, list) else [granule_path_zip]
+    calibrated_list = []
+    for zip_path in zip_list:
+        slice_gran = granule if len(zip_list) == 1 else get_granule_name(zip_path)
+        tag = '' if len(zip_list) == 1 else ':' + slice_gran
+        # orbit correction
+        Orbit_Correction = run_stage(ledger, granule, 'orbit' + tag, [zip_path] + orbit_parameters(nrt_orbit),
+                                     applyOrbit, new_dir, zip_path, slice_gran, nrt_orbit=nrt_orbit)
+        # border noise removal
+        Border_Noise_Removal = run_stage(ledger, granule, 'border_noise' + tag, [Orbit_Correction],
+                                         applyremovebordernoise, new_dir, Orbit_Correction, slice_gran)
+        # Calibration to sigma nought
+        calibrated = run_stage(ledger, granule, 'calibration' + tag, [Border_Noise_Removal] + calibration_parameters(),
+                               applyCal, new_dir, Border_Noise_Removal, slice_gran)
+        calibrated_list.append(calibrated)
+    if len(calibrated_list) > 1:
+        Calibration = run_stage(ledger, granule, 'slice_assembly', calibrated_list,
+                                applySliceAssembly, new_dir, calibrated_list, granule)
+    else:
+        Calibration = calibrated_list[0]
+    # subset to the area of interest
+    if geo_region is not None:
+        Calibration = run_stage(ledger, granule, 'subset', [Calibration] + subset_parameters(geo_region),
+                                applySubset, new_dir, Calibration, granule, geo_region)
+    # speckle filter
+    Speckle_Filter = run_stage(ledger, granule, 'speckle', [Calibration] + speckle_parameters(),
+                               applySpeckle, new_dir, Calibration, granule)
+    # terrain correction
+    Terrain_Correction = run_stage(ledger, granule, 'terrain_correction',
+                                   [Speckle_Filter] + terrain_correction_parameters(pixsiz, extDEM),
+                                   applyTC, new_dir, Speckle_Filter, granule, pixsiz, extDEM, nrt_orbit=nrt_orbit)
+    return Terrain_Correction
+
+# ---------------------------------------------------------------------------
+# Apply the chain in a single graph, skip it if completed in a previous run
+def applyGraphStage(new_dir, granule_path_zip, granule, pixsiz, extDEM, ledger=None, geo_region=None,
+                    nrt_orbit=False):
+    params = [granule_path_zip] + orbit_parameters(nrt_orbit) + calibration_parameters() + speckle_parameters() + \
+             terrain_correction_parameters(pixsiz, extDEM)
+    if geo_region is not None:
+        params += subset_parameters(geo_region)
+    return stage_ledger.run_stage(ledger, granule, 'graph', params,
+                                  applyGraph, new_dir, granule_path_zip, granule, pixsiz, extDEM,
+                                  geo_region=geo_region, nrt_orbit=nrt_orbit)
+
+# ---------------------------------------------------------------------------
+# granule names, e.g., S1A_IW_GRDH_1SDV_20190401T000523_20190401T000548_026600_02FC4A_5A2B
+# (mission, mode, product type, class, start time, stop time, absolute orbit, data take ID, unique ID)
+def get_granule_name(granule_path_zip):
+    if isinstance(granule_path_zip, list):
+        return assembled_granule_name(granule_path_zip)
+    return os.path.basename(granule_path_zip).split('.')[0]
+
+def assembled_granule_name(slice_zip_list):
+    # the name of the first slice, with the stop time of the last slice
+    names = [get_granule_name(item).split('_') for item in slice_zip_list]
+    return '_'.join(names[0][:5] + [names[-1][5]] + names[0][6:])
+
+def group_consecutive_slices(grd_list, max_gap_seconds=5):
+    '''
+    group consecutive slices of the same mission, absolute orbit and data take ID
+    :param grd_list: GRD zip files
+    :param max_gap_seconds: the maximum gap between the stop time of a slice and the start time of the next slice
+    :return: a list, each item is a GRD zip file or a list of consecutive slices
+    '''
+    groups = {}
+    for grd in grd_list:
+        parts = get_granule_name(grd).split('_')
+        key = tuple(parts[:4] + parts[6:8])
+        groups.setdefault(key, []).append(grd)
+
+    time_format = '%Y%m%dT%H%M%S'
+    grouped_list = []
+    for key in groups.keys():
+        slices = sorted(groups[key], key=lambda item: get_granule_name(item).split('_')[4])
+        run = [slices[0]]
+        for grd in slices[1:]:
+            prev_stop = datetime.strptime(get_granule_name(run[-1]).split('_')[5], time_format)
+            start = datetime.strptime(get_granule_name(grd).split('_')[4], time_format)
+            if (start - prev_stop).total_seconds() <= max_gap_seconds:
+                run.append(grd)
+            else:
+                grouped_list.append(run if len(run) > 1 else run[0])
+                run = [grd]
+        grouped_list.append(run if len(run) > 1 else run[0])
+    return grouped_list
+
+# ---------------------------------------------------------------------------
+# check that two terrain corrected products (e.g., from applyGraph and applyStages) are the same
+def compare_TC_outputs(tc_dim_a, tc_dim_b, rtol=1e-5, atol=1e-6):
+    import numpy as np
+    import rasterio
+    data_dir_a = tc_dim_a.replace('.dim', '.data')
+    data_dir_b = tc_dim_b.replace('.dim', '.data')
+    bands_a = sorted([os.path.basename(item) for item in glob.glob(os.path.join(data_dir_a, '*.img'))])
+    bands_b = sorted([os.path.basename(item) for item in glob.glob(os.path.join(data_dir_b, '*.img'))])
+    if bands_a != bands_b:
+        print('Bands are different: %s vs %s' % (str(bands_a), str(bands_b)))
+        return False
+    b_same = True
+    for band in bands_a:
+        with rasterio.open(os.path.join(data_dir_a, band)) as src_a, rasterio.open(os.path.join(data_dir_b, band)) as src_b:
+            if src_a.shape != src_b.shape or src_a.transform != src_b.transform or src_a.crs != src_b.crs:
+                print('%s: the size or georeference is different' % band)
+                b_same = False
+                continue
+            array_a = src_a.read(1)
+            array_b = src_b.read(1)
+            if np.allclose(array_a, array_b, rtol=rtol, atol=atol, equal_nan=True) is False:
+                print('%s: max absolute difference is %f' % (band, np.nanmax(np.abs(array_a - array_b))))
+                b_same = False
+    return b_same
+
 # ---------------------------------------------------------------------------
 # write files to tiff
 def Sigma0_FF_2_gtif(new_dir, Sigma0_directory, granule):
@@ -118,27 +405,137 @@ def Sigma0_FF_2_gtif(new_dir, Sigma0_directory, granule):
     Sigma0_VV_save = new_dir + '/' + granule + '_' + Sigma0_VV_path.split('/')[-1].split('.')[0] + '.tif'
     Sigma0_VH_save = new_dir + '/' + granule + '_' + Sigma0_VH_path.split('/')[-1].split('.')[0] + '.tif'
     Incidnc_Angle_save = new_dir + '/' + granule + '_incidenceAngleFromEllipsoid.tif'  # new addition 10/12/2022
-    cmd_VV = gdal_translate+' -of GTiff ' + Sigma0_VV_path + ' ' + Sigma0_VV_save
-    cmd_VH = gdal_translate+' -of GTiff ' + Sigma0_VH_path + ' ' + Sigma0_VH_save
-    cmd_Incidnc = gdal_translate+' -of GTiff ' + Incidnc_Angle_path + ' ' + Incidnc_Angle_save  # new addition 10/12/2022
-    run_pOpen(cmd_VV)
-    run_pOpen(cmd_VH)
-    run_pOpen(cmd_Incidnc)
+    cmd_VV = gdal_translate_args(Sigma0_VV_path, Sigma0_VV_save)
+    cmd_VH = gdal_translate_args(Sigma0_VH_path, Sigma0_VH_save)
+    cmd_Incidnc = gdal_translate_args(Incidnc_Angle_path, Incidnc_Angle_save)  # new addition 10/12/2022
+    # the three bands are converted at the same time
+    log_path = granule_log_path(new_dir, granule)
+    timeout = stage_timeout('export')
+    try:
+        proc_runner.run_commands([(cmd, log_path, timeout) for cmd in [cmd_VV, cmd_VH, cmd_Incidnc]], max_concurrent=3)
+    except proc_runner.CommandError as e:
+        print(''.join(e.tail_lines))
+        raise
     print(datetime.now(),'Incidence Angle outfilename: ', Incidnc_Angle_save)
+    return [Sigma0_VV_save, Sigma0_VH_save, Incidnc_Angle_save]
+
+# ---------------------------------------------------------------------------
+# write files to Cloud-Optimized GeoTIFFs (internal tiles, compression, and overviews),
+# convert the bands concurrently in this process, no gdal_translate runs
+Sigma0_bands = ['Sigma0_VV', 'Sigma0_VH', 'incidenceAngleFromEllipsoid']
+
+def band_2_cog(img_path, save_path, compress='DEFLATE', num_threads='ALL_CPUS'):
+    import rasterio
+    import rasterio.shutil
+    creation_options = {'COMPRESS': compress, 'PREDICTOR': 'YES', 'BLOCKSIZE': 512,
+                        'OVERVIEWS': 'AUTO', 'NUM_THREADS': num_threads, 'BIGTIFF': 'IF_SAFER'}
+    with rasterio.Env(GDAL_NUM_THREADS=num_threads):
+        rasterio.shutil.copy(img_path, save_path, driver='COG', **creation_options)
+    return save_path
+
+def Sigma0_2_cog(new_dir, Sigma0_directory, granule, compress='DEFLATE', num_threads='ALL_CPUS'):
+    from concurrent.futures import ThreadPoolExecutor
+    img_paths = [os.path.join(Sigma0_directory, band + '.img') for band in Sigma0_bands]
+    save_paths = [os.path.join(new_dir, granule + '_' + band + '.tif') for band in Sigma0_bands]
+    # GDAL releases the GIL when reading, compressing, and writing, so threads run in parallel
+    with ThreadPoolExecutor(max_workers=len(img_paths)) as executor:
+        futures = [executor.submit(band_2_cog, img_path, save_path, compress, num_threads)
+                   for img_path, save_path in zip(img_paths, save_paths)]
+        outputs = [future.result() for future in futures]
+    print(datetime.now(),'Saved Cloud-Optimized GeoTIFFs: ', outputs)
+    return outputs
+
+# ---------------------------------------------------------------------------
+# keep the ENVI rasters produced by Terrain-Correction, and write VRT files pointing to them (no pixel copied)
+def get_gdalbuildvrt():
+    if gdalbuildvrt is not None:
+        return gdalbuildvrt
+    # in the same folder as gdal_translate
+    return os.path.join(os.path.dirname(gdal_translate), 'gdalbuildvrt')
+
+def link_or_copy(src, dst):
+    # a hard link if on the same file system, otherwise a copy
+    if os.path.exists(dst):
+        os.remove(dst)
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+    return dst
+
+def Sigma0_2_vrt(new_dir, Sigma0_directory, granule):
+    img_paths = []
+    vrt_paths = []
+    for band in Sigma0_bands:
+        # link the .img and .hdr files, the .hdr file should have the same base name as the .img file,
+        # the terrain corrected product is kept as recorded in the ledger
+        img_path = os.path.join(new_dir, granule + '_' + band + '.img')
+        link_or_copy(os.path.join(Sigma0_directory, band + '.img'), img_path)
+        link_or_copy(os.path.join(Sigma0_directory, band + '.hdr'), img_path[:-4] + '.hdr')
+        if os.path.isfile(os.path.join(Sigma0_directory, band + '.img.aux.xml')):
+            shutil.copy2(os.path.join(Sigma0_directory, band + '.img.aux.xml'), img_path + '.aux.xml')
+        vrt_path = img_path[:-4] + '.vrt'
+        # source paths in the same folder are saved as relative to the VRT file
+        run_pOpen(shlex.split(get_gdalbuildvrt()) + [vrt_path, img_path], log_path=granule_log_path(new_dir, granule))
+        img_paths.append(img_path)
+        vrt_paths.append(vrt_path)
+    stack_vrt = os.path.join(new_dir, granule + '_Sigma0_stack.vrt')
+    run_pOpen(shlex.split(get_gdalbuildvrt()) + ['-separate', stack_vrt] + img_paths,
+              log_path=granule_log_path(new_dir, granule))
+    print(datetime.now(),'Saved VRT files: ', vrt_paths + [stack_vrt])
+    return img_paths + vrt_paths + [stack_vrt]
+
+# ---------------------------------------------------------------------------
+# record the orbit used in the metadata of bands, in .aux.xml files read by GDAL,
+# then GeoTIFFs written by gdal_translate or the COG driver also have it.
+# Written with the terrain corrected product, before its stage is recorded in the ledger
+orbit_metadata_key = 'S1_ORBIT'
+
+def write_orbit_metadata(Sigma0_directory, nrt_orbit=False):
+    value = 'NRT-orbit' if nrt_orbit else 'precise'
+    for img_path in glob.glob(os.path.join(Sigma0_directory, '*.img')):
+        aux_xml = img_path + '.aux.xml'
+        if os.path.isfile(aux_xml):
+            pam = ET.parse(aux_xml).getroot()
+        else:
+            pam = ET.Element('PAMDataset')
+        metadata = pam.find('Metadata')
+        if metadata is None:
+            metadata = ET.SubElement(pam, 'Metadata')
+        for item in metadata.findall('MDI'):
+            if item.get('key') == orbit_metadata_key:
+                metadata.remove(item)
+        ET.SubElement(metadata, 'MDI', key=orbit_metadata_key).text = value
+        ET.indent(pam)
+        ET.ElementTree(pam).write(aux_xml)
+    return value
+
+def export_Sigma0(new_dir, Sigma0_directory, granule, export_format='cog', compress='DEFLATE', num_threads='ALL_CPUS'):
+    if export_format == 'cog':
+        return Sigma0_2_cog(new_dir, Sigma0_directory, granule, compress=compress, num_threads=num_threads)
+    elif export_format == 'vrt':
+        return Sigma0_2_vrt(new_dir, Sigma0_directory, granule)
+    elif export_format == 'gtiff':
+        return Sigma0_FF_2_gtif(new_dir, Sigma0_directory, granule)
+    else:
+        raise ValueError('unknown export format: %s' % export_format)
 
 # ---------------------------------------------------------------------------    
 #Clean files
-def clean_dirs(Output_Directory,Final_Out_Dir):
+def clean_dirs(Output_Directory,Final_Out_Dir,move_lock=None,export_format='gtiff'):
     basename = os.path.basename(Output_Directory)[:-10]
     print(Output_Directory)
-    keep_files = [os.path.join(Output_Directory,basename + '_OB_GBN_CAL_SP_TC.dim'),
-                  os.path.join(Output_Directory,basename +'_Sigma0_VH.tif'),
-                  os.path.join(Output_Directory,basename + '_Sigma0_VV.tif'),
-                  os.path.join(Output_Directory,basename + '_incidenceAngleFromEllipsoid.tif')]
-    keep_files_out = [os.path.join(Final_Out_Dir,basename + '_OB_GBN_CAL_SP_TC.dim'),
-                      os.path.join(Final_Out_Dir,basename +'_Sigma0_VH.tif'),
-                      os.path.join(Final_Out_Dir,basename + '_Sigma0_VV.tif'),
-                      os.path.join(Final_Out_Dir,basename + '_incidenceAngleFromEllipsoid.tif')]
+    keep_names = [basename + '_OB_GBN_CAL_SP_TC.dim',
+                  basename +'_Sigma0_VH.tif',
+                  basename + '_Sigma0_VV.tif',
+                  basename + '_incidenceAngleFromEllipsoid.tif']
+    if export_format == 'vrt':
+        # the rasters produced by Terrain-Correction and the VRT files pointing to them
+        keep_names = [basename + '_OB_GBN_CAL_SP_TC.dim', basename + '_Sigma0_stack.vrt']
+        for band in Sigma0_bands:
+            keep_names += [basename + '_' + band + ext for ext in ['.img', '.hdr', '.vrt', '.img.aux.xml']]
+    keep_files = [os.path.join(Output_Directory, name) for name in keep_names]
+    keep_files_out = [os.path.join(Final_Out_Dir, name) for name in keep_names]
     files = [os.path.join(dp, f) for dp, dn, fn in os.walk(os.path.expanduser(Output_Directory)) for f in fn]
     remove = []
     for file in files:
@@ -148,37 +545,102 @@ def clean_dirs(Output_Directory,Final_Out_Dir):
         if os.path.isfile(file):
             os.remove(file)
     
-    if not os.path.exists(Final_Out_Dir):
-        os.makedirs(Final_Out_Dir)
-    
-    for file,file_out in zip(keep_files,keep_files_out):
-        if os.path.isfile(file):
-            shutil.move(file,file_out)
-            if '.img' in file_out:
-                cmd = gdal_translate+' -of GTiff ' + file_out + ' ' + file_out[:-4] + '.tif'
-                run_pOpen(cmd)
+    # when processing in parallel, only one process moves files to the final folder at a time
+    if move_lock is not None:
+        move_lock.acquire()
+    try:
+        if not os.path.exists(Final_Out_Dir):
+            os.makedirs(Final_Out_Dir, exist_ok=True)
+
+        for file,file_out in zip(keep_files,keep_files_out):
+            if os.path.isfile(file):
+                shutil.move(file,file_out)
+                if '.img' in file_out and export_format != 'vrt':
+                    run_pOpen(gdal_translate_args(file_out, file_out[:-4] + '.tif'))
+    finally:
+        if move_lock is not None:
+            move_lock.release()
 
     shutil.rmtree(Output_Directory)    # Remove *_Processed directory
+    return [file_out for file_out in keep_files_out if os.path.isfile(file_out)]
     
+# ---------------------------------------------------------------------------
+# read the footprint of a GRD zip file from its manifest.safe, return a polygon in (lon, lat)
+def read_grd_footprint(grd_zip):
+    return shapely.wkt.loads(footprint_index.read_manifest(grd_zip)['footprint'])
+
+# ---------------------------------------------------------------------------
+# a small DEM for each granule, clipped from a large DEM (e.g., a state-wide GeoTIFF) or mosaicked from SRTM tiles,
+# so Terrain-Correction does not read and resample a DEM much larger than the scene
+# the buffer around the footprint in degrees
+dem_buffer_deg = 0.05
+
+def granule_footprint(granule_path_zip, geo_region=None):
+    # the footprint of a GRD file or consecutive slices, within geo_region (WKT) if it is set
+    from shapely.ops import unary_union
+    zip_list = granule_path_zip if isinstance(granule_path_zip, list) else [granule_path_zip]
+    footprint = unary_union([read_grd_footprint(item) for item in zip_list])
+    if geo_region is not None:
+        region_footprint = footprint.intersection(shapely.wkt.loads(geo_region))
+        if region_footprint.is_empty is False:
+            footprint = region_footprint
+    return footprint
+
+def srtm_tile_paths(tile_dir, bounds):
+    # SRTM 1Sec tiles (e.g., N29W096.SRTMGL1.hgt.zip or N29W096.hgt) covering bounds, as paths readable by GDAL
+    # the tile names of downloadSRTM.py, in the parent folder
+    repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    if repo_dir not in sys.path:
+        sys.path.insert(0, repo_dir)
+    import downloadSRTM
+    minx, miny, maxx, maxy = bounds
+    paths = []
+    for lat in range(math.floor(miny), math.ceil(maxy)):
+        for lon in range(math.floor(minx), math.ceil(maxx)):
+            tile = downloadSRTM.srtm_tile_name(lat, lon)
+            name = tile.split('.')[0]
+            if os.path.isfile(os.path.join(tile_dir, name + '.hgt')):
+                paths.append(os.path.join(tile_dir, name + '.hgt'))
+            elif os.path.isfile(os.path.join(tile_dir, tile)):
+                # read from the zip file, no unzip
+                paths.append(downloadSRTM.srtm_vsizip_path(tile_dir, tile))
+    return paths
+
+def granule_dem(dem_source, footprint, save_dir, granule):
+    '''
+    clip a DEM to the footprint of a granule (with a buffer)
+    :param dem_source: a DEM file readable by GDAL, or a folder of SRTM 1Sec tiles
+    :param footprint: a polygon in (lon, lat)
+    :return: the path of the clipped DEM (GeoTIFF)
+    '''
+    save_path = os.path.join(save_dir, granule + '_DEM.tif')
+    log_path = granule_log_path(save_dir, granule)
+    bounds = footprint.buffer(dem_buffer_deg).bounds
+    if os.path.isdir(dem_source):
+        tile_paths = srtm_tile_paths(dem_source, bounds)
+        if len(tile_paths) < 1:
+            raise IOError('no SRTM tiles covering %s in %s' % (str(bounds), dem_source))
+        src_path = os.path.join(save_dir, granule + '_DEM_tiles.vrt')
+        run_pOpen(shlex.split(get_gdalbuildvrt()) + [src_path] + tile_paths, log_path=log_path)
+    else:
+        src_path = dem_source
+    minx, miny, maxx, maxy = bounds
+    tmp_path = save_path[:-4] + '_tmp.tif'
+    args = shlex.split(gdal_translate) + ['-of', 'GTiff', '-co', 'TILED=YES', '-projwin_srs', 'EPSG:4326',
+                                          '-projwin', str(minx), str(maxy), str(maxx), str(miny), src_path, tmp_path]
+    run_pOpen(args, log_path=log_path, timeout=stage_timeout('dem'))
+    os.replace(tmp_path, save_path)
+    print(datetime.now(), 'clipped DEM for %s: %s' % (granule, save_path))
+    return save_path
+
 # ---------------------------------------------------------------------------            
 def check_overlap(region_model,GRD_input_list):
     df = gpd.read_file(region_model)
-    df_poly     = df.geometry[0].__geo_interface__['coordinates']
-    rm_polylist = [tuple(reversed(y)) for x in df_poly for y in x]
-    rm_poly = Polygon(rm_polylist)
+    rm_poly = df.geometry[0]
 
     keep = []
     for file in GRD_input_list:
-        unzipped_file     = zipfile.ZipFile(file, "r")
-        manifest          = unzipped_file.read(os.path.join(os.path.basename(file)[:-4] + '.SAFE','manifest.safe'))
-        result            = re.search('<gml:coordinates>(.*)</gml:coordinates>', str(manifest))
-        grd_coverage_str  = result.group(1)
-        grd_coverage_tmp  = tuple(grd_coverage_str.split(' '))
-        grd_polylist = []
-        for coord in grd_coverage_tmp:
-            a,b = coord.split(',')
-            grd_polylist.append(tuple((float(a),float(b))))
-        grd_poly          = Polygon(grd_polylist)
+        grd_poly          = read_grd_footprint(file)
         
         overlap_area     = grd_poly.intersection(rm_poly).area
         percent_overlap  = overlap_area / rm_poly.area
@@ -195,7 +657,7 @@ def Process_GRD_File(args,GRD_input_list,extDEM_path=" "):
     :return: pre processed geotifs in GRD_Processed folder
     """
 
-    start_time = datetime.datetime.now()
+    start_time = datetime.now()
     if args['pixsize'] == " ":
         pixsiz = 10.0
     else:
@@ -207,28 +669,25 @@ def Process_GRD_File(args,GRD_input_list,extDEM_path=" "):
    # GRD_list_updated = check_overlap(args['region_model'],GRD_input_list)  # This was added by Clayton to eliminate scenes with small overlap
 #    for i,GRD_file in enumerate(GRD_list_updated):   # checks for overlap; eliminates scenes with small overlap
 #        print('Processing GRD File %s / %s' % (i,len(GRD_list_updated)))   # checks for overlap; eliminates scenes with small overlap
+    final_dir = os.path.join(args['output_dir'],'final')
+    ledger = stage_ledger.open_ledger(args['output_dir'], final_dir)
     for i,GRD_file in enumerate(GRD_input_list):
         print('Processing GRD File %s / %s' % (i,len(GRD_input_list)))   
         granule = GRD_file.split('/')[-1].split('.')[0]
-        Output_Directory = output_dir(args['output_dir'],granule)
-        if len(glob.glob(os.path.join(Output_Directory,'*VV*'))) == 0:           
-            # orbit correction
-            Orbit_Correction = applyOrbit(Output_Directory, GRD_file, granule)
-            # border noise removal
-            Border_Noise_Removal = applyremovebordernoise(Output_Directory, Orbit_Correction, granule)
-            # Calibration to sigma nought
-            Calibration = applyCal(Output_Directory, Border_Noise_Removal, granule)
-            # speckle filter
-            Speckle_Filter = applySpeckle(Output_Directory, Calibration, granule)
-            # terrain correction
-            Terrain_Correction = applyTC(Output_Directory, Speckle_Filter, granule, pixsiz, extDEM_path)
+        if ledger.is_granule_complete(granule) is False:
+            Output_Directory = output_dir(args['output_dir'],granule)
+            # orbit correction, border noise removal, calibration, speckle filter, and terrain correction
+            Terrain_Correction = applyStages(Output_Directory, GRD_file, granule, pixsiz, extDEM_path, ledger=ledger)
             # write out data to geotiffs VV and VH
             Sigma0_directory = Terrain_Correction.replace('.dim', '.data')
-            Sigma0_FF_2_gtif(Output_Directory, Sigma0_directory, granule)  
-            clean_dirs(Output_Directory,os.path.join(args['output_dir'],'final'))
+            stage_ledger.run_stage(ledger, granule, 'export', [Sigma0_directory],
+                                   Sigma0_FF_2_gtif, Output_Directory, Sigma0_directory, granule)
+            final_outputs = clean_dirs(Output_Directory,final_dir)
+            ledger.record_granule(granule, 'complete', final_outputs, [pixsiz, extDEM_path])
+            ledger.remove_stages(granule)
         else:
             print('%s already has output files...skipping' % (GRD_file))
-    end_time = datetime.datetime.now()
+    end_time = datetime.now()
     Total_time = timestamp(end_time) - timestamp(start_time)
     return Total_time
 
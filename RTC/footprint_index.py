@@ -0,0 +1,177 @@
+#!/usr/bin/env python
+# Filename: footprint_index.py
+"""
+introduction: a footprint index of Sentinel-1 GRD zip files. It reads only the manifest.safe entry of each zip
+              (using several threads), caches the footprint, acquisition time, orbits, and polarisations in a
+              SQLite table keyed by path, mtime and size, and builds an STRtree for overlap queries.
+
+add time: 18 October, 2026
+"""
+
+import os, sys
+import re
+import glob
+import sqlite3
+import zipfile
+from datetime import datetime
+from optparse import OptionParser
+from concurrent.futures import ThreadPoolExecutor
+
+from shapely import wkt
+from shapely.geometry import Polygon
+from shapely.strtree import STRtree
+
+index_name = 'footprint_index.sqlite'
+
+def parse_manifest(manifest):
+    '''
+    parse the information we need from the text of manifest.safe
+    :return: a dict
+    '''
+    coordinates = re.search(r'<gml:coordinates>(.*?)</gml:coordinates>', manifest, re.S).group(1)
+    polylist = []
+    for coord in coordinates.strip().split():
+        lat, lon = coord.split(',')
+        polylist.append((float(lon), float(lat)))
+    info = {'footprint': Polygon(polylist).wkt,
+            'start_time': re.search(r'<safe:startTime>(.*?)</safe:startTime>', manifest).group(1),
+            'stop_time': re.search(r'<safe:stopTime>(.*?)</safe:stopTime>', manifest).group(1),
+            'relative_orbit': int(re.search(r'<safe:relativeOrbitNumber type="start">(\d+)<', manifest).group(1)),
+            'absolute_orbit': int(re.search(r'<safe:orbitNumber type="start">(\d+)<', manifest).group(1)),
+            'polarisations': ','.join(re.findall(r'<s1sarl1:transmitterReceiverPolarisation>(\w+)<', manifest))}
+    return info
+
+def read_manifest(grd_zip):
+    # only read the manifest.safe entry, not the measurement files
+    with zipfile.ZipFile(grd_zip, 'r') as zip_obj:
+        manifest_names = [item for item in zip_obj.namelist() if item.endswith('manifest.safe')]
+        if len(manifest_names) < 1:
+            raise ValueError('No manifest.safe in %s' % grd_zip)
+        manifest = zip_obj.read(manifest_names[0]).decode()
+    return parse_manifest(manifest)
+
+class FootprintIndex(object):
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.conn = sqlite3.connect(db_path, timeout=120)
+        with self.conn:
+            self.conn.execute('CREATE TABLE IF NOT EXISTS footprints (path TEXT PRIMARY KEY, mtime REAL, size INTEGER, '
+                              'footprint TEXT, start_time TEXT, stop_time TEXT, relative_orbit INTEGER, '
+                              'absolute_orbit INTEGER, polarisations TEXT)')
+        self.paths = []
+        self.records = {}
+        self.tree = None
+
+    def close(self):
+        self.conn.close()
+
+    def _cached_record(self, path, mtime, size):
+        row = self.conn.execute('SELECT footprint, start_time, stop_time, relative_orbit, absolute_orbit, polarisations '
+                                'FROM footprints WHERE path=? AND mtime=? AND size=?', (path, mtime, size)).fetchone()
+        if row is None:
+            return None
+        keys = ['footprint', 'start_time', 'stop_time', 'relative_orbit', 'absolute_orbit', 'polarisations']
+        return dict(zip(keys, row))
+
+    def build(self, grd_zip_list, threads=8):
+        '''
+        read footprints of GRD zip files (from the cache if the file is unchanged), then build an STRtree
+        '''
+        grd_zip_list = [os.path.abspath(item) for item in grd_zip_list]
+        stats = {}
+        for path in grd_zip_list:
+            # e.g., removed after listing, or a broken link, get_record returns None for it
+            try:
+                stats[path] = os.stat(path)
+            except OSError as e:
+                print('Warning, cannot read %s: %s' % (path, repr(e)))
+        to_read = []
+        for path in stats.keys():
+            record = self._cached_record(path, stats[path].st_mtime, stats[path].st_size)
+            if record is None:
+                to_read.append(path)
+            else:
+                self.records[path] = record
+
+        if len(to_read) > 0:
+            print(datetime.now(), 'reading footprints of %d GRD files, %d in the cache' %
+                  (len(to_read), len(grd_zip_list) - len(to_read)))
+            with ThreadPoolExecutor(max_workers=threads) as executor:
+                results = list(executor.map(self._read_one, to_read))
+            with self.conn:
+                for path, record in zip(to_read, results):
+                    if record is None:
+                        continue
+                    self.conn.execute('INSERT OR REPLACE INTO footprints VALUES (?,?,?,?,?,?,?,?,?)',
+                                      (path, stats[path].st_mtime, stats[path].st_size, record['footprint'],
+                                       record['start_time'], record['stop_time'], record['relative_orbit'],
+                                       record['absolute_orbit'], record['polarisations']))
+                    self.records[path] = record
+
+        self.paths = [path for path in grd_zip_list if path in self.records]
+        self.geometries = [wkt.loads(self.records[path]['footprint']) for path in self.paths]
+        self.tree = STRtree(self.geometries)
+        return len(self.paths)
+
+    def _read_one(self, path):
+        try:
+            return read_manifest(path)
+        except Exception as e:
+            print('Warning, failed to read the manifest of %s: %s' % (path, repr(e)))
+            return None
+
+    def get_record(self, grd_zip):
+        return self.records.get(os.path.abspath(grd_zip))
+
+    def overlaps(self, extent_poly):
+        '''
+        find GRD files overlapping the area of interest
+        :param extent_poly: the area of interest in (lon, lat)
+        :return: a list of (path, overlap fraction of the area of interest, intersection), sorted by the fraction
+        '''
+        results = []
+        # shapely 2: query returns the indices of geometries whose envelope intersects
+        for idx in self.tree.query(extent_poly):
+            intersection = self.geometries[idx].intersection(extent_poly)
+            if intersection.is_empty or intersection.area <= 0:
+                continue
+            results.append((self.paths[idx], intersection.area / extent_poly.area, intersection))
+        results.sort(key=lambda item: item[1], reverse=True)
+        return results
+
+def main(options, args):
+    grd_dir = args[0]
+    grd_zip_list = glob.glob(os.path.join(grd_dir, '*GRDH*.zip'))
+    db_path = options.index_path if options.index_path is not None else os.path.join(grd_dir, index_name)
+    index = FootprintIndex(db_path)
+    count = index.build(grd_zip_list, threads=options.threads)
+    print(datetime.now(), 'indexed %d GRD files in %s' % (count, db_path))
+    if options.extent is not None:
+        sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        import vector_tools
+        for path, fraction, _ in index.overlaps(vector_tools.read_extent_polygon(options.extent)):
+            print('%.4f %s' % (fraction, path))
+
+if __name__ == '__main__':
+    usage = "usage: %prog [options] grd_directory "
+    parser = OptionParser(usage=usage, version="1.0 2026-10-18")
+    parser.description = 'Introduction: build a footprint index of GRD zip files, and rank them by overlap with an extent'
+
+    parser.add_option("-i", "--index_path",
+                      action="store", dest="index_path",
+                      help="the path of the index file, default is footprint_index.sqlite in grd_directory")
+
+    parser.add_option("-x", "--extent",
+                      action="store", dest="extent",
+                      help="a shapefile or a WKT polygon (lon lat) of the area of interest")
+
+    parser.add_option("-t", "--threads",
+                      action="store", dest="threads", type=int, default=8,
+                      help="the number of threads for reading zip files")
+
+    (options, args) = parser.parse_args()
+    if len(sys.argv) < 2 or len(args) < 1:
+        parser.print_help()
+        sys.exit(2)
+
+    main(options, args)
@@ -0,0 +1,270 @@
+#!/usr/bin/env python
+# Filename: orbit_cache.py
+"""
+introduction: a local cache of Sentinel-1 orbit files (POEORB and RESORB), prefetched before running gpt,
+              so Apply-Orbit-File finds them on disk and never waits on the network.
+
+              The cache has the layout of SNAP auxdata: <cache_dir>/POEORB/S1A/2019/04/<name>.EOF.zip,
+              by default it is the orbit folder of SNAP (~/.snap/auxdata/Orbits/Sentinel-1).
+              Orbit files are indexed by their validity window (in the file names).
+              The source is a URL of the same layout (e.g., https://step.esa.int/auxdata/orbits/Sentinel-1)
+              or a local mirror folder (any layout), so the cache can also be filled on an air-gapped cluster.
+
+add time: 18 October, 2026
+"""
+
+import os, sys
+import re
+import glob
+import fcntl
+import shutil
+import threading
+from datetime import datetime, timedelta
+from optparse import OptionParser
+from concurrent.futures import ThreadPoolExecutor
+
+snap_orbit_dir = os.path.expanduser('~/.snap/auxdata/Orbits/Sentinel-1')
+default_source = 'https://step.esa.int/auxdata/orbits/Sentinel-1'
+
+# e.g., S1A_OPER_AUX_POEORB_OPOD_20190421T120654_V20190331T225942_20190402T005942.EOF.zip
+orbit_pattern = re.compile(r'(S1[A-D])_OPER_AUX_(POEORB|RESORB)_OPOD_\d{8}T\d{6}_V(\d{8}T\d{6})_(\d{8}T\d{6})\.EOF(\.zip)?$')
+
+# orbit state vectors needed before and after the acquisition
+validity_margin = timedelta(seconds=60)
+
+def parse_orbit_name(file_name):
+    # return (mission, orbit_type, valid_start, valid_stop), None if it is not an orbit file
+    res = orbit_pattern.match(os.path.basename(file_name))
+    if res is None:
+        return None
+    return res.group(1), res.group(2), datetime.strptime(res.group(3), '%Y%m%dT%H%M%S'), \
+           datetime.strptime(res.group(4), '%Y%m%dT%H%M%S')
+
+def granule_time_window(granule):
+    # e.g., S1A_IW_GRDH_1SDV_20190401T000523_20190401T000548_026600_02FC4A_5A2B
+    parts = granule.split('_')
+    start = datetime.strptime(parts[4], '%Y%m%dT%H%M%S')
+    stop = datetime.strptime(parts[5], '%Y%m%dT%H%M%S')
+    return parts[0], start, stop
+
+def month_folder(cache_dir, orbit_type, mission, time):
+    return os.path.join(cache_dir, orbit_type, mission, '%04d' % time.year, '%02d' % time.month)
+
+def add_to_index(index, path):
+    # index: (mission, orbit_type) -> a list of (valid_start, valid_stop, path)
+    info = parse_orbit_name(path)
+    if info is None:
+        return
+    mission, orbit_type, valid_start, valid_stop = info
+    index.setdefault((mission, orbit_type), []).append((valid_start, valid_stop, path))
+
+def find_in_index(index, mission, orbit_type, start, stop):
+    # the newest file covering the acquisition
+    candidates = [item for item in index.get((mission, orbit_type), [])
+                  if item[0] <= start - validity_margin and item[1] >= stop + validity_margin]
+    if len(candidates) < 1:
+        return None
+    return sorted(candidates, key=lambda item: os.path.basename(item[2]))[-1][2]
+
+def find_snap_orbit(granule, orbit_type='POEORB'):
+    # the orbit file of a granule in the orbit folder of SNAP, None if not found
+    mission, start, stop = granule_time_window(granule)
+    index = {}
+    for path in glob.glob(os.path.join(month_folder(snap_orbit_dir, orbit_type, mission, start), '*.EOF*')):
+        add_to_index(index, path)
+    return find_in_index(index, mission, orbit_type, start, stop)
+
+class OrbitCache(object):
+    def __init__(self, cache_dir=None, source=None, offline=False):
+        '''
+        :param cache_dir: the cache folder, the orbit folder of SNAP if None
+        :param source: a URL or a local mirror folder, default_source if None
+        :param offline: only use files in the cache and the local mirror
+        '''
+        self.cache_dir = snap_orbit_dir if cache_dir is None else os.path.abspath(cache_dir)
+        self.source = default_source if source is None else source
+        self.offline = offline
+        # (mission, orbit_type) -> a list of (valid_start, valid_stop, path)
+        self.index = {}
+        self._mirror_index = None
+        self._mirror_lock = threading.Lock()
+        self._listed = {}
+        self.scan_cache()
+
+    # -----------------------------------------------------------------------
+    def scan_cache(self):
+        self.index = {}
+        for path in glob.glob(os.path.join(self.cache_dir, '*', '*', '*', '*', '*.EOF*')):
+            add_to_index(self.index, path)
+        return sum([len(item) for item in self.index.values()])
+
+    def find_cached(self, granule, orbit_type='POEORB'):
+        mission, start, stop = granule_time_window(granule)
+        return find_in_index(self.index, mission, orbit_type, start, stop)
+
+    # -----------------------------------------------------------------------
+    # the source of orbit files
+    def _is_url(self):
+        return self.source.startswith('http://') or self.source.startswith('https://')
+
+    def _find_in_mirror(self, mission, orbit_type, start, stop):
+        # threads of prefetch_orbits wait until the index is complete
+        with self._mirror_lock:
+            if self._mirror_index is None:
+                mirror_index = {}
+                for dp, dn, fn in os.walk(self.source):
+                    for f in fn:
+                        add_to_index(mirror_index, os.path.join(dp, f))
+                self._mirror_index = mirror_index
+        return find_in_index(self._mirror_index, mission, orbit_type, start, stop)
+
+    def _list_url(self, orbit_type, mission, time):
+        import requests
+        url = '%s/%s/%s/%04d/%02d/' % (self.source.rstrip('/'), orbit_type, mission, time.year, time.month)
+        if url not in self._listed:
+            response = requests.get(url, timeout=60)
+            names = [] if response.status_code != 200 else \
+                sorted(set(re.findall(r'href="(S1[A-D]_OPER_AUX_[A-Z]+_OPOD_[^"/]+\.EOF(?:\.zip)?)"', response.text)))
+            self._listed[url] = [(name, url + name) for name in names]
+        return self._listed[url]
+
+    def _find_in_url(self, mission, orbit_type, start, stop):
+        index = {}
+        urls = {}
+        # a file valid for the acquisition starts in the same or the previous month
+        for time in [start - timedelta(days=1), start]:
+            for name, url in self._list_url(orbit_type, mission, time):
+                add_to_index(index, name)
+                urls[name] = url
+        name = find_in_index(index, mission, orbit_type, start, stop)
+        return None if name is None else urls[name]
+
+    def _copy_to_cache(self, src, mission, orbit_type, valid_start):
+        save_dir = month_folder(self.cache_dir, orbit_type, mission, valid_start)
+        save_path = os.path.join(save_dir, os.path.basename(src))
+        if not os.path.isdir(save_dir):
+            os.makedirs(save_dir, exist_ok=True)
+        # a lock file, several processes may prefetch the same orbit file.
+        # it is kept, removing it lets another process lock a new file while one holds the old one
+        with open(save_path + '.lock', 'w') as lock_obj:
+            fcntl.flock(lock_obj, fcntl.LOCK_EX)
+            if os.path.isfile(save_path) is False:
+                tmp_path = save_path + '.%d.tmp' % os.getpid()
+                if src.startswith('http://') or src.startswith('https://'):
+                    import requests
+                    with requests.get(src, stream=True, timeout=120) as response:
+                        response.raise_for_status()
+                        with open(tmp_path, 'wb') as f_obj:
+                            for chunk in response.iter_content(chunk_size=1024*1024):
+                                f_obj.write(chunk)
+                else:
+                    shutil.copyfile(src, tmp_path)
+                # readers never see a partial file
+                os.replace(tmp_path, save_path)
+                print(datetime.now(), 'saved orbit file %s' % save_path)
+        return save_path
+
+    def fetch(self, granule, orbit_types=('POEORB', 'RESORB')):
+        '''
+        get the orbit file of a granule, from the cache or the source
+        :param orbit_types: orbit types in the order of preference
+        :return: (orbit_type, path), or (None, None) if not available
+        '''
+        mission, start, stop = granule_time_window(granule)
+        for orbit_type in orbit_types:
+            path = find_in_index(self.index, mission, orbit_type, start, stop)
+            if path is not None:
+                return orbit_type, path
+            if self._is_url():
+                src = None if self.offline else self._find_in_url(mission, orbit_type, start, stop)
+            else:
+                src = self._find_in_mirror(mission, orbit_type, start, stop)
+            if src is not None:
+                valid_start = parse_orbit_name(src)[2]
+                path = self._copy_to_cache(src, mission, orbit_type, valid_start)
+                add_to_index(self.index, path)
+                return orbit_type, path
+        return None, None
+
+    def install(self, granule, path, orbit_type):
+        '''
+        make the orbit file visible to SNAP, which looks for it in the folder of the acquisition month
+        '''
+        mission, start, _ = granule_time_window(granule)
+        save_dir = month_folder(snap_orbit_dir, orbit_type, mission, start)
+        save_path = os.path.join(save_dir, os.path.basename(path))
+        if os.path.isfile(save_path):
+            return save_path
+        if not os.path.isdir(save_dir):
+            os.makedirs(save_dir, exist_ok=True)
+        tmp_path = save_path + '.%d.tmp' % os.getpid()
+        try:
+            os.link(path, tmp_path)
+        except OSError:
+            # on different file systems
+            shutil.copyfile(path, tmp_path)
+        os.replace(tmp_path, save_path)
+        return save_path
+
+def prefetch_orbits(granules, cache_dir=None, source=None, offline=False, threads=4, orbit_types=('POEORB', 'RESORB')):
+    '''
+    prefetch the orbit files of granules before processing them
+    :return: a dict, granule -> (orbit_type, path); (None, None) if not available
+    '''
+    cache = OrbitCache(cache_dir=cache_dir, source=source, offline=offline)
+
+    def fetch(granule):
+        try:
+            return cache.fetch(granule, orbit_types=orbit_types)
+        except Exception as e:
+            # e.g., the source is not reachable, SNAP will try to download it
+            print(datetime.now(), 'Warning, failed to get the orbit file of %s: %s' % (granule, str(e)))
+            return None, None
+
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        results = list(executor.map(fetch, granules))
+    orbits = {}
+    for granule, (orbit_type, path) in zip(granules, results):
+        if path is not None:
+            # in the folder of the acquisition month, may be different from the month of the validity start
+            path = cache.install(granule, path, orbit_type)
+        orbits[granule] = (orbit_type, path)
+    missing = [granule for granule, (_, path) in orbits.items() if path is None]
+    print(datetime.now(), 'orbit files of %d granules are in %s, %d missing' %
+          (len(granules) - len(missing), cache.cache_dir, len(missing)))
+    for granule in missing:
+        print('Warning, no orbit file for %s' % granule)
+    return orbits
+
+def main(options, args):
+    granules = [os.path.basename(item).split('.')[0] for item in args]
+    prefetch_orbits(granules, cache_dir=options.cache_dir, source=options.source, offline=options.offline,
+                    threads=options.threads)
+
+if __name__ == '__main__':
+    usage = "usage: %prog [options] grd_zip_or_granule ... "
+    parser = OptionParser(usage=usage, version="1.0 2026-10-18")
+    parser.description = 'Introduction: prefetch Sentinel-1 orbit files into a local cache'
+
+    parser.add_option("-c", "--cache_dir",
+                      action="store", dest="cache_dir",
+                      help="the cache folder, default is the orbit folder of SNAP")
+
+    parser.add_option("-s", "--source",
+                      action="store", dest="source",
+                      help="a URL or a local mirror folder, default is %s" % default_source)
+
+    parser.add_option("", "--offline",
+                      action="store_true", dest="offline", default=False,
+                      help="do not access the network")
+
+    parser.add_option("-t", "--threads",
+                      action="store", dest="threads", type=int, default=4,
+                      help="the number of threads for downloading")
+
+    (options, args) = parser.parse_args()
+    if len(sys.argv) < 2 or len(args) < 1:
+        parser.print_help()
+        sys.exit(2)
+
+    main(options, args)
@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+# Filename: proc_runner.py
+"""
+introduction: run external commands (gpt, gdal_translate, ...) from argument lists, no shell.
+              The output of a command is streamed line by line to a log file (not kept in memory),
+              a command running longer than its timeout is killed together with its child processes
+              (e.g., a hung JVM), and many commands can run concurrently under a semaphore.
+
+add time: 18 October, 2026
+"""
+
+import os
+import signal
+import asyncio
+import collections
+from datetime import datetime
+from subprocess import Popen, PIPE, STDOUT, DEVNULL
+
+import stage_metrics
+
+# the last lines of the output kept for the error message
+tail_line_count = 30
+# seconds between SIGTERM and SIGKILL
+kill_grace_seconds = 10
+
+class CommandError(Exception):
+    """
+    a command failed or timed out
+    """
+    def __init__(self, args, returncode, tail_lines, log_path=None, timed_out=False):
+        self.args_list = args
+        self.returncode = returncode
+        self.tail_lines = tail_lines
+        self.log_path = log_path
+        self.timed_out = timed_out
+        reason = 'timed out' if timed_out else 'exited with code %s' % str(returncode)
+        message = '%s %s' % (' '.join(args), reason)
+        if log_path is not None:
+            message += ', see %s' % log_path
+        super(CommandError, self).__init__(message)
+
+async def stream_lines(pipe, log_obj, tail_lines):
+    loop = asyncio.get_running_loop()
+    reader = asyncio.StreamReader(limit=2**20)
+    transport, _ = await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), pipe)
+    try:
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            line = line.decode(errors='replace')
+            tail_lines.append(line)
+            if log_obj is not None:
+                log_obj.write(line)
+                log_obj.flush()
+    finally:
+        transport.close()
+
+def kill_process_group(pid, sig):
+    try:
+        os.killpg(pid, sig)
+    except ProcessLookupError:
+        pass
+
+async def run_command_async(args, log_path=None, timeout=None, semaphore=None):
+    '''
+    run a command
+    :param args: the argument list
+    :param log_path: append the output (stdout and stderr) to this file, if None, only keep the last lines
+    :param timeout: seconds, kill the command if it runs longer
+    :param semaphore: an asyncio.Semaphore limiting the number of concurrent commands
+    :return: the argument list, raise CommandError if failed
+    '''
+    if semaphore is not None:
+        async with semaphore:
+            return await run_command_async(args, log_path=log_path, timeout=timeout)
+
+    loop = asyncio.get_running_loop()
+    tail_lines = collections.deque(maxlen=tail_line_count)
+    log_obj = None
+    if log_path is not None:
+        log_obj = open(log_path, 'a')
+        log_obj.write('# %s: %s\n' % (str(datetime.now()), ' '.join(args)))
+    try:
+        # a new session, so the command and its children can be killed as a group
+        ps = Popen(args, stdin=DEVNULL, stdout=PIPE, stderr=STDOUT, start_new_session=True)
+        read_task = asyncio.ensure_future(stream_lines(ps.stdout, log_obj, tail_lines))
+        # wait4 also returns the CPU time, peak RSS, and block I/O of the child process
+        wait_future = loop.run_in_executor(None, os.wait4, ps.pid, 0)
+        timed_out = False
+        try:
+            await asyncio.wait_for(asyncio.shield(wait_future), timeout)
+        except asyncio.TimeoutError:
+            timed_out = True
+            print(datetime.now(), 'Warning, %s ran more than %s seconds, killing it' % (args[0], str(timeout)))
+            kill_process_group(ps.pid, signal.SIGTERM)
+            try:
+                await asyncio.wait_for(asyncio.shield(wait_future), kill_grace_seconds)
+            except asyncio.TimeoutError:
+                kill_process_group(ps.pid, signal.SIGKILL)
+        _, status, rusage = await wait_future
+        ps.returncode = os.waitstatus_to_exitcode(status)
+        await read_task
+        stage_metrics.add_child_usage(rusage)
+    finally:
+        if log_obj is not None:
+            log_obj.close()
+
+    if timed_out or ps.returncode != 0:
+        raise CommandError(args, ps.returncode, list(tail_lines), log_path=log_path, timed_out=timed_out)
+    return args
+
+async def run_commands_async(commands, max_concurrent):
+    semaphore = asyncio.Semaphore(max_concurrent)
+    return await asyncio.gather(*[run_command_async(args, log_path=log_path, timeout=timeout, semaphore=semaphore)
+                                  for args, log_path, timeout in commands], return_exceptions=True)
+
+def run_command(args, log_path=None, timeout=None):
+    # run a command and wait for it, raise CommandError if failed
+    return asyncio.run(run_command_async(args, log_path=log_path, timeout=timeout))
+
+def run_commands(commands, max_concurrent=4):
+    '''
+    run commands concurrently
+    :param commands: a list of (args, log_path, timeout)
+    :return: raise the first CommandError after all commands finished
+    '''
+    results = asyncio.run(run_commands_async(commands, max_concurrent))
+    errors = [item for item in results if isinstance(item, BaseException)]
+    if len(errors) > 0:
+        raise errors[0]
+    return results
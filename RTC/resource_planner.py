@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+# Filename: resource_planner.py
+"""
+introduction: decide how many gpt jobs run at once, and the JVM heap (-J-Xmx), tile cache (-c),
+              and thread count (-q) of each job, from the cores and RAM of the host and the peak memory
+              of gpt recorded in earlier runs (stage metrics).
+
+add time: 18 October, 2026
+"""
+
+import os, sys
+from datetime import datetime
+from optparse import OptionParser
+
+import stage_metrics
+
+# stages running gpt
+gpt_stages = ['graph', 'orbit', 'border_noise', 'calibration', 'slice_assembly', 'subset', 'speckle',
+              'terrain_correction']
+
+# memory of a gpt job if there is no history, in bytes
+default_job_memory = {'graph': 8 * 1024**3, 'stages': 6 * 1024**3}
+min_heap = 2 * 1024**3
+# the JVM needs memory outside the heap (metaspace, threads, native buffers of GDAL readers, ...)
+heap_fraction = 0.75
+# the fraction of the heap used for the tile cache
+tile_cache_fraction = 0.6
+min_threads_per_job = 2
+
+def cpu_count():
+    # the cores this process can run on (e.g., limited by a batch scheduler)
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count()
+
+def total_memory():
+    # physical memory in bytes
+    return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+
+def past_peak_memory(metrics_path, process_mode='graph'):
+    '''
+    the peak RSS of gpt runs in earlier runs (90th percentile)
+    :return: bytes, or None if there is no history
+    '''
+    if metrics_path is None or os.path.isfile(metrics_path) is False:
+        return None
+    stages = ['graph'] if process_mode == 'graph' else [item for item in gpt_stages if item != 'graph']
+    peaks = [item['child_peak_rss_bytes'] for item in stage_metrics.read_records(metrics_path)
+             if item['stage'] in stages and item['status'] == 'success' and item['child_processes'] > 0]
+    if len(peaks) < 1:
+        return None
+    return stage_metrics.percentile(peaks, 90)
+
+def plan_resources(workers=0, process_mode='graph', metrics_path=None, reserved_memory=2 * 1024**3,
+                   cores=None, memory=None):
+    '''
+    plan gpt jobs for this host
+    :param workers: the number of jobs, 0 for deciding it from cores and memory
+    :param reserved_memory: memory kept for the system and other processes
+    :return: a dict of workers, threads, heap_bytes, tile_cache_bytes
+    '''
+    cores = cpu_count() if cores is None else cores
+    memory = total_memory() if memory is None else memory
+    usable = max(memory - reserved_memory, min_heap)
+
+    peak = past_peak_memory(metrics_path, process_mode=process_mode)
+    if peak is None:
+        job_memory = default_job_memory.get(process_mode, default_job_memory['stages'])
+    else:
+        # a margin for larger granules
+        job_memory = max(peak * 1.2, min_heap / heap_fraction)
+
+    if workers < 1:
+        workers = int(min(cores // min_threads_per_job, usable // job_memory))
+        workers = max(workers, 1)
+    # give all the memory to the jobs, more heap means fewer tiles written to disk
+    heap = int(usable / workers * heap_fraction)
+    if heap < min_heap:
+        print(datetime.now(), 'Warning, only %.1f GB heap for each of %d gpt jobs, may run out of memory' %
+              (heap / 1024**3, workers))
+    plan = {'workers': workers, 'threads': max(cores // workers, 1), 'heap_bytes': heap,
+            'tile_cache_bytes': int(heap * tile_cache_fraction),
+            'cores': cores, 'memory_bytes': memory, 'job_memory_bytes': int(job_memory),
+            'past_peak_bytes': peak}
+    return plan
+
+def gpt_options(plan):
+    # options of gpt, -c and -J-Xmx in MB
+    return '-q %d -c %dM -J-Xmx%dM ' % (plan['threads'], plan['tile_cache_bytes'] // 1024**2,
+                                         plan['heap_bytes'] // 1024**2)
+
+def print_plan(plan):
+    print(datetime.now(), 'host: %d cores, %.1f GB memory; gpt memory: %s' %
+          (plan['cores'], plan['memory_bytes'] / 1024**3,
+           'no history' if plan['past_peak_bytes'] is None else '%.1f GB peak' % (plan['past_peak_bytes'] / 1024**3)))
+    print(datetime.now(), 'plan: %d gpt jobs, each with %d threads, %.1f GB heap, %.1f GB tile cache' %
+          (plan['workers'], plan['threads'], plan['heap_bytes'] / 1024**3, plan['tile_cache_bytes'] / 1024**3))
+
+def main(options, args):
+    metrics_path = args[0] if len(args) > 0 else None
+    plan = plan_resources(workers=options.workers, process_mode=options.process_mode, metrics_path=metrics_path)
+    print_plan(plan)
+    print('gpt options: %s' % gpt_options(plan))
+
+if __name__ == '__main__':
+    usage = "usage: %prog [options] [rtc_metrics.jsonl] "
+    parser = OptionParser(usage=usage, version="1.0 2026-10-18")
+    parser.description = 'Introduction: plan the number of gpt jobs and the settings of each job for this host'
+
+    parser.add_option("-w", "--workers",
+                      action="store", dest="workers", type=int, default=0,
+                      help="the number of gpt jobs, 0 for deciding it from cores and memory")
+
+    parser.add_option("-m", "--process_mode",
+                      action="store", dest="process_mode", default='graph', choices=['graph', 'stages'],
+                      help="graph or stages")
+
+    (options, args) = parser.parse_args()
+    main(options, args)
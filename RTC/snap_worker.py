@@ -0,0 +1,195 @@
+#!/usr/bin/env python
+# Filename: snap_worker.py
+"""
+introduction: a long-lived SNAP worker, keeps one SNAP engine (esa_snappy or snappy) alive and runs gpt graphs
+              sent to it through stdin, so JVM and SNAP module startup are paid once for many granules.
+
+              The worker reads one JSON job per line from stdin, e.g., {"graph": "/path/to/graph.xml"},
+              and writes one result per line to stdout, starting with RESULT_MARKER.
+              Other output (SNAP messages, on stdout and stderr) goes to the log of the graph.
+              A graph running longer than its timeout is killed with the worker, a new worker is started
+              for the next graph.
+
+add time: 18 October, 2026
+"""
+
+import os, sys
+import json
+import time
+import signal
+import atexit
+import threading
+import collections
+import traceback
+from datetime import datetime
+from subprocess import Popen, PIPE, STDOUT
+
+import proc_runner
+
+RESULT_MARKER = 'SNAP_WORKER_RESULT '
+
+# python interpreter with esa_snappy or snappy installed, the current one by default
+snappy_python = sys.executable
+
+def write_result(result):
+    sys.stdout.write(RESULT_MARKER + json.dumps(result) + '\n')
+    sys.stdout.flush()
+
+def import_snappy():
+    try:
+        import esa_snappy as snappy  # SNAP 10 and later
+    except ImportError:
+        import snappy
+    return snappy
+
+def serve():
+    # inside the worker process
+    try:
+        snappy = import_snappy()
+        jpy = snappy.jpy
+        GPF = jpy.get_type('org.esa.snap.core.gpf.GPF')
+        GraphIO = jpy.get_type('org.esa.snap.core.gpf.graph.GraphIO')
+        GraphProcessor = jpy.get_type('org.esa.snap.core.gpf.graph.GraphProcessor')
+        FileReader = jpy.get_type('java.io.FileReader')
+        ProgressMonitor = jpy.get_type('com.bc.ceres.core.ProgressMonitor')
+        JAI = jpy.get_type('javax.media.jai.JAI')
+        System = jpy.get_type('java.lang.System')
+        GPF.getDefaultInstance().getOperatorSpiRegistry().loadOperatorSpis()
+    except Exception as e:
+        write_result({'ready': False, 'message': repr(e)})
+        return 1
+    write_result({'ready': True})
+
+    for line in sys.stdin:
+        line = line.strip()
+        if len(line) < 1:
+            continue
+        job = json.loads(line)
+        if job.get('cmd') == 'exit':
+            break
+        t0 = time.time()
+        try:
+            reader = FileReader(job['graph'])
+            try:
+                graph = GraphIO.read(reader)
+            finally:
+                reader.close()
+            GraphProcessor().executeGraph(graph, ProgressMonitor.NULL)
+            write_result({'ok': True, 'graph': job['graph'], 'seconds': time.time() - t0})
+        except Exception as e:
+            write_result({'ok': False, 'graph': job['graph'], 'seconds': time.time() - t0,
+                          'message': repr(e) + '\n' + traceback.format_exc()})
+        finally:
+            # release tiles and memory of the previous granule
+            JAI.getDefaultInstance().getTileCache().flush()
+            System.gc()
+    return 0
+
+class SNAPWorker(object):
+    """
+    the client side of a SNAP worker process
+    """
+    def __init__(self, python_bin=None):
+        if python_bin is None:
+            python_bin = snappy_python
+        # a new session, so the worker can be killed together with its children
+        self.process = Popen([python_bin, os.path.abspath(__file__)], stdin=PIPE, stdout=PIPE, stderr=STDOUT,
+                             universal_newlines=True, bufsize=1, start_new_session=True)
+        result = self._read_result()
+        if result is None or result.get('ready') is not True:
+            message = 'unknown' if result is None else result.get('message')
+            self.close()
+            raise RuntimeError('Failed to start the SNAP worker: %s' % message)
+
+    def _read_result(self, log_obj=None, tail_lines=None):
+        # the messages printed by SNAP are written to the log, or to stdout
+        for line in self.process.stdout:
+            if line.startswith(RESULT_MARKER):
+                return json.loads(line[len(RESULT_MARKER):])
+            if tail_lines is not None:
+                tail_lines.append(line)
+            if log_obj is not None:
+                log_obj.write(line)
+                log_obj.flush()
+            else:
+                sys.stdout.write(line)
+        return None
+
+    def kill(self):
+        proc_runner.kill_process_group(self.process.pid, signal.SIGKILL)
+
+    def is_alive(self):
+        return self.process.poll() is None
+
+    def run_graph(self, graph_xml, log_path=None, timeout=None):
+        '''
+        run a graph in the worker
+        :param log_path: append the output of SNAP to this file
+        :param timeout: seconds, kill the worker if the graph runs longer, raise proc_runner.CommandError
+        :return: seconds
+        '''
+        if self.is_alive() is False:
+            raise RuntimeError('the SNAP worker has exited with code %s' % str(self.process.returncode))
+        args = ['snap_worker', os.path.abspath(graph_xml)]
+        tail_lines = collections.deque(maxlen=proc_runner.tail_line_count)
+        log_obj = None
+        if log_path is not None:
+            log_obj = open(log_path, 'a')
+            log_obj.write('# %s: %s\n' % (str(datetime.now()), ' '.join(args)))
+        timer = None
+        timed_out = threading.Event()
+        if timeout is not None:
+            def kill_on_timeout():
+                timed_out.set()
+                print(datetime.now(), 'Warning, the SNAP worker ran %s more than %s seconds, killing it' %
+                      (os.path.basename(graph_xml), str(timeout)))
+                self.kill()
+            timer = threading.Timer(timeout, kill_on_timeout)
+            timer.start()
+        try:
+            self.process.stdin.write(json.dumps({'graph': os.path.abspath(graph_xml)}) + '\n')
+            self.process.stdin.flush()
+            result = self._read_result(log_obj=log_obj, tail_lines=tail_lines)
+        finally:
+            if timer is not None:
+                timer.cancel()
+            if log_obj is not None:
+                log_obj.close()
+        if timed_out.is_set():
+            # get_snap_worker starts a new worker for the next graph
+            self.process.wait()
+            raise proc_runner.CommandError(args, self.process.returncode, list(tail_lines), log_path=log_path,
+                                           timed_out=True)
+        if result is None:
+            raise RuntimeError('the SNAP worker exited while running %s' % graph_xml)
+        if result['ok'] is False:
+            if log_path is not None:
+                with open(log_path, 'a') as f_obj:
+                    f_obj.write(result['message'] + '\n')
+            raise RuntimeError('SNAP worker failed to run %s: %s' % (graph_xml, result['message']))
+        return result['seconds']
+
+    def close(self):
+        if self.is_alive():
+            try:
+                self.process.stdin.write(json.dumps({'cmd': 'exit'}) + '\n')
+                self.process.stdin.close()
+                self.process.wait(timeout=60)
+            except Exception:
+                self.process.kill()
+                self.process.wait()
+
+# one worker for each process (e.g., each worker of a process pool)
+_worker = None
+_worker_pid = None
+
+def get_snap_worker():
+    global _worker, _worker_pid
+    if _worker is None or _worker_pid != os.getpid() or _worker.is_alive() is False:
+        _worker = SNAPWorker()
+        _worker_pid = os.getpid()
+        atexit.register(_worker.close)
+    return _worker
+
+if __name__ == '__main__':
+    sys.exit(serve())
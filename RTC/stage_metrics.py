@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+# Filename: stage_metrics.py
+"""
+introduction: performance metrics of each stage of the RTC pipeline, written as JSON lines.
+
+              Each record contains the wall time, the CPU time, peak RSS, and block I/O of the child processes
+              (gpt, gdal_translate, ...) run during the stage, the input zip size and the output size.
+              Usage of child processes is read from os.wait4 in proc_runner.
+
+              python stage_metrics.py report rtc_metrics.jsonl
+              prints per-stage percentiles and granules/hour
+
+add time: 18 October, 2026
+"""
+
+import os, sys
+import json
+import time
+import fcntl
+import socket
+import threading
+from datetime import datetime
+from contextlib import contextmanager
+from optparse import OptionParser
+
+metrics_name = 'rtc_metrics.jsonl'
+
+# the JSON-lines file, metrics are not recorded if it is None
+metrics_path = None
+
+# records of the stages being measured in the current thread, the outer one is the whole granule
+_local = threading.local()
+
+def _record_stack():
+    if not hasattr(_local, 'stack'):
+        _local.stack = []
+    return _local.stack
+
+def maxrss_bytes(ru_maxrss):
+    # ru_maxrss is in kilobytes on Linux, in bytes on macOS
+    return ru_maxrss if sys.platform == 'darwin' else ru_maxrss * 1024
+
+def add_child_usage(rusage):
+    '''
+    add the resource usage of a finished child process to the stages being measured
+    :param rusage: resource usage returned by os.wait4
+    '''
+    for record in _record_stack():
+        record['child_cpu_seconds'] += rusage.ru_utime + rusage.ru_stime
+        record['child_peak_rss_bytes'] = max(record['child_peak_rss_bytes'], maxrss_bytes(rusage.ru_maxrss))
+        # block I/O, in 512-byte units
+        record['read_bytes'] += rusage.ru_inblock * 512
+        record['write_bytes'] += rusage.ru_oublock * 512
+        record['child_processes'] += 1
+
+def write_record(record):
+    if metrics_path is None:
+        return
+    # several worker processes may append to the same file
+    with open(metrics_path, 'a') as f_obj:
+        fcntl.flock(f_obj, fcntl.LOCK_EX)
+        f_obj.write(json.dumps(record) + '\n')
+        fcntl.flock(f_obj, fcntl.LOCK_UN)
+
+@contextmanager
+def measure(granule, stage, input_size=None):
+    '''
+    measure a stage, the caller can set record['output_size']
+    :param input_size: the size of input zip files, use the one of the outer stage if None
+    '''
+    stack = _record_stack()
+    if input_size is None and len(stack) > 0:
+        input_size = stack[-1]['input_size']
+    record = {'granule': granule, 'stage': stage, 'status': 'success', 'host': socket.gethostname(),
+              'pid': os.getpid(), 'start_time': str(datetime.now()), 'wall_seconds': 0.0,
+              'child_cpu_seconds': 0.0, 'child_peak_rss_bytes': 0, 'read_bytes': 0, 'write_bytes': 0,
+              'child_processes': 0, 'input_size': input_size, 'output_size': None}
+    stack.append(record)
+    t0 = time.time()
+    try:
+        yield record
+    except BaseException:
+        # also record the stages stopped by SystemExit or KeyboardInterrupt
+        record['status'] = 'failed'
+        raise
+    finally:
+        record['wall_seconds'] = time.time() - t0
+        stack.remove(record)
+        write_record(record)
+
+# ---------------------------------------------------------------------------
+# aggregate metrics
+def read_records(path):
+    records = []
+    with open(path) as f_obj:
+        for line in f_obj:
+            line = line.strip()
+            if len(line) > 0:
+                records.append(json.loads(line))
+    return records
+
+def percentile(values, q):
+    # linear interpolation between the closest ranks
+    values = sorted(values)
+    pos = (len(values) - 1) * q / 100.0
+    low = int(pos)
+    high = min(low + 1, len(values) - 1)
+    return values[low] + (values[high] - values[low]) * (pos - low)
+
+def granules_per_hour(records):
+    records = [item for item in records if item['stage'] == 'granule' and item['status'] == 'success']
+    if len(records) < 1:
+        return 0.0
+    start = min([datetime.fromisoformat(item['start_time']).timestamp() for item in records])
+    end = max([datetime.fromisoformat(item['start_time']).timestamp() + item['wall_seconds'] for item in records])
+    return len(records) * 3600.0 / max(end - start, 1e-6)
+
+def report(records, percentiles=(50, 90, 99)):
+    keys = [('wall_seconds', 1.0, 'wall(s)'), ('child_cpu_seconds', 1.0, 'cpu(s)'),
+            ('child_peak_rss_bytes', 1e9, 'rss(GB)'), ('read_bytes', 1e9, 'read(GB)'),
+            ('write_bytes', 1e9, 'write(GB)')]
+    stages = []
+    for record in records:
+        if record['stage'] not in stages:
+            stages.append(record['stage'])
+    print('%-20s %6s %6s ' % ('stage', 'count', 'failed') +
+          ' '.join(['%-26s' % ('%s p%s' % (name, '/p'.join([str(p) for p in percentiles]))) for _, _, name in keys]))
+    for stage in stages:
+        stage_records = [item for item in records if item['stage'] == stage]
+        ok_records = [item for item in stage_records if item['status'] == 'success']
+        line = '%-20s %6d %6d ' % (stage, len(ok_records), len(stage_records) - len(ok_records))
+        for key, scale, _ in keys:
+            if len(ok_records) < 1:
+                line += ' %-26s' % '-'
+                continue
+            values = [item[key] / scale for item in ok_records]
+            line += ' %-26s' % '/'.join(['%.2f' % percentile(values, p) for p in percentiles])
+        print(line)
+    print('granules/hour: %.2f' % granules_per_hour(records))
+
+def main(options, args):
+    if args[0] != 'report':
+        raise ValueError('unknown command: %s' % args[0])
+    path = args[1] if len(args) > 1 else metrics_name
+    records = read_records(path)
+    if options.stage_prefix is not None:
+        records = [item for item in records if item['stage'].startswith(options.stage_prefix)]
+    report(records)
+
+if __name__ == '__main__':
+    usage = "usage: %prog [options] report [rtc_metrics.jsonl] "
+    parser = OptionParser(usage=usage, version="1.0 2026-10-18")
+    parser.description = 'Introduction: aggregate performance metrics of the RTC pipeline'
+
+    parser.add_option("-s", "--stage_prefix",
+                      action="store", dest="stage_prefix",
+                      help="only report stages whose names start with this prefix")
+
+    (options, args) = parser.parse_args()
+    if len(sys.argv) < 2 or len(args) < 1:
+        parser.print_help()
+        sys.exit(2)
+
+    main(options, args)
@@ -19,6 +19,9 @@ from netrc import netrc
 from genTools import read_list_from_txt
 from genTools import read_dict_from_txt_json
 
+import download_tools
+import granule_store
+
 def get_user_password_netrc():
     # Set up authentication using .netrc file
     urs = 'urs.earthdata.nasa.gov'  # Address to call for authentication
@@ -34,7 +37,37 @@ def shapefile_to_ROIs_wkt(shp_path):
     ROIs_wkt = [str(p) for p in polygons ]
     return ROIs_wkt
 
-def download_data_from_asf_list(file_list_txt, save_dir, username, password):
+def download_products(results, download_dir, session, threads=4, store_dir=None, link_mode='hardlink'):
+    '''
+    download the files of search results in parallel, each file is resumed if interrupted,
+    and checked against its size and md5 in the search results
+    :param store_dir: the granule store, files not in it are downloaded into it, then linked to download_dir
+    :param link_mode: hardlink, symlink, or manifest, see granule_store.link_to_roi
+    :return: a list of files failed to download
+    '''
+    if store_dir is not None:
+        # files downloaded to the folder before using the store
+        for product in results:
+            path = os.path.join(download_dir, product.properties['fileName'])
+            if os.path.isfile(path) and os.path.islink(path) is False:
+                granule_store.move_to_store(path, store_dir)
+    file_dir = download_dir if store_dir is None else store_dir
+    if not os.path.isdir(file_dir):
+        os.makedirs(file_dir)
+    download_tools.mount_pool(session, pool_size=threads)
+    url_path_list = [(product.properties['url'], os.path.join(file_dir, product.properties['fileName']),
+                      product.properties.get('bytes'), product.properties.get('md5sum')) for product in results]
+    res = download_tools.download_files(session, url_path_list, threads=threads)
+    failed_files = [path for path, message in res.items() if message is not None]
+    for path in failed_files:
+        print('Failed: %s, %s' % (path, res[path]))
+    if store_dir is not None:
+        granule_store.link_to_roi([path for path, message in res.items() if message is None], download_dir,
+                                  link_mode=link_mode)
+    return failed_files
+
+def download_data_from_asf_list(file_list_txt, save_dir, username, password, threads=4, store_dir=None,
+                                link_mode='hardlink'):
     ## ROI
     print(datetime.now(),'Searching... ... ...')
 
@@ -53,7 +86,8 @@ def download_data_from_asf_list(file_list_txt, save_dir, username, password):
         os.makedirs(download_dir)
 
     # it will skip files that have been downloaded
-    results.download(path=download_dir, session=session)  # download results to a path
+    failed_files = download_products(results, download_dir, session, threads=threads, store_dir=store_dir,
+                                     link_mode=link_mode)
     print(datetime.now(),'Finished Download')
 
     ## Save results to an output log
@@ -66,11 +100,10 @@ def download_data_from_asf_list(file_list_txt, save_dir, username, password):
     print(results)
     sys.stdout.close()
     sys.stdout = stdoutOrigin
+    return failed_files
 
 
-def download_data_from_asf(idx,roi_count,roi_wkt, save_dir, start_date, end_date, processingLevel, username, password,
-                           beamMode='IW',platform=asf.PLATFORM.SENTINEL1 ):
-    ## ROI
+def search_data_from_asf(roi_wkt, start_date, end_date, processingLevel, beamMode='IW', platform=asf.PLATFORM.SENTINEL1):
     print(datetime.now(),'Searching... ... ...')
     if isinstance(platform, list):
         platform_list = platform
@@ -81,6 +114,13 @@ def download_data_from_asf(idx,roi_count,roi_wkt, save_dir, start_date, end_date
                              end=end_date,
                              beamMode=beamMode, processingLevel=processingLevel)
     print(datetime.now(),'Found %s results' % (len(results)))
+    return results
+
+def download_data_from_asf(idx,roi_count,roi_wkt, save_dir, start_date, end_date, processingLevel, username, password,
+                           beamMode='IW',platform=asf.PLATFORM.SENTINEL1, threads=4, store_dir=None,
+                           link_mode='hardlink'):
+    ## ROI
+    results = search_data_from_asf(roi_wkt, start_date, end_date, processingLevel, beamMode=beamMode, platform=platform)
     session = asf.ASFSession()
     session.auth_with_creds(username, password)
     print(datetime.now(),'Downloading... ... ...')
@@ -95,7 +135,8 @@ def download_data_from_asf(idx,roi_count,roi_wkt, save_dir, start_date, end_date
         os.makedirs(download_dir)
 
     # it will skip files that have been downloaded
-    results.download(path=download_dir, session=session)  # download results to a path
+    failed_files = download_products(results, download_dir, session, threads=threads, store_dir=store_dir,
+                                     link_mode=link_mode)
     print(datetime.now(),'Finished Download')
 
     ## Save results to an output log
@@ -108,6 +149,7 @@ def download_data_from_asf(idx,roi_count,roi_wkt, save_dir, start_date, end_date
     print(results)
     sys.stdout.close()
     sys.stdout = stdoutOrigin
+    return failed_files
 
 def main(options, args):
 
@@ -120,6 +162,9 @@ def main(options, args):
         end_date = input_dict['end_date']
         user_name = input_dict['username'] if 'username' in input_dict.keys() else None
         password = input_dict['password'] if 'password' in input_dict.keys() else None
+        threads = input_dict['download_threads'] if 'download_threads' in input_dict.keys() else 4
+        store_dir = input_dict['granule_store_dir'] if 'granule_store_dir' in input_dict.keys() else None
+        link_mode = input_dict['link_mode'] if 'link_mode' in input_dict.keys() else 'hardlink'
     else:
         extent_shp = args[0]
         save_dir = options.save_dir
@@ -127,6 +172,9 @@ def main(options, args):
         end_date = options.end_date
         user_name = options.username
         password = options.password
+        threads = options.threads
+        store_dir = options.store_dir
+        link_mode = options.link_mode
 
     assert os.path.isfile(extent_shp)
 
@@ -142,16 +190,26 @@ def main(options, args):
     if extent_shp.endswith('.txt'):
         print(datetime.now(), "the input is a TXT file")
         file_list_txt = extent_shp
-        download_data_from_asf_list(file_list_txt, save_dir, user_name, password)
+        failed_files = download_data_from_asf_list(file_list_txt, save_dir, user_name, password, threads=threads,
+                                                   store_dir=store_dir, link_mode=link_mode)
 
     else:
         # shapefile to  ROI
         ROIs_wkt = shapefile_to_ROIs_wkt(extent_shp)
+        # a granule covering several ROIs is downloaded once to the store, and linked to the folder of each ROI
+        if store_dir is None and len(ROIs_wkt) > 1:
+            store_dir = granule_store.default_store_dir(save_dir)
+        failed_files = []
         for idx, roi_wkt in enumerate(ROIs_wkt):
             # download data
-            download_data_from_asf(idx, len(ROIs_wkt), roi_wkt, save_dir, start_date, end_date, processingLevel, user_name,
-                                   password,
-                                   beamMode='IW', platform=asf.PLATFORM.SENTINEL1)
+            failed_files.extend(download_data_from_asf(idx, len(ROIs_wkt), roi_wkt, save_dir, start_date, end_date,
+                                                       processingLevel, user_name, password,
+                                                       beamMode='IW', platform=asf.PLATFORM.SENTINEL1, threads=threads,
+                                                       store_dir=store_dir, link_mode=link_mode))
+
+    if len(failed_files) > 0:
+        print(datetime.now(), '%d files failed to download, run it again to resume them' % len(failed_files))
+        sys.exit(1)
 
 
 
@@ -180,6 +238,18 @@ if __name__ == "__main__":
                       action="store", dest="password",
                       help="password for the earth data account")
 
+    parser.add_option("-t", "--threads",
+                      action="store", dest="threads", type=int, default=4,
+                      help="the number of files downloaded in parallel")
+
+    parser.add_option("", "--store_dir",
+                      action="store", dest="store_dir",
+                      help="the granule store, default is save_dir/%s if there are more than one ROI" % granule_store.store_folder)
+
+    parser.add_option("", "--link_mode",
+                      action="store", dest="link_mode", default='hardlink', choices=granule_store.link_modes,
+                      help="how files in the store appear in the folder of an ROI: hardlink, symlink, or manifest")
+
 
     (options, args) = parser.parse_args()
     if len(sys.argv) < 2 or len(args) < 1:
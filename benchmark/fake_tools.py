@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+# Filename: fake_tools.py
+"""
+introduction: stand-in gpt, gdal_translate, and gdalbuildvrt for benchmarks, they accept the command lines
+              written by RTC_v3, sleep for a configurable time, and write outputs of realistic sizes.
+
+              python fake_tools.py gpt graph.xml
+              python fake_tools.py gpt Operator -t target [-Pkey=value] [-Ssource=path] [source ...]
+              python fake_tools.py gdal_translate -of GTiff in.img out.tif
+              python fake_tools.py gdalbuildvrt [-separate] out.vrt in.img ...
+
+              settings (environment variables):
+              FAKE_GPT_STARTUP: seconds for starting gpt (JVM and SNAP modules), default 1.0
+              FAKE_GPT_OP_DELAY: seconds for each operator, default 0.5
+              FAKE_GDAL_DELAY: seconds for each gdal_translate or gdalbuildvrt run, default 0.2
+              FAKE_BAND_MB: the size of each band written by gpt in MB, default 10
+
+add time: 18 October, 2026
+"""
+
+import os, sys
+import time
+import shutil
+import xml.etree.ElementTree as ET
+
+def get_setting(name, default):
+    return float(os.getenv(name, default))
+
+def write_band(path, size_bytes, chunk_size=1024*1024):
+    # write zeros instead of seeking, so the disk space is really used
+    chunk = bytes(chunk_size)
+    with open(path, 'wb') as f_obj:
+        written = 0
+        while written < size_bytes:
+            count = min(chunk_size, size_bytes - written)
+            f_obj.write(chunk[:count])
+            written += count
+
+def write_dimap_product(target, bands):
+    # a BEAM-DIMAP product: target.dim and target.data containing ENVI rasters
+    dim_path = target if target.endswith('.dim') else target + '.dim'
+    data_dir = dim_path[:-4] + '.data'
+    if os.path.isdir(data_dir) is False:
+        os.makedirs(data_dir)
+    band_bytes = int(get_setting('FAKE_BAND_MB', 10) * 1024 * 1024)
+    for band in bands:
+        write_band(os.path.join(data_dir, band + '.img'), band_bytes)
+        with open(os.path.join(data_dir, band + '.hdr'), 'w') as f_obj:
+            f_obj.write('ENVI\ndescription = {%s}\n' % band)
+    with open(dim_path, 'w') as f_obj:
+        f_obj.write('<?xml version="1.0" encoding="ISO-8859-1"?>\n<Dimap_Document name="%s">\n' %
+                    os.path.basename(dim_path))
+        for band in bands:
+            f_obj.write('  <BAND_NAME>%s</BAND_NAME>\n' % band)
+        f_obj.write('</Dimap_Document>\n')
+    return dim_path
+
+def product_bands(target):
+    if target.endswith('_TC') or target.endswith('_TC.dim'):
+        return ['Sigma0_VV', 'Sigma0_VH', 'incidenceAngleFromEllipsoid']
+    return ['Sigma0_VV', 'Sigma0_VH']
+
+def check_inputs(paths):
+    for path in paths:
+        if os.path.exists(path) is False:
+            raise IOError('%s does not exist' % path)
+
+def fake_gpt(argv):
+    if len(argv) < 1:
+        raise ValueError('no operator or graph')
+    startup = get_setting('FAKE_GPT_STARTUP', 1.0)
+    op_delay = get_setting('FAKE_GPT_OP_DELAY', 0.5)
+    if argv[0].endswith('.xml'):
+        graph = ET.parse(argv[0]).getroot()
+        inputs, target, op_count = [], None, 0
+        for node in graph.findall('node'):
+            operator = node.find('operator').text
+            if operator == 'Read':
+                inputs.append(node.find('parameters/file').text)
+            elif operator == 'Write':
+                target = node.find('parameters/file').text
+            else:
+                op_count += 1
+    else:
+        op_count = 1
+        target = None
+        inputs = []
+        idx = 1
+        while idx < len(argv):
+            if argv[idx] == '-t':
+                target = argv[idx + 1]
+                idx += 1
+            elif argv[idx] in ['-q', '-c']:
+                # the thread count and tile cache size
+                idx += 1
+            elif argv[idx].startswith('-S'):
+                inputs.append(argv[idx].split('=', 1)[1])
+            elif argv[idx].startswith('-') is False:
+                inputs.append(argv[idx])
+            idx += 1
+    if target is None:
+        raise ValueError('no target product')
+    check_inputs(inputs)
+    time.sleep(startup + op_count * op_delay)
+    target = target[:-4] if target.endswith('.dim') else target
+    write_dimap_product(target, product_bands(target))
+
+def fake_gdal_translate(argv):
+    src, dst = argv[-2], argv[-1]
+    check_inputs([src])
+    time.sleep(get_setting('FAKE_GDAL_DELAY', 0.2))
+    shutil.copyfile(src, dst)
+
+def fake_gdalbuildvrt(argv):
+    paths = [item for item in argv if item.startswith('-') is False]
+    vrt_path, sources = paths[0], paths[1:]
+    check_inputs(sources)
+    time.sleep(get_setting('FAKE_GDAL_DELAY', 0.2))
+    with open(vrt_path, 'w') as f_obj:
+        f_obj.write('<VRTDataset>\n')
+        for source in sources:
+            f_obj.write('  <SourceFilename relativeToVRT="1">%s</SourceFilename>\n' % os.path.basename(source))
+        f_obj.write('</VRTDataset>\n')
+
+tools = {'gpt': fake_gpt, 'gdal_translate': fake_gdal_translate, 'gdalbuildvrt': fake_gdalbuildvrt}
+
+def main():
+    if len(sys.argv) < 2 or sys.argv[1] not in tools.keys():
+        print('usage: fake_tools.py %s [arguments]' % '|'.join(tools.keys()))
+        return 2
+    try:
+        tools[sys.argv[1]](sys.argv[2:])
+    except Exception as e:
+        print('Error: %s' % repr(e))
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
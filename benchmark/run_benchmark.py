@@ -0,0 +1,288 @@
+#!/usr/bin/env python
+# Filename: run_benchmark.py
+"""
+introduction: an offline benchmark of the GRD pre-processing pipeline, no SNAP or real scenes needed.
+              It generates synthetic GRD zip files, runs snap_GRD_process.GRD_file_preProcessing
+              (SNAP stages, Sigma0_FF_2_gtif or other exports, and clean_dirs) with stand-in gpt and GDAL tools,
+              then reports throughput, peak disk use, and per-stage overhead (wall time minus the simulated time
+              of the stand-in tools). Results are appended to a JSON-lines file keyed by git commit.
+
+              python run_benchmark.py run -n 8 -w 4
+              python run_benchmark.py compare [commit_a] [commit_b]
+
+add time: 18 October, 2026
+"""
+
+import os, sys
+import json
+import time
+import shutil
+import threading
+import subprocess
+from datetime import datetime
+from optparse import OptionParser
+
+bench_dir = os.path.dirname(os.path.abspath(__file__))
+repo_dir = os.path.dirname(bench_dir)
+sys.path.insert(0, repo_dir)
+sys.path.insert(0, bench_dir)
+
+import synthetic_grd
+
+# outside the work_dir, which is removed by each run, so results of different commits can be compared.
+# the file is ignored by git
+default_results = os.path.join(bench_dir, 'benchmark_results.jsonl')
+
+def folder_size(folder):
+    size = 0
+    for dp, dn, fn in os.walk(folder):
+        for f in fn:
+            try:
+                size += os.path.getsize(os.path.join(dp, f))
+            except OSError:
+                # the file has been moved or removed during walking
+                pass
+    return size
+
+class DiskMonitor(threading.Thread):
+    """
+    sample the size of folders in a background thread, and keep the peak
+    """
+    def __init__(self, folders, interval=0.2):
+        super(DiskMonitor, self).__init__(daemon=True)
+        self.folders = folders
+        self.interval = interval
+        self.peak_bytes = 0
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while self._stop_event.is_set() is False:
+            self.peak_bytes = max(self.peak_bytes, sum([folder_size(item) for item in self.folders]))
+            self._stop_event.wait(self.interval)
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+        return self.peak_bytes
+
+def git_commit():
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=repo_dir).decode().strip()
+        status = subprocess.check_output(['git', 'status', '--porcelain', '--untracked-files=no'],
+                                         cwd=repo_dir).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown', False
+    return commit, len(status) > 0
+
+def set_fake_tools(config):
+    # the stand-in tools read their settings from environment variables
+    os.environ['FAKE_GPT_STARTUP'] = str(config['gpt_startup'])
+    os.environ['FAKE_GPT_OP_DELAY'] = str(config['gpt_op_delay'])
+    os.environ['FAKE_GDAL_DELAY'] = str(config['gdal_delay'])
+    os.environ['FAKE_BAND_MB'] = str(config['band_mb'])
+    fake_tools = sys.executable + ' ' + os.path.join(bench_dir, 'fake_tools.py')
+    import RTC.RTC_v3 as RTC_v3
+    RTC_v3.baseSNAP = fake_tools + ' gpt'
+    RTC_v3.gdal_translate = fake_tools + ' gdal_translate'
+    RTC_v3.gdalbuildvrt = fake_tools + ' gdalbuildvrt'
+
+def simulated_seconds(stage, child_processes, config):
+    # the time the stand-in tools sleep in a stage
+    if stage == 'export' and config['export_format'] == 'gtiff':
+        # Sigma0_FF_2_gtif runs gdal_translate for the three bands at the same time
+        return -(-child_processes // 3) * config['gdal_delay']
+    if stage in ['export', 'cleanup']:
+        return child_processes * config['gdal_delay']
+    if stage == 'graph':
+        # orbit, border noise, calibration, speckle, and terrain correction
+        return child_processes * (config['gpt_startup'] + 5 * config['gpt_op_delay'])
+    if stage == 'granule':
+        return None
+    return child_processes * (config['gpt_startup'] + config['gpt_op_delay'])
+
+def stage_summary(records, config):
+    summary = {}
+    stages = []
+    for record in records:
+        if record['stage'] not in stages:
+            stages.append(record['stage'])
+    for stage in stages:
+        stage_records = [item for item in records if item['stage'] == stage and item['status'] == 'success']
+        if len(stage_records) < 1:
+            continue
+        count = len(stage_records)
+        mean_wall = sum([item['wall_seconds'] for item in stage_records]) / count
+        item = {'count': count, 'mean_wall': mean_wall}
+        simulated = [simulated_seconds(stage, record['child_processes'], config) for record in stage_records]
+        if None not in simulated:
+            item['mean_simulated'] = sum(simulated) / count
+            item['mean_overhead'] = mean_wall - item['mean_simulated']
+        summary[stage] = item
+    return summary
+
+def run_benchmark(options):
+    import snap_GRD_process
+    import RTC.RTC_v3 as RTC_v3
+    config = {'count': options.count, 'size_mb': options.size_mb, 'band_mb': options.band_mb,
+              'workers': options.workers, 'process_mode': options.process_mode,
+              'export_format': options.export_format, 'gpt_startup': options.gpt_startup,
+              'gpt_op_delay': options.gpt_op_delay, 'gdal_delay': options.gdal_delay}
+    work_dir = os.path.abspath(options.work_dir)
+    if os.path.isdir(work_dir):
+        shutil.rmtree(work_dir)
+    grd_dir = os.path.join(work_dir, 'grd')
+    temp_dir = os.path.join(work_dir, 'temp')
+    save_dir = os.path.join(work_dir, 'save')
+    for folder in [temp_dir, save_dir]:
+        os.makedirs(folder)
+    zip_list = synthetic_grd.make_synthetic_grd_list(grd_dir, options.count, size_mb=options.size_mb)
+    set_fake_tools(config)
+
+    monitor = DiskMonitor([temp_dir, save_dir])
+    monitor.start()
+    t0 = time.time()
+    results = snap_GRD_process.GRD_file_preProcessing(zip_list, temp_dir, save_dir, 10.0,
+                                                      process_mode=options.process_mode, workers=options.workers,
+                                                      export_opts={'export_format': options.export_format})
+    wall_seconds = time.time() - t0
+    peak_bytes = monitor.stop()
+
+    success = len([res for res in results if res[1] == 'success'])
+    metrics_path = os.path.join(save_dir, RTC_v3.stage_metrics.metrics_name)
+    records = RTC_v3.stage_metrics.read_records(metrics_path) if os.path.isfile(metrics_path) else []
+    commit, dirty = git_commit()
+    result = {'commit': commit, 'dirty': dirty, 'time': str(datetime.now()), 'config': config,
+              'success': success, 'failed': len(results) - success, 'wall_seconds': wall_seconds,
+              'granules_per_hour': success * 3600.0 / wall_seconds,
+              'input_mb_per_second': success * options.size_mb / wall_seconds,
+              'peak_disk_bytes': peak_bytes, 'stages': stage_summary(records, config)}
+    print_result(result)
+    with open(options.results, 'a') as f_obj:
+        f_obj.write(json.dumps(result) + '\n')
+    print(datetime.now(), 'saved the benchmark result to %s' % options.results)
+    if options.keep_work_dir is False:
+        shutil.rmtree(work_dir)
+    return result
+
+def print_result(result):
+    print('commit: %s%s, %s' % (result['commit'], ' (dirty)' if result['dirty'] else '', result['time']))
+    print('config: %s' % json.dumps(result['config'], sort_keys=True))
+    print('granules: %d success, %d failed, %.2f seconds' % (result['success'], result['failed'],
+                                                            result['wall_seconds']))
+    print('throughput: %.2f granules/hour, %.2f MB/s of input' % (result['granules_per_hour'],
+                                                                 result['input_mb_per_second']))
+    print('peak disk use: %.2f MB' % (result['peak_disk_bytes'] / 1024.0 / 1024.0))
+    print('%-20s %6s %10s %10s %10s' % ('stage', 'count', 'wall(s)', 'simulated', 'overhead'))
+    for stage, item in result['stages'].items():
+        if 'mean_overhead' in item:
+            print('%-20s %6d %10.3f %10.3f %10.3f' % (stage, item['count'], item['mean_wall'],
+                                                      item['mean_simulated'], item['mean_overhead']))
+        else:
+            print('%-20s %6d %10.3f %10s %10s' % (stage, item['count'], item['mean_wall'], '-', '-'))
+
+def read_results(path):
+    results = []
+    with open(path) as f_obj:
+        for line in f_obj:
+            if len(line.strip()) > 0:
+                results.append(json.loads(line))
+    return results
+
+def find_result(results, commit):
+    # the latest result of a commit
+    for result in reversed(results):
+        if result['commit'].startswith(commit) or commit.startswith(result['commit']):
+            return result
+    raise ValueError('no benchmark result of %s' % commit)
+
+def compare_results(options, args):
+    results = read_results(options.results)
+    if len(args) >= 2:
+        base, new = find_result(results, args[0]), find_result(results, args[1])
+    elif len(results) >= 2:
+        base, new = results[-2], results[-1]
+    else:
+        raise ValueError('need at least two benchmark results in %s' % options.results)
+    if base['config'] != new['config']:
+        print('Warning, the two runs used different settings, the comparison may be meaningless')
+
+    def change(a, b):
+        return '%+.1f%%' % ((b - a) * 100.0 / a) if a != 0 else '-'
+
+    print('%-24s %14s %14s %10s' % ('', base['commit'], new['commit'], 'change'))
+    for key, name in [('granules_per_hour', 'granules/hour'), ('wall_seconds', 'wall(s)'),
+                      ('peak_disk_bytes', 'peak disk(bytes)')]:
+        print('%-24s %14.2f %14.2f %10s' % (name, base[key], new[key], change(base[key], new[key])))
+    for stage in new['stages'].keys():
+        if stage not in base['stages'] or 'mean_overhead' not in new['stages'][stage]:
+            continue
+        a, b = base['stages'][stage]['mean_overhead'], new['stages'][stage]['mean_overhead']
+        print('%-24s %14.3f %14.3f %10s' % ('overhead(s) ' + stage, a, b, change(a, b)))
+
+def main(options, args):
+    if args[0] == 'run':
+        run_benchmark(options)
+    elif args[0] == 'compare':
+        compare_results(options, args[1:])
+    else:
+        raise ValueError('unknown command: %s' % args[0])
+
+if __name__ == '__main__':
+    usage = "usage: %prog [options] run | compare [commit_a commit_b] "
+    parser = OptionParser(usage=usage, version="1.0 2026-10-18")
+    parser.description = 'Introduction: benchmark the GRD pre-processing pipeline with synthetic inputs and stand-in tools'
+
+    parser.add_option("-n", "--count",
+                      action="store", dest="count", type=int, default=4,
+                      help="the number of synthetic GRD files")
+
+    parser.add_option("", "--size_mb",
+                      action="store", dest="size_mb", type=float, default=50.0,
+                      help="the size of each synthetic GRD file in MB")
+
+    parser.add_option("", "--band_mb",
+                      action="store", dest="band_mb", type=float, default=10.0,
+                      help="the size of each band written by the stand-in gpt in MB")
+
+    parser.add_option("-w", "--workers",
+                      action="store", dest="workers", type=int, default=1,
+                      help="the number of GRD files processed in parallel")
+
+    parser.add_option("-m", "--process_mode",
+                      action="store", dest="process_mode", default='graph', choices=['graph', 'stages'],
+                      help="graph or stages")
+
+    parser.add_option("-f", "--export_format",
+                      action="store", dest="export_format", default='gtiff', choices=['cog', 'gtiff', 'vrt'],
+                      help="the export format, cog needs rasterio")
+
+    parser.add_option("", "--gpt_startup",
+                      action="store", dest="gpt_startup", type=float, default=1.0,
+                      help="simulated seconds for starting gpt")
+
+    parser.add_option("", "--gpt_op_delay",
+                      action="store", dest="gpt_op_delay", type=float, default=0.5,
+                      help="simulated seconds for each SNAP operator")
+
+    parser.add_option("", "--gdal_delay",
+                      action="store", dest="gdal_delay", type=float, default=0.2,
+                      help="simulated seconds for each gdal_translate or gdalbuildvrt run")
+
+    parser.add_option("-o", "--work_dir",
+                      action="store", dest="work_dir", default='benchmark_work',
+                      help="the folder for synthetic inputs and outputs, removed before running")
+
+    parser.add_option("-k", "--keep_work_dir",
+                      action="store_true", dest="keep_work_dir", default=False,
+                      help="keep the work folder after running")
+
+    parser.add_option("-r", "--results",
+                      action="store", dest="results", default=default_results,
+                      help="the JSON-lines file of benchmark results, kept across runs (not in git)")
+
+    (options, args) = parser.parse_args()
+    if len(sys.argv) < 2 or len(args) < 1:
+        parser.print_help()
+        sys.exit(2)
+
+    main(options, args)
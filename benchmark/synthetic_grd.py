@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+# Filename: synthetic_grd.py
+"""
+introduction: generate synthetic Sentinel-1 GRD zip files for benchmarks, each contains a manifest.safe
+              (footprint, acquisition time, orbits, and polarisations) and fake measurement TIFFs.
+
+add time: 18 October, 2026
+"""
+
+import os, sys
+import zipfile
+from datetime import datetime, timedelta
+from optparse import OptionParser
+
+manifest_template = '''<?xml version="1.0" encoding="UTF-8"?>
+<xfdu:XFDU xmlns:xfdu="urn:ccsds:schema:xfdu:1" xmlns:gml="http://www.opengis.net/gml"
+  xmlns:safe="http://www.esa.int/safe/sentinel-1.0" xmlns:s1sarl1="http://www.esa.int/safe/sentinel-1.0/sentinel-1/sar/level-1">
+  <metadataSection>
+    <metadataObject ID="acquisitionPeriod">
+      <metadataWrap><xmlData><safe:acquisitionPeriod>
+        <safe:startTime>{start_time}</safe:startTime>
+        <safe:stopTime>{stop_time}</safe:stopTime>
+      </safe:acquisitionPeriod></xmlData></metadataWrap>
+    </metadataObject>
+    <metadataObject ID="measurementOrbitReference">
+      <metadataWrap><xmlData><safe:orbitReference>
+        <safe:orbitNumber type="start">{absolute_orbit}</safe:orbitNumber>
+        <safe:orbitNumber type="stop">{absolute_orbit}</safe:orbitNumber>
+        <safe:relativeOrbitNumber type="start">{relative_orbit}</safe:relativeOrbitNumber>
+        <safe:relativeOrbitNumber type="stop">{relative_orbit}</safe:relativeOrbitNumber>
+      </safe:orbitReference></xmlData></metadataWrap>
+    </metadataObject>
+    <metadataObject ID="generalProductInformation">
+      <metadataWrap><xmlData><s1sarl1:standAloneProductInformation>
+        <s1sarl1:transmitterReceiverPolarisation>VV</s1sarl1:transmitterReceiverPolarisation>
+        <s1sarl1:transmitterReceiverPolarisation>VH</s1sarl1:transmitterReceiverPolarisation>
+      </s1sarl1:standAloneProductInformation></xmlData></metadataWrap>
+    </metadataObject>
+    <metadataObject ID="measurementFrameSet">
+      <metadataWrap><xmlData><safe:frameSet><safe:frame><safe:footPrint>
+        <gml:coordinates>{coordinates}</gml:coordinates>
+      </safe:footPrint></safe:frame></safe:frameSet></xmlData></metadataWrap>
+    </metadataObject>
+  </metadataSection>
+</xfdu:XFDU>
+'''
+
+def granule_name(start, stop, absolute_orbit, datatake, unique_id):
+    return 'S1A_IW_GRDH_1SDV_%s_%s_%06d_%06X_%04X' % (start.strftime('%Y%m%dT%H%M%S'), stop.strftime('%Y%m%dT%H%M%S'),
+                                                     absolute_orbit, datatake, unique_id)
+
+def footprint_coordinates(lon, lat, width=2.5, height=2.0):
+    # lat,lon pairs as in manifest.safe
+    corners = [(lat, lon), (lat, lon + width), (lat + height, lon + width), (lat + height, lon), (lat, lon)]
+    return ' '.join(['%.6f,%.6f' % (y, x) for y, x in corners])
+
+def write_random_entry(zip_obj, arcname, size_bytes, chunk_size=1024*1024):
+    # random bytes are not compressible, so the zip file has the expected size
+    with zip_obj.open(arcname, 'w', force_zip64=True) as f_obj:
+        written = 0
+        while written < size_bytes:
+            chunk = os.urandom(min(chunk_size, size_bytes - written))
+            f_obj.write(chunk)
+            written += len(chunk)
+
+def make_synthetic_grd(save_dir, start, absolute_orbit, datatake, unique_id, lon, lat, size_mb=100.0,
+                       duration=25):
+    stop = start + timedelta(seconds=duration)
+    granule = granule_name(start, stop, absolute_orbit, datatake, unique_id)
+    zip_path = os.path.join(save_dir, granule + '.zip')
+    manifest = manifest_template.format(start_time=start.strftime('%Y-%m-%dT%H:%M:%S.000000'),
+                                        stop_time=stop.strftime('%Y-%m-%dT%H:%M:%S.000000'),
+                                        absolute_orbit=absolute_orbit, relative_orbit=(absolute_orbit - 73) % 175 + 1,
+                                        coordinates=footprint_coordinates(lon, lat))
+    band_bytes = int(size_mb * 1024 * 1024 / 2)
+    with zipfile.ZipFile(zip_path, 'w', compression=zipfile.ZIP_STORED) as zip_obj:
+        zip_obj.writestr(granule + '.SAFE/manifest.safe', manifest)
+        for pol in ['vv', 'vh']:
+            tiff_name = 's1a-iw-grd-%s-%s.tiff' % (pol, granule.lower().replace('_', '-'))
+            write_random_entry(zip_obj, granule + '.SAFE/measurement/' + tiff_name, band_bytes)
+    return zip_path
+
+def make_synthetic_grd_list(save_dir, count, size_mb=100.0, consecutive=False, lon=-95.0, lat=29.0):
+    '''
+    generate synthetic GRD zip files
+    :param consecutive: if True, the files are consecutive slices of the same pass, otherwise one pass per day
+    :return: the list of zip files
+    '''
+    if os.path.isdir(save_dir) is False:
+        os.makedirs(save_dir)
+    start = datetime(2019, 4, 1, 0, 5, 23)
+    zip_list = []
+    for idx in range(count):
+        if consecutive:
+            zip_path = make_synthetic_grd(save_dir, start + timedelta(seconds=25 * idx), 26600, 0x02FC4A, idx + 1,
+                                          lon, lat - 1.8 * idx, size_mb=size_mb)
+        else:
+            zip_path = make_synthetic_grd(save_dir, start + timedelta(days=idx), 26600 + 15 * idx, 0x02FC4A + idx,
+                                          idx + 1, lon + 0.1 * idx, lat, size_mb=size_mb)
+        zip_list.append(zip_path)
+    print(datetime.now(), 'generated %d synthetic GRD files (%.1f MB each) in %s' % (count, size_mb, save_dir))
+    return zip_list
+
+def main(options, args):
+    make_synthetic_grd_list(args[0], options.count, size_mb=options.size_mb, consecutive=options.consecutive)
+
+if __name__ == '__main__':
+    usage = "usage: %prog [options] save_dir "
+    parser = OptionParser(usage=usage, version="1.0 2026-10-18")
+    parser.description = 'Introduction: generate synthetic Sentinel-1 GRD zip files for benchmarks'
+
+    parser.add_option("-n", "--count",
+                      action="store", dest="count", type=int, default=4,
+                      help="the number of GRD files")
+
+    parser.add_option("", "--size_mb",
+                      action="store", dest="size_mb", type=float, default=100.0,
+                      help="the size of each GRD file in MB")
+
+    parser.add_option("", "--consecutive",
+                      action="store_true", dest="consecutive", default=False,
+                      help="generate consecutive slices of the same pass")
+
+    (options, args) = parser.parse_args()
+    if len(sys.argv) < 2 or len(args) < 1:
+        parser.print_help()
+        sys.exit(2)
+
+    main(options, args)
@@ -1,7 +1,10 @@
 #!/usr/bin/env python
-# Filename: download3DEP.py 
+# Filename: download3DEP.py
 """
-introduction:
+introduction: download 3DEP elevation using py3dep, for each polygon in a shapefile.
+              Each polygon is cached as a GeoTIFF named by a hash of its geometry and the resolution,
+              so repeat runs over the same areas (on any machine sharing the cache) do not download again.
+              The input shapefile is not changed.
 
 authors: Huang Lingcao
 email:huanglingcao@gmail.com
@@ -9,46 +12,76 @@ add time: 30 January, 2023
 """
 
 import os, sys
+import subprocess
+import hashlib
 from optparse import OptionParser
 from datetime import datetime
-import random
+from concurrent.futures import ThreadPoolExecutor
 
 import vector_tools
 
-def download_3DEP_cmd(extent_shp, save_path, cache_dir, resolution=10):
+def split_polygons(polygons):
+    # split multi-polygons, each part is downloaded and cached separately
+    parts = []
+    for poly in polygons:
+        parts.extend(list(poly.geoms) if hasattr(poly, 'geoms') else [poly])
+    return parts
+
+def geometry_cache_key(poly, resolution):
+    # the same for the same geometry (in EPSG:4326) and resolution, independent of the vertex order
+    import shapely
+    poly = shapely.normalize(shapely.set_precision(poly, 1e-7))
+    key = hashlib.sha1(shapely.to_wkb(poly) + ('%.3f' % float(resolution)).encode()).hexdigest()
+    return key[:20]
+
+def download_3DEP_polygon(poly, cache_dir, resolution=10):
+    '''
+    download the DEM of a polygon (lon, lat), skip it if cached
+    :return: the cached GeoTIFF
+    '''
+    save_path = os.path.join(cache_dir, '3dep_%s.tif' % geometry_cache_key(poly, resolution))
     if os.path.isfile(save_path):
-        print('%s already exist, skip downloading'%save_path)
-        return
-
-    # checking if 'id' and 'res' are in the shapefile
-    if vector_tools.is_field_name_in_shp(extent_shp,'id') is False:
-        add_att = {'id': random.randint(10, 1000000) }
-        vector_tools.add_attributes_to_shp(extent_shp,add_att)
-        print('Added id (%d) to %s'%(add_att['id'], extent_shp))
-    if vector_tools.is_field_name_in_shp(extent_shp, 'res') is False:
-        add_att = {'res': float(resolution)}
-        vector_tools.add_attributes_to_shp(extent_shp, add_att)
-        print('Added res (%f) to %s' % (add_att['res'], extent_shp))
-
-    polygons, attributes = vector_tools.read_polygons_attributes_list(extent_shp, ['id','res'])
-    if len(polygons) != 1:
-        raise ValueError('Currently, only support one polygon')
-
-    id = attributes[0][0]
-    dem_nc_file = os.path.join(cache_dir, '%d.nc'%id )
-
-    # using py3dep to download DEM
-    cmd_str = 'py3dep geometry %s  -l DEM -s %s'%(extent_shp,cache_dir)
-    res = os.system(cmd_str)
+        print(datetime.now(), 'cached: %s' % save_path)
+        return save_path
+    import py3dep
+    dem = py3dep.get_dem(poly, resolution, crs=4326)
+    # other processes may download the same polygon, the file is complete once it appears
+    tmp_path = save_path + '.%d.tmp.tif' % os.getpid()
+    dem.rio.to_raster(tmp_path, tiled=True, compress='DEFLATE')
+    os.replace(tmp_path, save_path)
+    print(datetime.now(), 'downloaded: %s' % save_path)
+    return save_path
+
+def mosaic_dem_files(dem_files, save_path):
+    # a VRT over the cached files, written as a tiled and compressed GeoTIFF
+    tmp_vrt = os.path.splitext(save_path)[0] + '.%d.tmp.vrt' % os.getpid()
+    res = subprocess.call(['gdalbuildvrt', tmp_vrt] + dem_files)
     if res != 0:
         sys.exit(res)
-
-    # convert to geotiff
-    # res = attributes[0][1]
-    cmd_str = 'gdal_translate %s %s'%(dem_nc_file,save_path)
-    res = os.system(cmd_str)
+    tmp_path = save_path + '.%d.tmp.tif' % os.getpid()
+    res = subprocess.call(['gdal_translate', '--config', 'GDAL_NUM_THREADS', 'ALL_CPUS', '-of', 'GTiff',
+                           '-co', 'TILED=YES', '-co', 'COMPRESS=DEFLATE', '-co', 'NUM_THREADS=ALL_CPUS',
+                           '-co', 'BIGTIFF=IF_SAFER', tmp_vrt, tmp_path])
+    os.remove(tmp_vrt)
     if res != 0:
         sys.exit(res)
+    os.replace(tmp_path, save_path)
+
+def download_3DEP(extent_shp, save_path, cache_dir, resolution=10, threads=4):
+    if os.path.isfile(save_path):
+        print('%s already exist, skip downloading'%save_path)
+        return
+
+    polygons = split_polygons(vector_tools.read_shape_gpd_to_NewPrj(extent_shp, 'EPSG:4326'))
+    if len(polygons) < 1:
+        raise ValueError('No extent polygons in %s' % extent_shp)
+    print(datetime.now(), 'download 3DEP for %d polygons using %d threads' % (len(polygons), threads))
+    # py3dep waits on the web service most of the time
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        dem_files = list(executor.map(lambda poly: download_3DEP_polygon(poly, cache_dir, resolution=resolution),
+                                      polygons))
+
+    mosaic_dem_files(sorted(set(dem_files)), save_path)
 
 
 def main(options, args):
@@ -73,7 +106,7 @@ def main(options, args):
     if os.path.isdir(cache_dir) is False:
         os.makedirs(cache_dir)
 
-    download_3DEP_cmd(extent_shp, save_path, cache_dir, resolution=res)
+    download_3DEP(extent_shp, save_path, cache_dir, resolution=res, threads=options.threads)
 
 
 
@@ -81,24 +114,28 @@ if __name__ == "__main__":
 
     usage = "usage: %prog [options] extent_shp "
     parser = OptionParser(usage=usage, version="1.0 2023-01-30")
-    parser.description = 'Introduction: download 3DEP elevation, in the extent_shp, should contain "id", and "res" '
+    parser.description = 'Introduction: download 3DEP elevation for the polygons in extent_shp '
 
     parser.add_option("-d", "--save_path",
                       action="store", dest="save_path",
                       help="the path for saving a DEM file")
 
     parser.add_option("-r", "--resolution",
-                      action="store", dest="resolution", default=10,
+                      action="store", dest="resolution", type=float, default=10,
                       help="the resolution for the saving DEM file")
 
     parser.add_option("-a", "--cache_dir",
                       action="store", dest="cache_dir",
                       help="the cache directory")
 
+    parser.add_option("-t", "--threads",
+                      action="store", dest="threads", type=int, default=4,
+                      help="the number of polygons downloaded in parallel")
+
 
     (options, args) = parser.parse_args()
     if len(sys.argv) < 2 or len(args) < 1:
         parser.print_help()
         sys.exit(2)
 
-    main(options, args)
\ No newline at end of file
+    main(options, args)
@@ -11,6 +11,7 @@ add time: 02 December, 2022
 """
 
 import os, sys
+import subprocess
 from optparse import OptionParser
 from datetime import datetime
 
@@ -21,8 +22,10 @@ import math
 # use ~/.netrc for user/password
 import os
 # import wget
-import requests
-from netrc import netrc
+from netrc import netrc, NetrcParseError
+import download_tools
+
+default_srtm_url = 'https://e4ftl01.cr.usgs.gov/MEASURES/SRTMGL1.003/2000.02.11/'
 
 def download_SRTM_cmd(extent_shp,save_path):
     cmd_str = "eio clip -o %s --reference %s"%(save_path,extent_shp)
@@ -41,115 +44,143 @@ def download_SRTM(extent_shp,save_path,cache_dir,b_clean=False):
     if b_clean:
         elevation.clean()
 
-def srtm_tiles_download(tile_list, cache_dir):
-    # download SRTM tiles:
-    # ref: https://github.com/ab-natcap/idb-scripts/blob/a1dcb89fe741ca1e737c59614e308ae49501ad08/srtm_download.py
-
-    # Set up authentication using .netrc file
+def earthdata_auth():
+    # user name and password in the ~/.netrc file, None if not found (e.g., a local mirror)
     urs = 'urs.earthdata.nasa.gov'  # Address to call for authentication
     netrcDir = os.path.expanduser("~/.netrc")
-    user = netrc(netrcDir).authenticators(urs)[0]
-    passwd = netrc(netrcDir).authenticators(urs)[2]
-
-    srtm_url = 'https://e4ftl01.cr.usgs.gov/MEASURES/SRTMGL1.003/2000.02.11/'
+    try:
+        auth = netrc(netrcDir).authenticators(urs)
+    except (FileNotFoundError, NetrcParseError):
+        return None
+    if auth is None:
+        return None
+    return auth[0], auth[2]
+
+def srtm_tiles_download(tile_list, cache_dir, srtm_url=None, threads=4):
+    # download SRTM tiles in parallel, tiles already in cache_dir are skipped if they are valid zip files
+    # ref: https://github.com/ab-natcap/idb-scripts/blob/a1dcb89fe741ca1e737c59614e308ae49501ad08/srtm_download.py
+    srtm_url = default_srtm_url if srtm_url is None else srtm_url
+    if srtm_url.endswith('/') is False:
+        srtm_url += '/'
+    session = download_tools.create_session(auth=earthdata_auth(), pool_size=threads)
+    url_path_list = [("{}{}".format(srtm_url, file), os.path.join(cache_dir, file)) for file in tile_list]
+    results = download_tools.download_files(session, url_path_list, threads=threads,
+                                            validate=download_tools.is_valid_zip)
     download_tiles = []
     for file in tile_list:
-        save_tile = os.path.join(cache_dir,file)
-        if os.path.isfile(save_tile):
-            print('%s already exist'%save_tile)
+        message = results[os.path.join(cache_dir, file)]
+        if message is None:
             download_tiles.append(file)
-            continue
-        file_url = "{}{}".format(srtm_url, file)
-        # wget.download(file_url, file)  # using requests instead (below)
-
-        print('Beginning file download with requests {}'.format(file_url))
-        # Create and submit request and download file
-        with requests.get(file_url, stream=True, auth=(user, passwd)) as response:
-            if response.status_code != 200:
-                print("{} not downloaded. The tile is not available OR your username and password is incorrect in {}".
-                      format(file,netrcDir))
-            else:
-                response.raw.decode_content = True
-                content = response.raw
-                with open(save_tile, 'wb') as d:
-                    while True:
-                        chunk = content.read(16 * 1024)
-                        if not chunk:
-                            break
-                        d.write(chunk)
-                print('Downloaded file: {}'.format(file))
-                download_tiles.append(file)
-
+        else:
+            # tiles over the ocean do not exist
+            print("{} not downloaded. The tile is not available OR your username and password is incorrect in "
+                  "~/.netrc: {}".format(file, message))
     return download_tiles
 
-def process_srtm_tiles(cache_dir, tile_list, save_path):
+def srtm_vsizip_path(cache_dir, tile):
+    # e.g., /vsizip//home/user/elevation/N15W086.SRTMGL1.hgt.zip/N15W086.hgt, read by GDAL without unzip
+    return '/vsizip/' + os.path.join(os.path.abspath(cache_dir), tile) + '/' + tile.split('.')[0] + '.hgt'
+
+def process_srtm_tiles(cache_dir, tile_list, save_path, nodata=-32768):
+    '''
+    mosaic SRTM tiles in zip files to a VRT, then to a tiled and compressed GeoTIFF if save_path is not a .vrt
+    '''
     if os.path.isfile(save_path):
         print('warning, %s exists, skip'%save_path)
         return False
-    # unpack
-    tile_paths = [os.path.join(cache_dir, item) for item in tile_list ]
-    curr_dir = os.getcwd()
-    os.chdir(cache_dir)
-    for tile in tile_paths:
-        if os.path.isfile(tile) is False:
-            print('warning, %s does not exist'%tile)
+    tile_paths = []
+    for tile in tile_list:
+        if os.path.isfile(os.path.join(cache_dir, tile)) is False:
+            print('warning, %s does not exist'%os.path.join(cache_dir, tile))
             continue
-        cmd_str = 'unzip %s'%tile
-        res = os.system(cmd_str)
-        if res != 0:
-            sys.exit(1)
-
-    # merge
-    cmd_str = 'gdal_merge.py -o %s -n -32768 -a_nodata -32768  *.hgt'%save_path
-
-    res = os.system(cmd_str)
+        tile_paths.append(srtm_vsizip_path(cache_dir, tile))
+    if len(tile_paths) < 1:
+        raise IOError('No SRTM tiles in %s' % cache_dir)
+
+    # only the listed tiles are used, other jobs can use the same cache at the same time
+    b_vrt = save_path.lower().endswith('.vrt')
+    tmp_vrt = os.path.splitext(save_path)[0] + '.%d.tmp.vrt' % os.getpid()
+    cmd_list = ['gdalbuildvrt', '-srcnodata', str(nodata), '-vrtnodata', str(nodata), tmp_vrt] + tile_paths
+    res = subprocess.call(cmd_list)
+    if res != 0:
+        sys.exit(1)
+    if b_vrt:
+        os.replace(tmp_vrt, save_path)
+        return True
+
+    # write the mosaic using all the cores
+    tmp_path = save_path + '.%d.tmp.tif' % os.getpid()
+    cmd_list = ['gdal_translate', '--config', 'GDAL_NUM_THREADS', 'ALL_CPUS', '-of', 'GTiff',
+                '-co', 'TILED=YES', '-co', 'COMPRESS=DEFLATE', '-co', 'PREDICTOR=2', '-co', 'NUM_THREADS=ALL_CPUS',
+                '-co', 'BIGTIFF=IF_SAFER', '-a_nodata', str(nodata), tmp_vrt, tmp_path]
+    res = subprocess.call(cmd_list)
+    os.remove(tmp_vrt)
     if res != 0:
         sys.exit(1)
+    os.replace(tmp_path, save_path)
+    return True
 
-    os.system('rm *.hgt')
-    os.chdir(curr_dir)
 
+def srtm_tile_name(lat, lon):
+    # the tile whose lower-left corner is (lon, lat), e.g., N15W086.SRTMGL1.hgt.zip, N00E000 for (0, 0)
+    lat_str = ('N' if lat >= 0 else 'S') + str(abs(lat)).zfill(2)
+    lon_str = ('E' if lon >= 0 else 'W') + str(abs(lon)).zfill(3)
+    return lat_str + lon_str + '.SRTMGL1.hgt.zip'
 
 def extent_to_1degree_tiles(poly):
+    '''
+    the 1 by 1 degree tiles overlapping a polygon (lon, lat), not all the tiles in its bounding box
+    '''
+    import numpy as np
+    import shapely
     minx, miny, maxx, maxy = poly.bounds  # (minx, miny, maxx, maxy)
-    x_list = [ item for item in range(math.floor(minx), math.ceil(maxx)) ]
-    y_list = [ item for item in range(math.floor(miny), math.ceil(maxy)) ]
-    # N15W086.SRTMGL1.hgt.zip
-    tiles = []
-    for y in y_list:
-        lat_str = str(abs(y)).zfill(2)
-        lat_str = 'N'+ lat_str if y > 0 else 'S'+lat_str
-        for x in x_list:
-            lon_str = str(abs(x)).zfill(3)
-            lon_str = 'E' + lon_str if x > 0 else 'W' + lon_str
-            tiles.append(lat_str+lon_str+'.SRTMGL1.hgt.zip')
-    return tiles
-
-
-
-def download_SRTM_url(extent_shp, save_path,cache_dir):
+    x_list = np.arange(math.floor(minx), max(math.ceil(maxx), math.floor(minx) + 1))
+    y_list = np.arange(math.floor(miny), max(math.ceil(maxy), math.floor(miny) + 1))
+    xs, ys = np.meshgrid(x_list, y_list)
+    xs, ys = xs.ravel(), ys.ravel()
+    cells = shapely.box(xs, ys, xs + 1, ys + 1)
+    shapely.prepare(poly)
+    # tiles only sharing an edge or a corner with the polygon are not needed
+    b_overlap = shapely.intersects(cells, poly) & ~shapely.touches(cells, poly)
+    return [srtm_tile_name(int(y), int(x)) for x, y in zip(xs[b_overlap], ys[b_overlap])]
+
+def download_SRTM_url(extent_shp, save_path,cache_dir, srtm_url=None, threads=4, per_polygon=False):
     '''
     Download SRTM 30m elevation tiles from URL
     :param extent_shp: shapefile
     :param save_path: output path
     :param cache_dir:
-    :return:
+    :param srtm_url: the URL of the SRTM tiles, default_srtm_url if None
+    :param threads: the number of parallel downloads
+    :param per_polygon: if True, save a mosaic for each polygon (save_path with _0, _1, ...), otherwise one mosaic
+    :return: the list of saved mosaics
     '''
     # shapefile to 1 by 1 degrees.
     ext_polys = vector_tools.read_shape_gpd_to_NewPrj(extent_shp,'EPSG:4326')
-    if len(ext_polys) == 1:
-        # create file names
-        tiles = extent_to_1degree_tiles(ext_polys[0])
-        download_tiles = srtm_tiles_download(tiles,cache_dir)
-        if len(download_tiles) > 0:
-            process_srtm_tiles(cache_dir, download_tiles, save_path)
-        else:
-            print('error, NO downloaded SRTM tiles')
-    elif len(ext_polys) > 1:
-        raise ValueError('currently, only support one polygon')
-        pass
-    else:
+    if len(ext_polys) < 1:
         raise ValueError('No extent polygons in %s'%extent_shp)
+    # create file names, a tile is downloaded once even if it overlaps several polygons
+    poly_tiles = [extent_to_1degree_tiles(poly) for poly in ext_polys]
+    tiles = sorted(set([tile for tile_list in poly_tiles for tile in tile_list]))
+    print(datetime.now(), '%d polygons overlap %d SRTM tiles' % (len(ext_polys), len(tiles)))
+    download_tiles = srtm_tiles_download(tiles,cache_dir, srtm_url=srtm_url, threads=threads)
+    if len(download_tiles) < 1:
+        print('error, NO downloaded SRTM tiles')
+        return []
+    if per_polygon is False or len(ext_polys) == 1:
+        process_srtm_tiles(cache_dir, download_tiles, save_path)
+        return [save_path]
+    save_paths = []
+    base, ext = os.path.splitext(save_path)
+    for idx, tile_list in enumerate(poly_tiles):
+        tile_list = [tile for tile in tile_list if tile in download_tiles]
+        if len(tile_list) < 1:
+            print('warning, NO downloaded SRTM tiles for polygon %d' % idx)
+            continue
+        poly_save_path = base + '_%d' % idx + ext
+        process_srtm_tiles(cache_dir, tile_list, poly_save_path)
+        save_paths.append(poly_save_path)
+    return save_paths
 
 def main(options, args):
     extent_shp = args[0]
@@ -177,7 +208,8 @@ def main(options, args):
 
     # download_SRTM_cmd(extent_shp,save_path)
     # download_SRTM(extent_shp, save_path,cache_dir,b_clean=b_clean)
-    download_SRTM_url(extent_shp, save_path, cache_dir)
+    download_SRTM_url(extent_shp, save_path, cache_dir, srtm_url=options.srtm_url, threads=options.threads,
+                      per_polygon=options.per_polygon)
 
 if __name__ == "__main__":
 
@@ -187,12 +219,24 @@ if __name__ == "__main__":
 
     parser.add_option("-d", "--save_path",
                       action="store", dest="save_path",
-                      help="the path for saving a DEM file")
+                      help="the path for saving a DEM file, a GeoTIFF, or a VRT pointing to the cached tiles if it ends with .vrt")
 
     parser.add_option("-a", "--cache_dir",
                       action="store", dest="cache_dir",
                       help="the cache directory")
 
+    parser.add_option("-u", "--srtm_url",
+                      action="store", dest="srtm_url", default=default_srtm_url,
+                      help="the URL of SRTM tiles, e.g., a local mirror")
+
+    parser.add_option("-t", "--threads",
+                      action="store", dest="threads", type=int, default=4,
+                      help="the number of parallel downloads")
+
+    parser.add_option("-p", "--per_polygon",
+                      action="store_true", dest="per_polygon", default=False,
+                      help="save a DEM for each polygon in extent_shp, instead of one DEM covering all polygons")
+
     parser.add_option("-c", "--clean",
                       action="store_true", dest="clean", default=False,
                       help="clean up stale temporary files and fix the cache in the event of a server error")
@@ -6,6 +6,11 @@ introduction: download daily mean gage height observations from  NWIS: https://n
 
              Gage height, feet (Mean)
 
+             Sites are requested in chunks (groups of sites, for a calendar month) concurrently.
+             Past months (after their daily values are published) are cached per site in cache_dir,
+             so a re-run only downloads the months not cached,
+             and the HTTP responses are cached by HyRiver in the same folder.
+
 authors: Huang Lingcao
 email:huanglingcao@gmail.com
 add time: 31 January, 2023
@@ -13,7 +18,8 @@ add time: 31 January, 2023
 
 import os, sys
 from optparse import OptionParser
-from datetime import datetime
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
 
 import genTools
 import vector_tools
@@ -40,48 +46,148 @@ def test_download_one_site():
 
 
 
-def download_gage_height(extent_shp, save_path, cache_dir, dates_str=("2017-08-16", "2017-09-13")):
-    ext_polys = vector_tools.read_shape_gpd_to_NewPrj(extent_shp,'EPSG:4326')
-    if len(ext_polys) != 1:
-        raise ValueError('currently, only support one polygon')
-    bounds = [item.bounds for item in ext_polys][0]
-    # minx, miny, maxx, maxy = poly.bounds
-    # bounds = (-95.00715306114322, 30.0368774601673, -94.42042753827869, 30.454254427946868)
-    print(bounds)
-
+# stations requested together in one NWIS query
+sites_per_request = 20
+# daily values of a day are published a few days later, a month is cached after its last day plus this lag
+publication_lag = timedelta(days=5)
+
+def month_ranges(start_date, end_date):
+    # split a date range into calendar months, a list of (month_start, month_end) in datetime
+    months = []
+    month_start = datetime(start_date.year, start_date.month, 1)
+    while month_start <= end_date:
+        next_month = datetime(month_start.year + month_start.month // 12, month_start.month % 12 + 1, 1)
+        months.append((month_start, next_month - timedelta(days=1)))
+        month_start = next_month
+    return months
+
+def month_cache_path(cache_dir, site_no, month_start):
+    return os.path.join(cache_dir, 'gage_height', site_no, month_start.strftime('%Y-%m') + '.parquet')
+
+def site_columns(gageHeight, site_no):
+    # columns are named by the site code, e.g., USGS-08068720
+    return [item for item in gageHeight.columns if str(item) in ['USGS-' + site_no, site_no]]
+
+def download_month(nwis, site_list, month_start, month_end, cache_dir):
+    '''
+    download gage height of sites in a month, and cache the months whose daily values have been published
+    (they will not change)
+    :return: a dict, site_no -> dataframe (empty if no data), and None or the error message if failed
+    '''
+    from pygeohydro.exceptions import ZeroMatchedError
+    dates_str = (month_start.strftime('%Y-%m-%d'), min(month_end, datetime.now()).strftime('%Y-%m-%d'))
+    try:
+        # gageHeight is a dateframe, a column for each site
+        gageHeight = nwis.get_gageheight(site_list, dates_str)
+    except ZeroMatchedError:
+        # none of the sites have data in this month
+        gageHeight = pd.DataFrame()
+    except Exception as e:
+        # e.g., timeout or server errors, not cached, so the next run requests it again
+        message = str(e)
+        print(datetime.now(), 'Warning, failed to get gage height of %d sites in %s: %s' %
+              (len(site_list), month_start.strftime('%Y-%m'), message))
+        return {}, message
+    site_tables = {}
+    for site_no in site_list:
+        site_tables[site_no] = gageHeight[site_columns(gageHeight, site_no)]
+        if month_end + timedelta(days=1) + publication_lag <= datetime.now():
+            save_path = month_cache_path(cache_dir, site_no, month_start)
+            if os.path.isdir(os.path.dirname(save_path)) is False:
+                os.makedirs(os.path.dirname(save_path), exist_ok=True)
+            tmp_path = save_path + '.%d.tmp' % os.getpid()
+            site_tables[site_no].to_parquet(tmp_path)
+            os.replace(tmp_path, save_path)
+    return site_tables, None
+
+def get_gage_height_cached(site_list, dates, cache_dir, threads=8):
+    '''
+    get daily mean gage height of sites, only download the months not in the cache
+    :param dates: (start, end) in datetime
+    :return: a dataframe, a column for each site, and a list of (site_list, month_start) failed to download
+    '''
     from pygeohydro import NWIS
+    nwis = NWIS()
 
+    tables = []
+    chunk_list = []
+    for month_start, month_end in month_ranges(dates[0], dates[1]):
+        missing = []
+        for site_no in site_list:
+            cache_path = month_cache_path(cache_dir, site_no, month_start)
+            if os.path.isfile(cache_path):
+                tables.append(pd.read_parquet(cache_path))
+            else:
+                missing.append(site_no)
+        for idx in range(0, len(missing), sites_per_request):
+            chunk_list.append((missing[idx: idx + sites_per_request], month_start, month_end))
+    print(datetime.now(), '%d cached site-months, %d requests to NWIS' % (len(tables), len(chunk_list)))
+
+    # the requests wait on the web service most of the time
+    failed_chunks = []
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        futures = [executor.submit(download_month, nwis, sites, month_start, month_end, cache_dir)
+                   for sites, month_start, month_end in chunk_list]
+        for (sites, month_start, _), future in zip(chunk_list, futures):
+            site_tables, message = future.result()
+            if message is not None:
+                failed_chunks.append((sites, month_start))
+            tables.extend(site_tables.values())
+
+    tables = [item for item in tables if len(item.columns) > 0]
+    if len(tables) < 1:
+        return pd.DataFrame(), failed_chunks
+    # months of a site are rows, sites are columns
+    gageHeight = pd.concat(tables, axis=0).groupby(level=0).first().sort_index()
+    # cached months may be outside of the dates
+    days = gageHeight.index if gageHeight.index.tz is None else gageHeight.index.tz_localize(None)
+    return gageHeight[(days >= dates[0]) & (days < dates[1] + timedelta(days=1))], failed_chunks
+
+def get_site_info(ext_polys):
+    # sites with daily values in the polygons, a site in several polygons is kept once
+    from pygeohydro import NWIS
     nwis = NWIS()
-    # codes = nwis.get_parameter_codes("%gage%")
-    # save_xlsx_table(codes,'gage_codes.xlsx')
-
-    query = {
-        "bBox": ",".join(f"{b:.06f}" for b in bounds),
-        "hasDataTypeCd": "dv",
-        "outputDataTypeCd": "dv",
-    }
-    #  info_box is GeoDataframe
-    info_box = nwis.get_info(query)
-    # print(info_box)
-
-    site_file = os.path.splitext(os.path.basename(save_path))[0] +'_info_box.gpkg'
+    info_list = []
+    for poly in ext_polys:
+        # minx, miny, maxx, maxy = poly.bounds
+        query = {
+            "bBox": ",".join(f"{b:.06f}" for b in poly.bounds),
+            "hasDataTypeCd": "dv",
+            "outputDataTypeCd": "dv",
+        }
+        #  info_box is GeoDataframe
+        info_box = nwis.get_info(query)
+        info_list.append(info_box[info_box.to_crs('EPSG:4326').intersects(poly)])
+    info = pd.concat(info_list)
+    return info.drop_duplicates(subset=['site_no'])
+
+def download_gage_height(extent_shp, save_path, cache_dir, dates_str=("2017-08-16", "2017-09-13"), threads=8):
+    ext_polys = vector_tools.read_shape_gpd_to_NewPrj(extent_shp,'EPSG:4326')
+    if len(ext_polys) < 1:
+        raise ValueError('No extent polygons in %s' % extent_shp)
+    print(datetime.now(), 'find NWIS sites in %d polygons' % len(ext_polys))
+    info_box = get_site_info(ext_polys)
+
+    site_file = os.path.splitext(save_path)[0] +'_info_box.gpkg'
     info_box.to_file(site_file, driver='GPKG')
     print('save site locations to %s'%site_file)
 
     dates = tuple([datetime.strptime(item, '%Y-%m-%d') for item in dates_str])
 
-    stations = info_box[(info_box.begin_date <= dates[0]) & (info_box.end_date >= dates[1])].site_no.tolist()
+    stations = sorted(set(info_box[(info_box.begin_date <= dates[0]) & (info_box.end_date >= dates[1])].site_no.tolist()))
+    print(datetime.now(), 'get gage height of %d sites from %s to %s' % (len(stations), dates_str[0], dates_str[1]))
 
-    # gageHeight is a dateframe
-    gageHeight = nwis.get_gageheight(stations, dates_str)
-    # print(qobs.attrs)
+    gageHeight, failed_chunks = get_gage_height_cached(stations, dates, cache_dir, threads=threads)
+    for sites, month_start in failed_chunks:
+        print('Warning, missing gage height of %s in %s' % (','.join(sites), month_start.strftime('%Y-%m')))
     gageHeight.reset_index(inplace=True)
-    # for key in qobs.keys():
-    #     print(key)
-    # print(qobs)
     gageHeight['index'] = gageHeight['index'].astype(str)
-    # plot.signatures(qobs)
-    save_xlsx_table(gageHeight,save_path)
+    if save_path.endswith('.xlsx'):
+        save_xlsx_table(gageHeight,save_path)
+    else:
+        gageHeight.to_parquet(save_path)
+        print('save table to %s' % save_path)
+    return failed_chunks
 
 
 
@@ -94,7 +200,7 @@ def main(options, args):
 
     if save_path is None:
         file_name = os.path.splitext(os.path.basename(extent_shp))[0]
-        save_path = os.path.join(os.getcwd(), file_name + '_hydro.xlsx')
+        save_path = os.path.join(os.getcwd(), file_name + '_hydro.parquet')
     else:
         save_path = os.path.abspath(save_path)
 
@@ -110,9 +216,15 @@ def main(options, args):
         cache_dir = os.path.expanduser('~/hydro')
     if os.path.isdir(cache_dir) is False:
         os.makedirs(cache_dir)
+    # the HTTP response cache of HyRiver (pygeohydro), read when pygeohydro is imported
+    os.environ['HYRIVER_CACHE_NAME'] = os.path.join(os.path.abspath(cache_dir), 'aiohttp_cache.sqlite')
 
     # test_download_one_site()
-    download_gage_height(extent_shp, save_path, cache_dir, dates_str=(start_date, end_date))
+    failed_chunks = download_gage_height(extent_shp, save_path, cache_dir, dates_str=(start_date, end_date),
+                                         threads=options.threads)
+    if len(failed_chunks) > 0:
+        # the failed months are not cached, run it again to download them
+        sys.exit(1)
 
 
 
@@ -124,7 +236,7 @@ if __name__ == "__main__":
 
     parser.add_option("-d", "--save_path",
                       action="store", dest="save_path",
-                      help="the path for saving a DEM file")
+                      help="the path for saving the table, Parquet, or Excel if it ends with .xlsx")
 
     parser.add_option("-s", "--start_date",default="2017-08-16",
                       action="store", dest="start_date",
@@ -138,6 +250,10 @@ if __name__ == "__main__":
                       action="store", dest="cache_dir",
                       help="the cache directory")
 
+    parser.add_option("-t", "--threads",
+                      action="store", dest="threads", type=int, default=8,
+                      help="the number of concurrent requests to NWIS")
+
     (options, args) = parser.parse_args()
     if len(sys.argv) < 2 or len(args) < 1:
         parser.print_help()
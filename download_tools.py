@@ -0,0 +1,171 @@
+#!/usr/bin/env python
+# Filename: download_tools.py
+"""
+introduction: download files over HTTP(S) in parallel, with a shared (authenticated) session.
+              A file is written to <save_path>.partial, an interrupted download is resumed with a Range request,
+              failed requests are retried with exponential backoff, and the file is renamed to its final path
+              only after its size, md5, or content are validated, so a truncated file is never taken as a complete one.
+              The throughput of each file and of all files is printed.
+
+add time: 18 October, 2026
+"""
+
+import os
+import time
+import hashlib
+import zipfile
+import threading
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+chunk_size = 1024 * 1024
+# retries of a file, waiting backoff_seconds * 2^n between them
+max_retries = 5
+backoff_seconds = 2.0
+# HTTP status codes worth retrying
+retry_status_codes = [408, 429, 500, 502, 503, 504]
+part_suffix = '.partial'
+
+def mount_pool(session, pool_size=8):
+    # keep a connection for each thread, the default pool of requests only keeps 10
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+def create_session(auth=None, pool_size=8):
+    # a session reused by all threads, keeping connections (and cookies of the login) alive
+    session = requests.Session()
+    session.auth = auth
+    return mount_pool(session, pool_size=pool_size)
+
+def file_md5(path):
+    md5 = hashlib.md5()
+    with open(path, 'rb') as f_obj:
+        for chunk in iter(lambda: f_obj.read(chunk_size), b''):
+            md5.update(chunk)
+    return md5.hexdigest()
+
+def is_valid_zip(path):
+    # a complete zip file has a central directory, and the CRC of its members are correct
+    try:
+        with zipfile.ZipFile(path, 'r') as zip_obj:
+            return zip_obj.testzip() is None
+    except (zipfile.BadZipFile, OSError):
+        return False
+
+class DownloadError(Exception):
+    """
+    a file cannot be downloaded, e.g., not found or still failing after retries
+    """
+    def __init__(self, url, message, status_code=None):
+        self.url = url
+        self.status_code = status_code
+        super(DownloadError, self).__init__('%s: %s' % (url, message))
+
+def _download_once(session, url, part_path, timeout):
+    # download or resume to part_path, return the HTTP status code
+    offset = os.path.getsize(part_path) if os.path.isfile(part_path) else 0
+    headers = {'Range': 'bytes=%d-' % offset} if offset > 0 else {}
+    with session.get(url, headers=headers, stream=True, timeout=timeout) as response:
+        if response.status_code == 416:
+            # the range is beyond the file, the part file is wrong, start again
+            os.remove(part_path)
+            return response.status_code
+        if response.status_code not in [200, 206]:
+            return response.status_code
+        # 200: the server ignored the Range header, write from the beginning
+        mode = 'ab' if response.status_code == 206 else 'wb'
+        with open(part_path, mode) as f_obj:
+            for chunk in response.iter_content(chunk_size=chunk_size):
+                f_obj.write(chunk)
+        return response.status_code
+
+def download_file(session, url, save_path, expected_size=None, expected_md5=None, validate=None, timeout=60):
+    '''
+    download a file, resume it if a part file exists
+    :param expected_size: the size in bytes, not checked if None
+    :param expected_md5: the md5 checksum (hex), not checked if None
+    :param validate: a function checking the downloaded file, e.g., is_valid_zip
+    :return: save_path, raise DownloadError if failed
+    '''
+    part_path = save_path + part_suffix
+    t0 = time.time()
+    resumed_bytes = os.path.getsize(part_path) if os.path.isfile(part_path) else 0
+    for retry in range(max_retries + 1):
+        if retry > 0:
+            time.sleep(backoff_seconds * 2 ** (retry - 1))
+        try:
+            status_code = _download_once(session, url, part_path, timeout)
+        except (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError) as e:
+            # keep the part file, the next try resumes from it
+            print(datetime.now(), 'Warning, downloading %s failed (%s), retry %d' % (url, str(e), retry + 1))
+            continue
+        if status_code in retry_status_codes or status_code == 416:
+            print(datetime.now(), 'Warning, downloading %s got HTTP %d, retry %d' % (url, status_code, retry + 1))
+            continue
+        if status_code not in [200, 206]:
+            raise DownloadError(url, 'HTTP %d' % status_code, status_code=status_code)
+        if expected_size is not None and os.path.getsize(part_path) < int(expected_size):
+            # the connection was closed early, resume it
+            continue
+        if (expected_size is not None and os.path.getsize(part_path) != int(expected_size)) or \
+                (expected_md5 is not None and file_md5(part_path) != expected_md5.lower()) or \
+                (validate is not None and validate(part_path) is False):
+            print(datetime.now(), 'Warning, %s is corrupted, download it again' % url)
+            os.remove(part_path)
+            resumed_bytes = 0
+            continue
+        os.replace(part_path, save_path)
+        seconds = max(time.time() - t0, 1e-6)
+        size_mb = (os.path.getsize(save_path) - resumed_bytes) / 1024.0 / 1024.0
+        print(datetime.now(), 'downloaded %s, %.1f MB in %.1f seconds (%.1f MB/s)' %
+              (save_path, size_mb, seconds, size_mb / seconds))
+        return save_path
+    raise DownloadError(url, 'failed after %d retries' % max_retries)
+
+def download_files(session, url_path_list, threads=4, validate=None):
+    '''
+    download files in parallel, files already at their paths are skipped if they are valid
+    :param url_path_list: a list of (url, save_path), or (url, save_path, expected_size, expected_md5)
+    :return: a dict, save_path -> None if succeeded, or the error message
+    '''
+    lock = threading.Lock()
+    results = {}
+    downloaded_bytes = [0]
+    t0 = time.time()
+
+    def download(url_path):
+        url, save_path = url_path[:2]
+        expected_size, expected_md5 = url_path[2:4] if len(url_path) > 2 else (None, None)
+        # a file at its final path has been checked when it was downloaded, only check its size again
+        if os.path.isfile(save_path) and (expected_size is None or os.path.getsize(save_path) == int(expected_size)) \
+                and (validate is None or validate(save_path)):
+            message = None
+        else:
+            part_path = save_path + part_suffix
+            resumed_bytes = os.path.getsize(part_path) if os.path.isfile(part_path) else 0
+            try:
+                download_file(session, url, save_path, expected_size=expected_size, expected_md5=expected_md5,
+                              validate=validate)
+                message = None
+                with lock:
+                    downloaded_bytes[0] += max(os.path.getsize(save_path) - resumed_bytes, 0)
+            except (DownloadError, requests.RequestException, OSError) as e:
+                # only this file fails, others continue
+                print(datetime.now(), 'Failed to download %s' % str(e))
+                message = str(e)
+        with lock:
+            results[save_path] = message
+
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        list(executor.map(download, url_path_list))
+    failed = len([item for item in results.values() if item is not None])
+    seconds = max(time.time() - t0, 1e-6)
+    total_mb = downloaded_bytes[0] / 1024.0 / 1024.0
+    print(datetime.now(), 'downloaded %d files (%d failed) using %d threads, %.1f MB in %.1f seconds (%.1f MB/s)' %
+          (len(results) - failed, failed, threads, total_mb, seconds, total_mb / seconds))
+    return results
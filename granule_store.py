@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+# Filename: granule_store.py
+"""
+introduction: a central store of downloaded GRD zip files, keyed by the granule ID (the file name),
+              so a granule covering several ROIs is downloaded and processed only once.
+              The folder of each ROI has hardlinks or symlinks to the files in the store,
+              or a manifest (granules.txt) listing them.
+
+add time: 18 October, 2026
+"""
+
+import os
+import shutil
+
+store_folder = 'granule_store'
+manifest_name = 'granules.txt'
+link_modes = ['hardlink', 'symlink', 'manifest']
+
+def default_store_dir(save_dir):
+    return os.path.join(save_dir, store_folder)
+
+def granule_id(path):
+    # e.g., S1A_IW_GRDH_1SDV_20170829T002620_20170829T002645_018131_01E74D_D734.zip
+    return os.path.basename(path).split('.')[0]
+
+def read_manifest(manifest_path):
+    # paths in a manifest are relative to the folder of the manifest, or absolute
+    with open(manifest_path, 'r') as f_obj:
+        lines = [line.strip() for line in f_obj.readlines()]
+    return [os.path.join(os.path.dirname(os.path.abspath(manifest_path)), line) for line in lines if len(line) > 0]
+
+def write_manifest(manifest_path, stored_paths):
+    # add to the files already listed
+    paths = read_manifest(manifest_path) if os.path.isfile(manifest_path) else []
+    paths = unique_by_granule(paths + [os.path.abspath(item) for item in stored_paths])
+    tmp_path = manifest_path + '.%d.tmp' % os.getpid()
+    with open(tmp_path, 'w') as f_obj:
+        f_obj.writelines([item + '\n' for item in paths])
+    os.replace(tmp_path, manifest_path)
+    return manifest_path
+
+def link_file(src, save_path, link_mode='hardlink'):
+    if os.path.lexists(save_path):
+        if os.path.exists(save_path) and os.path.samefile(save_path, src):
+            return save_path
+        # a copy, or a link to an old file
+        os.remove(save_path)
+    if link_mode == 'hardlink':
+        try:
+            os.link(src, save_path)
+            return save_path
+        except OSError:
+            # the store is on another file system
+            pass
+    os.symlink(os.path.abspath(src), save_path)
+    return save_path
+
+def link_to_roi(stored_paths, roi_dir, link_mode='hardlink'):
+    '''
+    make files in the store visible in the folder of an ROI
+    :param link_mode: hardlink (a symlink if not on the same file system), symlink, or manifest
+    :return: the links, or the manifest
+    '''
+    if link_mode not in link_modes:
+        raise ValueError('unknown link mode: %s, should be one of %s' % (link_mode, str(link_modes)))
+    if os.path.isdir(roi_dir) is False:
+        os.makedirs(roi_dir)
+    if link_mode == 'manifest':
+        return [write_manifest(os.path.join(roi_dir, manifest_name), stored_paths)]
+    return [link_file(path, os.path.join(roi_dir, os.path.basename(path)), link_mode=link_mode)
+            for path in stored_paths]
+
+def unique_by_granule(grd_files, warn=False):
+    # a granule in several ROI folders (links of the same file in the store) is only kept once,
+    # then two workers never pick the same granule
+    granules = set()
+    unique_list = []
+    for path in grd_files:
+        if granule_id(path) in granules:
+            if warn:
+                print('warning, %s is duplicated, ignore it' % path)
+            continue
+        granules.add(granule_id(path))
+        unique_list.append(path)
+    return unique_list
+
+def move_to_store(path, store_dir):
+    # put a file downloaded before the store existed into the store, and leave a link
+    save_path = os.path.join(store_dir, os.path.basename(path))
+    if os.path.isfile(save_path) is False:
+        if os.path.isdir(store_dir) is False:
+            os.makedirs(store_dir)
+        shutil.move(path, save_path)
+    link_file(save_path, path)
+    return save_path
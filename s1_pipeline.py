@@ -0,0 +1,404 @@
+#!/usr/bin/env python
+# Filename: s1_pipeline.py
+"""
+introduction: a pipeline of download -> DEM preparation -> RTC -> export, with bounded queues between stages.
+              A granule is processed as soon as its zip file is downloaded and verified, instead of waiting for
+              all downloads. Downloads pause when the disk is fuller than a watermark, and also when the queues
+              are full (RTC is slower than downloading).
+
+add time: 18 October, 2026
+"""
+
+import os,sys
+from optparse import OptionParser
+from datetime import datetime
+import time
+import queue
+import shutil
+import zipfile
+import threading
+
+import RTC.RTC_v3 as RTC_v3
+import snap_GRD_process
+import download_tools
+
+from genTools import read_dict_from_txt_json
+from genTools import read_list_from_txt
+
+def disk_used_fraction(path):
+    usage = shutil.disk_usage(path)
+    return usage.used / usage.total
+
+def wait_for_disk(path, watermark, interval=30, max_wait=3600):
+    # pause while the disk is fuller than the watermark, intermediate files are removed when granules are exported.
+    # raise IOError if the disk is still full after max_wait seconds, then the granule fails instead of hanging
+    b_printed = False
+    t0 = time.time()
+    while disk_used_fraction(path) > watermark:
+        if time.time() - t0 > max_wait:
+            raise IOError('disk of %s is still %.1f%% used (watermark: %.1f%%) after %.0f seconds' %
+                          (path, disk_used_fraction(path) * 100, watermark * 100, max_wait))
+        if b_printed is False:
+            print(datetime.now(), 'disk of %s is %.1f%% used (watermark: %.1f%%), pause downloading' %
+                  (path, disk_used_fraction(path) * 100, watermark * 100))
+            b_printed = True
+        time.sleep(interval)
+
+def verify_grd_zip(zip_path, expected_bytes=None):
+    # a complete zip file has the expected size, a central directory, and a manifest.safe
+    if os.path.isfile(zip_path) is False:
+        return False
+    if expected_bytes is not None and os.path.getsize(zip_path) != int(expected_bytes):
+        return False
+    try:
+        with zipfile.ZipFile(zip_path, 'r') as zip_obj:
+            return len([item for item in zip_obj.namelist() if item.endswith('manifest.safe')]) > 0
+    except zipfile.BadZipFile:
+        return False
+
+class GRDPipeline(object):
+    """
+    run download, DEM preparation, RTC, and export in threads connected by bounded queues,
+    the heavy work is done by gpt and GDAL in child processes
+    """
+    def __init__(self, zip_dir, temp_dir, save_dir, pixel_size, dem_file=None, process_mode='graph',
+                 download_workers=2, rtc_workers=1, export_workers=1, export_opts=None, disk_watermark=0.9,
+                 queue_size=2, disk_max_wait=3600):
+        self.zip_dir = zip_dir
+        self.temp_dir = temp_dir
+        self.save_dir = save_dir
+        self.pixel_size = pixel_size
+        self.dem_file = dem_file
+        self.process_mode = process_mode
+        self.export_opts = {} if export_opts is None else export_opts
+        self.disk_watermark = disk_watermark
+        self.disk_max_wait = disk_max_wait
+        self.worker_counts = {'download': download_workers, 'dem': 1, 'rtc': rtc_workers, 'export': export_workers}
+        # bounded, so a fast stage waits for a slow one instead of filling the disk
+        self.queues = {'download': queue.Queue(), 'dem': queue.Queue(maxsize=queue_size),
+                       'rtc': queue.Queue(maxsize=queue_size), 'export': queue.Queue(maxsize=queue_size)}
+        self.session = None
+        self.results = []
+        self.results_lock = threading.Lock()
+        self.t0 = None
+        self.first_product_seconds = None
+
+    def add_result(self, granule, status, stage, message=''):
+        with self.results_lock:
+            self.results.append((granule, status, stage, message))
+            if status == 'success' and self.first_product_seconds is None:
+                self.first_product_seconds = time.time() - self.t0
+                print(datetime.now(), 'the first product is ready after %.1f seconds' % self.first_product_seconds)
+
+    # -----------------------------------------------------------------------
+    # stages, each gets an item (a dict) and returns it for the next stage, or None if the granule is done
+    def download(self, product):
+        granule = product.properties['sceneName']
+        if snap_GRD_process.get_ledger(self.save_dir).is_granule_complete(granule):
+            print('%s already has output files...skipping' % granule)
+            self.add_result(granule, 'skipped', 'download')
+            return None
+        zip_path = os.path.join(self.zip_dir, product.properties['fileName'])
+        expected_bytes = product.properties.get('bytes')
+        if verify_grd_zip(zip_path, expected_bytes) is False:
+            wait_for_disk(self.zip_dir, self.disk_watermark, max_wait=self.disk_max_wait)
+            with RTC_v3.stage_metrics.measure(granule, 'download') as record:
+                if os.path.isfile(zip_path):
+                    os.remove(zip_path)
+                # resume a partial file left by an interrupted run, check the md5 in the search results
+                download_tools.download_file(self.session, product.properties['url'], zip_path,
+                                             expected_size=expected_bytes,
+                                             expected_md5=product.properties.get('md5sum'))
+                record['output_size'] = os.path.getsize(zip_path) if os.path.isfile(zip_path) else 0
+            if verify_grd_zip(zip_path, expected_bytes) is False:
+                raise IOError('%s is incomplete or corrupted' % zip_path)
+            print(datetime.now(), 'downloaded and verified %s' % zip_path)
+        return {'granule': granule, 'grd': zip_path}
+
+    def prepare_dem(self, item):
+        # clip the DEM to the footprint of the granule, SNAP downloads SRTM 1Sec tiles if no DEM is set
+        if self.dem_file is not None and os.path.exists(self.dem_file) is False:
+            raise IOError('DEM file %s does not exist' % self.dem_file)
+        item['dem'] = snap_GRD_process.prepare_granule_dem(item['grd'], item['granule'], self.temp_dir, self.save_dir,
+                                                           dem_file=self.dem_file)
+        return item
+
+    def rtc(self, item):
+        item['nrt_orbit'] = RTC_v3.use_nrt_orbit(item['grd'])
+        item['out_dir'], item['tc'] = snap_GRD_process.rtc_one_granule(item['grd'], item['granule'], self.temp_dir,
+                                                                       self.save_dir, self.pixel_size,
+                                                                       dem_file=item['dem'],
+                                                                       process_mode=self.process_mode,
+                                                                       nrt_orbit=item['nrt_orbit'])
+        return item
+
+    def export(self, item):
+        params = [self.pixel_size, self.dem_file, self.process_mode, self.export_opts, None]
+        snap_GRD_process.export_one_granule(item['granule'], item['out_dir'], item['tc'], self.save_dir,
+                                            export_opts=self.export_opts, params=params, grd=item['grd'],
+                                            nrt_orbit=item['nrt_orbit'])
+        self.add_result(item['granule'], 'success', 'export')
+        return None
+
+    # -----------------------------------------------------------------------
+    def _stage_loop(self, stage, func, in_queue, out_queue):
+        while True:
+            item = in_queue.get()
+            if item is None:
+                break
+            granule = item.properties['sceneName'] if stage == 'download' else item['granule']
+            try:
+                result = func(item)
+            except Exception as e:
+                # e.g., a command failed or timed out (CommandError), other granules can continue
+                print(datetime.now(), 'Failed to %s %s: %s' % (stage, granule, repr(e)))
+                self.add_result(granule, 'failed', stage, repr(e))
+                continue
+            if result is not None and out_queue is not None:
+                # block if the next stage is busy
+                out_queue.put(result)
+
+    def run(self, products, session=None, grd_list=None):
+        '''
+        :param products: ASF search results (ASFProduct)
+        :param grd_list: GRD files (or lists of slices) already downloaded, e.g., granules to be reprocessed,
+                         they start from the dem stage
+        :return: a list of (granule, status, stage, message)
+        '''
+        self.t0 = time.time()
+        self.session = session
+        for folder in [self.zip_dir, self.temp_dir, self.save_dir]:
+            if not os.path.isdir(folder):
+                os.makedirs(folder)
+        stages = [('download', self.download), ('dem', self.prepare_dem), ('rtc', self.rtc), ('export', self.export)]
+        grd_list = [] if grd_list is None else grd_list
+        grd_granules = set([RTC_v3.get_granule_name(grd) for grd in grd_list])
+        for product in products:
+            # do not process a granule twice
+            if product.properties['sceneName'] in grd_granules:
+                continue
+            self.queues['download'].put(product)
+
+        # start the stages, then stop them one by one after the previous stage has finished
+        threads = {}
+        for idx, (stage, func) in enumerate(stages):
+            out_queue = self.queues[stages[idx + 1][0]] if idx + 1 < len(stages) else None
+            threads[stage] = [threading.Thread(target=self._stage_loop, name='%s_%d' % (stage, count),
+                                               args=(stage, func, self.queues[stage], out_queue), daemon=True)
+                              for count in range(self.worker_counts[stage])]
+            for thread in threads[stage]:
+                thread.start()
+        # the queue of the dem stage is bounded, so add them after the stage is started
+        for grd in grd_list:
+            self.queues['dem'].put({'granule': RTC_v3.get_granule_name(grd), 'grd': grd})
+        for stage, _ in stages:
+            for _ in threads[stage]:
+                self.queues[stage].put(None)
+            for thread in threads[stage]:
+                thread.join()
+            print(datetime.now(), 'all granules passed the %s stage' % stage)
+
+        total_time = time.time() - self.t0
+        print(datetime.now(), 'Pipeline complete, took %s seconds, the first product took %s seconds' %
+              (total_time, self.first_product_seconds))
+        for status in ['success', 'skipped', 'failed']:
+            print('%s: %d' % (status, len([res for res in self.results if res[1] == status])))
+        for granule, status, stage, message in self.results:
+            if status == 'failed':
+                print('failed at %s: %s, %s' % (stage, granule, message))
+        return self.results
+
+def search_products(extent_shp_or_ids, start_date, end_date):
+    # search GRD products overlapping polygons in a shapefile, or by granule IDs in a txt file
+    import asf_search as asf
+    import asf_download
+    if extent_shp_or_ids.endswith('.txt'):
+        return list(asf.granule_search(read_list_from_txt(extent_shp_or_ids)))
+    products = {}
+    for roi_wkt in asf_download.shapefile_to_ROIs_wkt(extent_shp_or_ids):
+        # a granule may overlap several polygons, only keep one
+        for product in asf_download.search_data_from_asf(roi_wkt, start_date, end_date, 'GRD_HD'):
+            products[product.properties['sceneName']] = product
+    return list(products.values())
+
+def main(options, args):
+
+    if args[0].endswith('.json'):
+        input_dict = read_dict_from_txt_json(args[0])
+        extent_shp = input_dict['extent_shp']
+        zip_dir = input_dict['s1_zip_save_dir']
+        start_date = input_dict['start_date']
+        end_date = input_dict['end_date']
+        user_name = input_dict['username'] if 'username' in input_dict.keys() else None
+        password = input_dict['password'] if 'password' in input_dict.keys() else None
+        save_dir = input_dict['sar_images_save_dir']
+        temp_dir = input_dict['temp_dir'] if 'temp_dir' in input_dict.keys() else save_dir
+        pixel_size = input_dict['save_pixel_size']
+        dem_file = input_dict['elevation_file'] if 'elevation_file' in input_dict.keys() else None
+        setting_json = input_dict['env_setting'] if 'env_setting' in input_dict.keys() else 'env_setting.json'
+        process_mode = input_dict['process_mode'] if 'process_mode' in input_dict.keys() else 'graph'
+        workers = input_dict['workers'] if 'workers' in input_dict.keys() else 1
+        download_workers = input_dict['download_workers'] if 'download_workers' in input_dict.keys() else 2
+        export_format = input_dict['export_format'] if 'export_format' in input_dict.keys() else 'cog'
+        disk_watermark = input_dict['disk_watermark'] if 'disk_watermark' in input_dict.keys() else 0.9
+        disk_max_wait = input_dict['disk_max_wait'] if 'disk_max_wait' in input_dict.keys() else 3600
+        queue_size = input_dict['queue_size'] if 'queue_size' in input_dict.keys() else 2
+        orbit_cache_dir = input_dict['orbit_cache_dir'] if 'orbit_cache_dir' in input_dict.keys() else None
+        orbit_source = input_dict['orbit_source'] if 'orbit_source' in input_dict.keys() else None
+        nrt_mode = input_dict['nrt_mode'] if 'nrt_mode' in input_dict.keys() else False
+        clip_dem = input_dict['clip_dem'] if 'clip_dem' in input_dict.keys() else True
+    else:
+        extent_shp = args[0]
+        zip_dir = options.zip_dir
+        start_date = options.start_date
+        end_date = options.end_date
+        user_name = options.username
+        password = options.password
+        save_dir = options.save_dir
+        temp_dir = options.temp_dir if options.temp_dir is not None else save_dir
+        pixel_size = options.save_pixel_size
+        dem_file = options.elevation_file
+        setting_json = options.env_setting
+        process_mode = options.process_mode
+        workers = options.workers
+        download_workers = options.download_workers
+        export_format = options.export_format
+        disk_watermark = options.disk_watermark
+        disk_max_wait = options.disk_max_wait
+        queue_size = options.queue_size
+        orbit_cache_dir = options.orbit_cache_dir
+        orbit_source = options.orbit_source
+        nrt_mode = options.nrt_mode
+        clip_dem = options.whole_dem is False
+
+    snap_GRD_process.set_env_setting(setting_json)
+    workers = snap_GRD_process.init_save_dir(save_dir, workers=workers, process_mode=process_mode)
+    # only one thread moves files to the final folder at a time
+    snap_GRD_process.final_dir_lock = threading.Lock()
+
+    if user_name is None or password is None:
+        import asf_download
+        print('Get user name and password from the .netrc file')
+        user_name, password = asf_download.get_user_password_netrc()
+    import asf_search as asf
+    session = asf.ASFSession()
+    session.auth_with_creds(user_name, password)
+    download_tools.mount_pool(session, pool_size=download_workers)
+
+    products = search_products(extent_shp, start_date, end_date)
+    # orbit files of all granules are known from the search results, get them before downloading GRD files
+    RTC_v3.orbit_cache.prefetch_orbits([product.properties['sceneName'] for product in products],
+                                       cache_dir=orbit_cache_dir, source=orbit_source)
+    # granules processed with restituted orbits earlier are processed again if found and precise orbits are available
+    RTC_v3.nrt_mode = nrt_mode
+    RTC_v3.clip_dem = clip_dem
+    requeued_list = snap_GRD_process.requeue_nrt_granules(save_dir, orbit_opts={'cache_dir': orbit_cache_dir,
+                                                                              'source': orbit_source})
+    print(datetime.now(), 'will download and process %d GRD files, reprocess %d, %d RTC workers' %
+          (len(products), len(requeued_list), workers))
+    pipeline = GRDPipeline(zip_dir, temp_dir, save_dir, pixel_size, dem_file=dem_file, process_mode=process_mode,
+                           download_workers=download_workers, rtc_workers=workers,
+                           export_opts={'export_format': export_format}, disk_watermark=disk_watermark,
+                           queue_size=queue_size, disk_max_wait=disk_max_wait)
+    results = pipeline.run(products, session=session, grd_list=requeued_list)
+    if len([res for res in results if res[1] == 'failed']) > 0:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+
+    usage = "usage: %prog [options] extent_shp or file_ids.txt or input.json "
+    parser = OptionParser(usage=usage, version="1.0 2026-10-18")
+    parser.description = 'Introduction: download Sentinel-1 GRD files from ASF and pre-process them in a pipeline'
+
+    parser.add_option("-z", "--zip_dir",
+                      action="store", dest="zip_dir", default='asf_data',
+                      help="the folder to save downloaded zip files")
+
+    parser.add_option("-d", "--save_dir",
+                      action="store", dest="save_dir", default='pre-processed',
+                      help="the folder to save pre-processed results")
+
+    parser.add_option("-t", "--temp_dir",
+                      action="store", dest="temp_dir",
+                      help="the temporal folder for saving intermediate data ")
+
+    parser.add_option("-s", "--start_date", default='2018-04-30',
+                      action="store", dest="start_date",
+                      help="start date for inquiry, with format year-month-day, e.g., 2018-05-23")
+
+    parser.add_option("-e", "--end_date", default='2018-06-30',
+                      action="store", dest="end_date",
+                      help="the end date for inquiry, with format year-month-day, e.g., 2018-05-23")
+
+    parser.add_option("-u", "--username",
+                      action="store", dest="username",
+                      help="Earth Data account")
+
+    parser.add_option("-p", "--password",
+                      action="store", dest="password",
+                      help="password for the earth data account")
+
+    parser.add_option("", "--save_pixel_size",
+                      action="store", dest="save_pixel_size", type=float, default='10.0',
+                      help="the spatial resolution of output raster")
+
+    parser.add_option("", "--elevation_file",
+                      action="store", dest="elevation_file",
+                      help="DEM file used for terrain correction, if not set, will use SRTM 1 sec ")
+
+    parser.add_option("", "--whole_dem",
+                      action="store_true", dest="whole_dem", default=False,
+                      help="pass the whole elevation_file to terrain correction, instead of clipping it to each GRD file ")
+
+    parser.add_option("", "--env_setting",
+                      action="store", dest="env_setting", default='env_setting.json',
+                      help=" the setting of the software environment  ")
+
+    parser.add_option("-m", "--process_mode",
+                      action="store", dest="process_mode", default='graph', choices=['graph', 'stages'],
+                      help="graph: run all the steps in a single gpt graph; stages: run each step in a separate gpt run ")
+
+    parser.add_option("-w", "--workers",
+                      action="store", dest="workers", type=int, default=1,
+                      help="the number of GRD files processed by gpt in parallel, 0 for deciding it from cores and memory ")
+
+    parser.add_option("", "--download_workers",
+                      action="store", dest="download_workers", type=int, default=2,
+                      help="the number of parallel downloads ")
+
+    parser.add_option("-f", "--export_format",
+                      action="store", dest="export_format", default='cog', choices=['cog', 'gtiff', 'vrt'],
+                      help="the format of exported Sigma0 bands ")
+
+    parser.add_option("", "--disk_watermark",
+                      action="store", dest="disk_watermark", type=float, default=0.9,
+                      help="pause downloading when the disk of zip_dir is fuller than this fraction ")
+
+    parser.add_option("", "--disk_max_wait",
+                      action="store", dest="disk_max_wait", type=float, default=3600,
+                      help="the seconds to wait for disk space, after that the granule fails")
+
+    parser.add_option("", "--queue_size",
+                      action="store", dest="queue_size", type=int, default=2,
+                      help="the maximum number of granules waiting between two stages ")
+
+    parser.add_option("", "--nrt_mode",
+                      action="store_true", dest="nrt_mode", default=False,
+                      help="near-real-time mode, use restituted orbits if precise orbits are not available yet ")
+
+    parser.add_option("", "--orbit_cache_dir",
+                      action="store", dest="orbit_cache_dir",
+                      help="the folder caching orbit files, default is the orbit folder of SNAP ")
+
+    parser.add_option("", "--orbit_source",
+                      action="store", dest="orbit_source",
+                      help="a URL or a local mirror folder of orbit files, default is %s " %
+                           RTC_v3.orbit_cache.default_source)
+
+    (options, args) = parser.parse_args()
+    if len(sys.argv) < 2 or len(args) < 1:
+        parser.print_help()
+        sys.exit(2)
+
+    main(options, args)
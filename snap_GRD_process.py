@@ -9,49 +9,397 @@ from optparse import OptionParser
 import glob
 from datetime import datetime
 import time
+import threading
 
 import RTC.RTC_v3 as RTC_v3
 
 from genTools import read_dict_from_txt_json
+import vector_tools
+import storage_planner
+import granule_store
 
 def get_grd_file_list(file_or_dir):
     if os.path.isdir(file_or_dir):
-        GRD_files = glob.glob(os.path.join(file_or_dir, '*GRDH*.zip'))
+        # the folder, and the folders of ROIs (roi_0, roi_1, ...) of a granule store, with files or a manifest
+        GRD_files = []
+        for folder in [file_or_dir] + sorted(glob.glob(os.path.join(file_or_dir, 'roi_*'))):
+            GRD_files += sorted(glob.glob(os.path.join(folder, '*GRDH*.zip')))
+            manifest_path = os.path.join(folder, granule_store.manifest_name)
+            if os.path.isfile(manifest_path):
+                GRD_files += granule_store.read_manifest(manifest_path)
     else:
         with open(file_or_dir,'r') as f_obj:
             GRD_files = [line.strip() for line in f_obj.readlines()]
-    return GRD_files
+    # a granule shared by several ROIs is processed once
+    return granule_store.unique_by_granule(GRD_files)
 
-def GRD_file_preProcessing(grd_list,temp_dir,save_dir,pixel_size, dem_file=None):
+# a lock for moving files to the final folder, set in each worker process
+final_dir_lock = None
+
+def init_worker(lock, snap_gpt, gdal_translate_bin, gdalbuildvrt_bin, use_snap_worker, snappy_python, metrics_path,
+                gpt_options, log_dir, stage_timeouts, nrt_mode, clip_dem):
+    global final_dir_lock
+    final_dir_lock = lock
+    # module variables are not copied to the workers if processes are spawned (e.g., on macOS)
+    RTC_v3.baseSNAP = snap_gpt
+    RTC_v3.gdal_translate = gdal_translate_bin
+    RTC_v3.gdalbuildvrt = gdalbuildvrt_bin
+    RTC_v3.use_snap_worker = use_snap_worker
+    RTC_v3.snap_worker.snappy_python = snappy_python
+    RTC_v3.stage_metrics.metrics_path = metrics_path
+    RTC_v3.gpt_options = gpt_options
+    RTC_v3.log_dir = log_dir
+    RTC_v3.stage_timeouts = stage_timeouts
+    RTC_v3.nrt_mode = nrt_mode
+    RTC_v3.clip_dem = clip_dem
+
+# the ledger of completed stages, each process (and each thread) opens its own connection
+_ledger_local = threading.local()
+
+def get_ledger(save_dir):
+    if getattr(_ledger_local, 'pid', None) != os.getpid():
+        _ledger_local.ledger = RTC_v3.stage_ledger.open_ledger(save_dir, os.path.join(save_dir, 'final'))
+        _ledger_local.pid = os.getpid()
+    return _ledger_local.ledger
+
+def process_one_granule(grd, temp_dir, save_dir, pixel_size, dem_file=None, process_mode='graph', export_opts=None,
+                        geo_region=None, planner=None):
+    """
+    process one GRD file, return (grd, status, seconds, message), status is 'success', 'skipped', or 'failed'
+    """
+    t1 = time.time()
+    # grd is a GRD zip file, or a list of consecutive slices to be assembled
+    granule = RTC_v3.get_granule_name(grd)
+    ledger = get_ledger(save_dir)
+    if ledger.is_granule_complete(granule):
+        print('%s already has output files...skipping' % (grd))
+        return grd, 'skipped', time.time() - t1, ''
+    try:
+        # the metrics of the whole granule, the stages are measured inside
+        with RTC_v3.stage_metrics.measure(granule, 'granule', input_size=storage_planner.get_zip_size(grd)) as record:
+            final_outputs = process_granule_stages(grd, granule, temp_dir, save_dir, pixel_size, dem_file=dem_file,
+                                                   process_mode=process_mode, export_opts=export_opts,
+                                                   geo_region=geo_region, planner=planner)
+            record['output_size'] = sum([os.path.getsize(item) for item in final_outputs])
+    except Exception as e:
+        # e.g., a command failed or timed out (CommandError), other GRD files can continue
+        print(datetime.now(), 'Failed to process %s: %s' % (grd, repr(e)))
+        return grd, 'failed', time.time() - t1, repr(e)
+    return grd, 'success', time.time() - t1, ''
+
+def process_granule_stages(grd, granule, temp_dir, save_dir, pixel_size, dem_file=None, process_mode='graph',
+                           export_opts=None, geo_region=None, planner=None):
+    # run the stages of one granule, return the files moved to the final folder
+    target_dir = temp_dir
+    try:
+        # place intermediate data on a fast local storage if it fits
+        if planner is not None:
+            target_dir = planner.reserve(granule, storage_planner.estimate_peak_bytes(grd, process_mode))
+        # decided once, so the product is marked with the orbit actually used
+        nrt_orbit = RTC_v3.use_nrt_orbit(grd)
+        granule_dem = prepare_granule_dem(grd, granule, target_dir, save_dir, dem_file=dem_file, geo_region=geo_region)
+        Output_Directory, Terrain_Correction = rtc_one_granule(grd, granule, target_dir, save_dir, pixel_size,
+                                                               dem_file=granule_dem, process_mode=process_mode,
+                                                               geo_region=geo_region, nrt_orbit=nrt_orbit)
+        final_outputs = export_one_granule(granule, Output_Directory, Terrain_Correction, save_dir,
+                                           export_opts=export_opts,
+                                           params=[pixel_size, dem_file, process_mode, export_opts, geo_region],
+                                           grd=grd, nrt_orbit=nrt_orbit)
+    finally:
+        if planner is not None:
+            planner.release(granule, target_dir)
+    return final_outputs
+
+def prepare_granule_dem(grd, granule, target_dir, save_dir, dem_file=None, geo_region=None):
+    # the DEM for terrain correction, clipped to the granule; None for SRTM 1Sec downloaded by SNAP
+    if dem_file is None or RTC_v3.clip_dem is False:
+        return dem_file
+    ledger = get_ledger(save_dir)
+    Output_Directory = RTC_v3.output_dir(target_dir, granule)
+    footprint = RTC_v3.granule_footprint(grd, geo_region=geo_region)
+    return RTC_v3.stage_ledger.run_stage(ledger, granule, 'dem', [dem_file, footprint.wkt, RTC_v3.dem_buffer_deg],
+                                         RTC_v3.granule_dem, dem_file, footprint, Output_Directory, granule)
+
+def rtc_one_granule(grd, granule, target_dir, save_dir, pixel_size, dem_file=None, process_mode='graph',
+                    geo_region=None, nrt_orbit=False):
+    # orbit correction, border noise removal, calibration, speckle filter, and terrain correction
+    ledger = get_ledger(save_dir)
+    Output_Directory = RTC_v3.output_dir(target_dir, granule)
+    dem_file = ' ' if dem_file is None else dem_file
+    if process_mode == 'graph':
+        # all the steps in a single gpt run
+        Terrain_Correction = RTC_v3.applyGraphStage(Output_Directory, grd, granule, pixel_size, dem_file,
+                                                    ledger=ledger, geo_region=geo_region, nrt_orbit=nrt_orbit)
+    elif process_mode == 'stages':
+        # one gpt run for each step
+        Terrain_Correction = RTC_v3.applyStages(Output_Directory, grd, granule, pixel_size, dem_file,
+                                                ledger=ledger, geo_region=geo_region, nrt_orbit=nrt_orbit)
+    else:
+        raise ValueError('unknown process mode: %s' % process_mode)
+    return Output_Directory, Terrain_Correction
+
+def export_one_granule(granule, Output_Directory, Terrain_Correction, save_dir, export_opts=None, params=None,
+                       grd=None, nrt_orbit=False):
+    # write out data to geotiffs VV and VH, move them to the final folder, and mark the granule as complete
+    ledger = get_ledger(save_dir)
+    final_save_dir = os.path.join(save_dir, 'final')
+    Sigma0_directory = Terrain_Correction.replace('.dim', '.data')
+    export_opts = {} if export_opts is None else export_opts
+    RTC_v3.stage_ledger.run_stage(ledger, granule, 'export', [Sigma0_directory, export_opts, nrt_orbit],
+                                  RTC_v3.export_Sigma0, Output_Directory, Sigma0_directory, granule, **export_opts)
+    with RTC_v3.stage_metrics.measure(granule, 'cleanup') as record:
+        final_outputs = RTC_v3.clean_dirs(Output_Directory, final_save_dir, move_lock=final_dir_lock,
+                                          export_format=export_opts.get('export_format', 'gtiff'))
+        record['output_size'] = sum([os.path.getsize(item) for item in final_outputs])
+    ledger.record_granule(granule, 'complete', final_outputs, params)
+    ledger.remove_stages(granule)
+    if nrt_orbit and grd is not None:
+        ledger.queue_reprocess(granule, grd, 'restituted orbit')
+    else:
+        ledger.dequeue_reprocess(granule)
+    return final_outputs
+
+def process_one_granule_args(args):
+    return process_one_granule(*args)
+
+def select_grd_by_extent(grd_list, extent, save_dir, min_overlap=0.0):
+    '''
+    select GRD files overlapping the extent, using the footprint index
+    :param min_overlap: the minimum overlap (fraction of the extent area)
+    :return: selected GRD files ranked by overlap, the subset region (WKT) of each of them,
+             and GRD files whose manifest cannot be read (e.g., corrupted or partial downloads)
+    '''
+    extent_poly = vector_tools.read_extent_polygon(extent)
+    index = RTC_v3.footprint_index.FootprintIndex(os.path.join(save_dir, RTC_v3.footprint_index.index_name))
+    index.build(grd_list)
+    abs_paths = {os.path.abspath(grd): grd for grd in grd_list}
+    unreadable = [grd for grd in grd_list if index.get_record(grd) is None]
+    for grd in unreadable:
+        print('Warning, cannot read the footprint of %s, it is not selected' % grd)
+    selected = []
+    geo_regions = {}
+    for path, fraction, intersection in index.overlaps(extent_poly):
+        if fraction < min_overlap:
+            print('%s only covers %.4f of the extent...skipping' % (path, fraction))
+            continue
+        grd = abs_paths[path]
+        selected.append(grd)
+        # Subset uses the pixel bounds of the region, the convex hull keeps the WKT short
+        geo_regions[grd] = intersection.convex_hull.wkt
+    index.close()
+    print(datetime.now(), 'selected %d of %d GRD files overlapping the extent, %d unreadable' %
+          (len(selected), len(grd_list), len(unreadable)))
+    return selected, geo_regions, unreadable
+
+def get_group_region(grd, geo_regions):
+    # the subset region of a GRD file, or the union of the regions of slices to be assembled
+    if isinstance(grd, list):
+        from shapely import wkt
+        from shapely.ops import unary_union
+        regions = [wkt.loads(geo_regions[item]) for item in grd if item in geo_regions]
+        return unary_union(regions).convex_hull.wkt
+    return geo_regions.get(grd)
+
+def init_save_dir(save_dir, workers=1, process_mode='graph', gpt_defaults=False):
+    # create the ledger before starting workers
+    get_ledger(save_dir)
+    # performance metrics of each stage
+    RTC_v3.stage_metrics.metrics_path = os.path.join(save_dir, RTC_v3.stage_metrics.metrics_name)
+    print(datetime.now(), 'stage metrics will be saved to %s' % RTC_v3.stage_metrics.metrics_path)
+    # the output of gpt and GDAL commands, one log file for each granule
+    RTC_v3.log_dir = os.path.join(save_dir, 'logs')
+    # the number of parallel jobs (if workers is 0), and the threads, tile cache, and heap of each gpt run
+    plan = RTC_v3.resource_planner.plan_resources(workers=workers, process_mode=process_mode,
+                                                  metrics_path=RTC_v3.stage_metrics.metrics_path)
+    RTC_v3.resource_planner.print_plan(plan)
+    if gpt_defaults is False:
+        RTC_v3.gpt_options = RTC_v3.resource_planner.gpt_options(plan)
+    return plan['workers']
+
+def prefetch_orbit_files(grd_list, save_dir, orbit_opts):
+    '''
+    download orbit files of all granules before processing, so Apply-Orbit-File does not wait on the network
+    :param orbit_opts: a dict with cache_dir, source, and offline
+    :return: the GRD files (or groups of slices) without orbit files in the offline mode
+    '''
+    ledger = get_ledger(save_dir)
+    grd_list = [grd for grd in grd_list if not ledger.is_granule_complete(RTC_v3.get_granule_name(grd))]
+    slice_list = []
+    for grd in grd_list:
+        slice_list.extend(grd if isinstance(grd, list) else [grd])
+    orbits = RTC_v3.orbit_cache.prefetch_orbits([RTC_v3.get_granule_name(item) for item in slice_list],
+                                                cache_dir=orbit_opts.get('cache_dir'),
+                                                source=orbit_opts.get('source'),
+                                                offline=orbit_opts.get('offline', False))
+    # in the near-real-time mode, granules without orbit files use the orbit state vectors in the products
+    if orbit_opts.get('offline', False) is False or RTC_v3.nrt_mode:
+        return []
+    missing = set([granule for granule, (_, path) in orbits.items() if path is None])
+    return [grd for grd in grd_list
+            if len([item for item in (grd if isinstance(grd, list) else [grd])
+                    if RTC_v3.get_granule_name(item) in missing]) > 0]
+
+def requeue_nrt_granules(save_dir, orbit_opts=None):
+    '''
+    granules processed with restituted orbits are reprocessed once their precise orbits are available
+    :return: the GRD files (or lists of slices) to be reprocessed
+    '''
+    ledger = get_ledger(save_dir)
+    queued = ledger.reprocess_list()
+    if len(queued) < 1:
+        return []
+    if orbit_opts is not None:
+        slice_list = []
+        for _, grd, _ in queued:
+            slice_list.extend(grd if isinstance(grd, list) else [grd])
+        RTC_v3.orbit_cache.prefetch_orbits([RTC_v3.get_granule_name(item) for item in slice_list],
+                                           cache_dir=orbit_opts.get('cache_dir'), source=orbit_opts.get('source'),
+                                           offline=orbit_opts.get('offline', False), orbit_types=('POEORB',))
+    grd_list = []
+    for granule, grd, reason in queued:
+        zip_list = grd if isinstance(grd, list) else [grd]
+        if False in [os.path.isfile(item) for item in zip_list]:
+            print(datetime.now(), 'Warning, the GRD files of %s (%s) are removed, cannot reprocess it' % (granule, reason))
+            continue
+        if None in [RTC_v3.orbit_cache.find_snap_orbit(RTC_v3.get_granule_name(item), 'POEORB') for item in zip_list]:
+            continue
+        ledger.reopen_granule(granule)
+        grd_list.append(grd)
+    print(datetime.now(), '%d of %d granules processed with restituted orbits will be reprocessed with precise orbits' %
+          (len(grd_list), len(queued)))
+    return grd_list
+
+def GRD_file_preProcessing(grd_list,temp_dir,save_dir,pixel_size, dem_file=None, process_mode='graph', workers=1,
+                           export_opts=None, extent=None, min_overlap=0.0, slice_assembly=False, staging_dirs=None,
+                           gpt_defaults=False, orbit_opts=None):
     t0 = time.time()
+    workers = init_save_dir(save_dir, workers=workers, process_mode=process_mode, gpt_defaults=gpt_defaults)
+    # granules processed with restituted orbits earlier, whose precise orbits are available now,
+    # a group of slices stays one item and is assembled again, with or without slice_assembly
+    grd_list = list(grd_list)
+    input_names = set([RTC_v3.get_granule_name(item) for item in grd_list])
+    requeued_groups = []
+    for grd in requeue_nrt_granules(save_dir, orbit_opts=orbit_opts):
+        if isinstance(grd, list):
+            requeued_groups.append(grd)
+        elif RTC_v3.get_granule_name(grd) not in input_names:
+            grd_list.append(grd)
+    # the slices of the groups are selected by the extent like other GRD files, for their subset regions
+    group_slices = [item for grd in requeued_groups for item in grd if RTC_v3.get_granule_name(item) not in input_names]
+    grd_list = granule_store.unique_by_granule(grd_list + group_slices, warn=True)
+    # only process GRD files overlapping the extent, and only the part within the extent
+    geo_regions = {}
+    results = []
+    if extent is not None:
+        grd_list, geo_regions, unreadable = select_grd_by_extent(grd_list, extent, save_dir, min_overlap=min_overlap)
+        for grd in unreadable:
+            results.append((grd, 'failed', 0.0, 'cannot read the manifest, the zip file may be corrupted'))
+    selected_names = set([RTC_v3.get_granule_name(item) for item in grd_list])
+    grd_list = [grd for grd in grd_list if grd not in group_slices]
+    # assemble consecutive slices of the same pass, then produce one terrain corrected product per pass
+    if slice_assembly:
+        grd_list = RTC_v3.group_consecutive_slices(grd_list)
+    # requeued groups not produced again by the grouping above, and having slices within the extent
+    group_names = [RTC_v3.get_granule_name(item) for item in grd_list]
+    for grd in requeued_groups:
+        if RTC_v3.get_granule_name(grd) in group_names:
+            continue
+        if True not in [RTC_v3.get_granule_name(item) in selected_names for item in grd]:
+            continue
+        grd_list.append(grd)
+    for grd in grd_list:
+        if isinstance(grd, list):
+            print(datetime.now(), 'will assemble %d slices to %s' % (len(grd), RTC_v3.get_granule_name(grd)))
+    # orbit files are downloaded once here, not by each gpt run
+    if orbit_opts is not None:
+        no_orbit_list = prefetch_orbit_files(grd_list, save_dir, orbit_opts)
+        for grd in no_orbit_list:
+            results.append((grd, 'failed', 0.0, 'no orbit file in the offline mode'))
+        grd_list = [grd for grd in grd_list if grd not in no_orbit_list]
+    regions = [get_group_region(grd, geo_regions) for grd in grd_list]
+    # staging folders on fast local storage for intermediate data, temp_dir is the fallback
+    planner = None
+    if staging_dirs is not None and len(staging_dirs) > 0:
+        planner = storage_planner.StoragePlanner(staging_dirs + [temp_dir])
     total_count = len(grd_list)
-    for idx, grd in enumerate(grd_list):
-        t1 = time.time()
-        print(datetime.now(),'Processing GRD File %s / %s' % (idx + 1, total_count))
-        granule = os.path.basename(grd).split('.')[0]
-        final_save_dir = os.path.join(save_dir, 'final')
-        if len(glob.glob(os.path.join(final_save_dir, granule + '*'))) == 0:
-            Output_Directory = RTC_v3.output_dir(temp_dir, granule)
-            # orbit correction
-            Orbit_Correction = RTC_v3.applyOrbit(Output_Directory, grd, granule)
-            # border noise removal
-            Border_Noise_Removal = RTC_v3.applyremovebordernoise(Output_Directory, Orbit_Correction, granule)
-            # Calibration to sigma nought
-            Calibration = RTC_v3.applyCal(Output_Directory, Border_Noise_Removal, granule)
-            # speckle filter
-            Speckle_Filter = RTC_v3.applySpeckle(Output_Directory, Calibration, granule)
-            # terrain correction
-            dem_file = ' ' if dem_file is None else dem_file
-            Terrain_Correction = RTC_v3.applyTC(Output_Directory, Speckle_Filter, granule, pixel_size, dem_file)
-            # write out data to geotiffs VV and VH
-            Sigma0_directory = Terrain_Correction.replace('.dim', '.data')
-            RTC_v3.Sigma0_FF_2_gtif(Output_Directory, Sigma0_directory, granule)
-            RTC_v3.clean_dirs(Output_Directory, final_save_dir)
-        else:
-            print('%s already has output files...skipping' % (grd))
-        print(datetime.now(), 'Complete, took %s seconds' % (time.time() - t1))
+    if workers > 1:
+        import multiprocessing
+        print(datetime.now(), 'Processing %d GRD Files using %d workers' % (total_count, workers))
+        lock = multiprocessing.Lock()
+        job_args = [(grd, temp_dir, save_dir, pixel_size, dem_file, process_mode, export_opts, region, planner)
+                    for grd, region in zip(grd_list, regions)]
+        with multiprocessing.Pool(processes=workers, initializer=init_worker,
+                                  initargs=(lock, RTC_v3.baseSNAP, RTC_v3.gdal_translate, RTC_v3.gdalbuildvrt,
+                                            RTC_v3.use_snap_worker, RTC_v3.snap_worker.snappy_python,
+                                            RTC_v3.stage_metrics.metrics_path, RTC_v3.gpt_options,
+                                            RTC_v3.log_dir, RTC_v3.stage_timeouts, RTC_v3.nrt_mode,
+                                            RTC_v3.clip_dem)) as pool:
+            for idx, res in enumerate(pool.imap_unordered(process_one_granule_args, job_args, chunksize=1)):
+                grd, status, seconds, _ = res
+                print(datetime.now(), '%s / %s, %s: %s, took %s seconds' % (idx + 1, total_count, status, grd, seconds))
+                results.append(res)
+    else:
+        for idx, (grd, region) in enumerate(zip(grd_list, regions)):
+            print(datetime.now(),'Processing GRD File %s / %s' % (idx + 1, total_count))
+            res = process_one_granule(grd, temp_dir, save_dir, pixel_size, dem_file=dem_file, process_mode=process_mode,
+                                      export_opts=export_opts, geo_region=region, planner=planner)
+            print(datetime.now(), 'Complete, took %s seconds' % (res[2]))
+            results.append(res)
+
     total_time = time.time() - t0
     print(datetime.now(),'Process complete, took %s seconds' % (total_time))
+    for status in ['success', 'skipped', 'failed']:
+        print('%s: %d' % (status, len([res for res in results if res[1] == status])))
+    for grd, status, _, message in results:
+        if status == 'failed':
+            print('failed: %s, %s' % (grd, message))
+    return results
+
+def set_env_setting(setting_json):
+    # the paths of gpt and GDAL tools, from a setting file or environment variables
+    if os.path.isfile(setting_json):
+        env_setting = read_dict_from_txt_json(setting_json)
+        RTC_v3.baseSNAP = env_setting['snap_bin_gpt']
+        print(datetime.now(),'setting SNAP gpt:', RTC_v3.baseSNAP)
+        RTC_v3.gdal_translate = env_setting['gdal_translate_bin']
+        print(datetime.now(), 'gdal_translate:', RTC_v3.gdal_translate)
+        if 'gdalbuildvrt_bin' in env_setting.keys():
+            RTC_v3.gdalbuildvrt = env_setting['gdalbuildvrt_bin']
+        if 'snappy_python' in env_setting.keys():
+            RTC_v3.snap_worker.snappy_python = env_setting['snappy_python']
+    else:
+        RTC_v3.baseSNAP = os.getenv('SNAP_BIN_GPT')
+        if RTC_v3.baseSNAP is None:
+            raise ValueError('SNAP_BIN_GPT is not in Environment Variables')
+        RTC_v3.gdal_translate = os.getenv('GDAL_TRANSLATE_BIN')
+        if RTC_v3.gdal_translate is None:
+            raise ValueError('GDAL_TRANSLATE_BIN is not in Environment Variables')
+
+def parse_stage_timeouts(timeouts_str):
+    # e.g., terrain_correction=7200,default=3600
+    stage_timeouts = {}
+    if timeouts_str is None:
+        return stage_timeouts
+    for item in timeouts_str.split(','):
+        stage, seconds = item.split('=')
+        stage_timeouts[stage.strip()] = float(seconds)
+    return stage_timeouts
+
+def check_graph_vs_stages(grd, temp_dir, pixel_size, dem_file=None):
+    # process one granule using both the single graph and the stage by stage processing, then compare the outputs
+    granule = RTC_v3.get_granule_name(grd)
+    dem_file = ' ' if dem_file is None else dem_file
+    graph_dir = RTC_v3.output_dir(os.path.join(temp_dir, 'check_graph'), granule)
+    stages_dir = RTC_v3.output_dir(os.path.join(temp_dir, 'check_stages'), granule)
+    t1 = time.time()
+    graph_tc = RTC_v3.applyGraph(graph_dir, grd, granule, pixel_size, dem_file)
+    t2 = time.time()
+    stages_tc = RTC_v3.applyStages(stages_dir, grd, granule, pixel_size, dem_file)
+    t3 = time.time()
+    print(datetime.now(), 'single graph took %s seconds, stage by stage took %s seconds' % (t2 - t1, t3 - t2))
+    b_same = RTC_v3.compare_TC_outputs(graph_tc, stages_tc)
+    print(datetime.now(), 'outputs of the two process modes are %s' % ('the same' if b_same else 'DIFFERENT'))
+    return b_same
 
 def test_Sigma0_FF_2_gtif():
     Output_Directory = os.path.expanduser('~/Data/tmp_data/flood_detection/pre-processed/S1A_IW_GRDH_1SDV_20170829T002620_20170829T002645_018131_01E74D_D734_Processed')
@@ -70,6 +418,22 @@ def main(options, args):
         pixel_size = input_dict['save_pixel_size']
         dem_file = input_dict['elevation_file'] if 'elevation_file' in input_dict.keys() else None
         setting_json = input_dict['env_setting'] if 'env_setting' in input_dict.keys() else 'env_setting.json'
+        process_mode = input_dict['process_mode'] if 'process_mode' in input_dict.keys() else 'graph'
+        workers = input_dict['workers'] if 'workers' in input_dict.keys() else 1
+        export_format = input_dict['export_format'] if 'export_format' in input_dict.keys() else 'cog'
+        compress = input_dict['compress'] if 'compress' in input_dict.keys() else 'DEFLATE'
+        num_threads = input_dict['gdal_num_threads'] if 'gdal_num_threads' in input_dict.keys() else 'ALL_CPUS'
+        extent = input_dict['subset_extent'] if 'subset_extent' in input_dict.keys() else None
+        min_overlap = input_dict['min_overlap'] if 'min_overlap' in input_dict.keys() else 0.0
+        slice_assembly = input_dict['slice_assembly'] if 'slice_assembly' in input_dict.keys() else False
+        staging_dirs = input_dict['staging_dirs'] if 'staging_dirs' in input_dict.keys() else None
+        gpt_defaults = input_dict['gpt_defaults'] if 'gpt_defaults' in input_dict.keys() else False
+        stage_timeouts = input_dict['stage_timeouts'] if 'stage_timeouts' in input_dict.keys() else {}
+        orbit_cache_dir = input_dict['orbit_cache_dir'] if 'orbit_cache_dir' in input_dict.keys() else None
+        orbit_source = input_dict['orbit_source'] if 'orbit_source' in input_dict.keys() else None
+        offline = input_dict['offline'] if 'offline' in input_dict.keys() else False
+        nrt_mode = input_dict['nrt_mode'] if 'nrt_mode' in input_dict.keys() else False
+        clip_dem = input_dict['clip_dem'] if 'clip_dem' in input_dict.keys() else True
     else:
         grd_file_list = get_grd_file_list(args[0])
         save_dir = options.save_dir
@@ -77,23 +441,48 @@ def main(options, args):
         pixel_size = options.save_pixel_size
         dem_file = options.elevation_file
         setting_json = options.env_setting
+        process_mode = options.process_mode
+        workers = options.workers
+        export_format = options.export_format
+        compress = options.compress
+        num_threads = options.gdal_num_threads
+        extent = options.extent
+        min_overlap = options.min_overlap
+        slice_assembly = options.slice_assembly
+        staging_dirs = None if options.staging_dirs is None else options.staging_dirs.split(',')
+        gpt_defaults = options.gpt_defaults
+        stage_timeouts = parse_stage_timeouts(options.stage_timeouts)
+        orbit_cache_dir = options.orbit_cache_dir
+        orbit_source = options.orbit_source
+        offline = options.offline
+        nrt_mode = options.nrt_mode
+        clip_dem = options.whole_dem is False
 
-    if os.path.isfile(setting_json):
-        env_setting = read_dict_from_txt_json(setting_json)
-        RTC_v3.baseSNAP = env_setting['snap_bin_gpt']
-        print(datetime.now(),'setting SNAP gpt:', RTC_v3.baseSNAP)
-        RTC_v3.gdal_translate = env_setting['gdal_translate_bin']
-        print(datetime.now(), 'gdal_translate:', RTC_v3.gdal_translate)
-    else:
-        RTC_v3.baseSNAP = os.getenv('SNAP_BIN_GPT')
-        if RTC_v3.baseSNAP is None:
-            raise ValueError('SNAP_BIN_GPT is not in Environment Variables')
-        RTC_v3.gdal_translate = os.getenv('GDAL_TRANSLATE_BIN')
-        if RTC_v3.gdal_translate is None:
-            raise ValueError('GDAL_TRANSLATE_BIN is not in Environment Variables')
+    set_env_setting(setting_json)
+
+    RTC_v3.stage_timeouts = stage_timeouts
+    RTC_v3.nrt_mode = nrt_mode
+    RTC_v3.clip_dem = clip_dem
+    if nrt_mode:
+        print(datetime.now(), 'near-real-time mode, use restituted orbits if precise orbits are not available')
+    if options.snap_worker:
+        if process_mode != 'graph':
+            raise ValueError('the SNAP worker only runs in the graph process mode')
+        RTC_v3.use_snap_worker = True
+        print(datetime.now(), 'run graphs in a long-lived SNAP worker, python:', RTC_v3.snap_worker.snappy_python)
 
     # test_Sigma0_FF_2_gtif()
-    GRD_file_preProcessing(grd_file_list, temp_dir, save_dir, pixel_size, dem_file=dem_file)
+    if options.compare_modes:
+        b_same = check_graph_vs_stages(grd_file_list[0], temp_dir, pixel_size, dem_file=dem_file)
+        sys.exit(0 if b_same else 1)
+    export_opts = {'export_format': export_format, 'compress': compress, 'num_threads': str(num_threads)}
+    orbit_opts = {'cache_dir': orbit_cache_dir, 'source': orbit_source, 'offline': offline}
+    results = GRD_file_preProcessing(grd_file_list, temp_dir, save_dir, pixel_size, dem_file=dem_file,
+                                     process_mode=process_mode, workers=workers, export_opts=export_opts,
+                                     extent=extent, min_overlap=min_overlap, slice_assembly=slice_assembly,
+                                     staging_dirs=staging_dirs, gpt_defaults=gpt_defaults, orbit_opts=orbit_opts)
+    if len([res for res in results if res[1] == 'failed']) > 0:
+        sys.exit(1)
 
 
 
@@ -115,14 +504,98 @@ if __name__ == "__main__":
                       action="store", dest="save_pixel_size",type=float, default='10.0',
                       help="the spatial resolution of output raster")
 
+    parser.add_option("", "--staging_dirs",
+                      action="store", dest="staging_dirs",
+                      help="folders on fast local storage (e.g., /dev/shm/s1,/mnt/nvme/s1) for intermediate data, "
+                           "separated by comma, ordered by preference, temp_dir is used if they don't have enough space ")
+
     parser.add_option("-e", "--elevation_file",
                       action="store", dest="elevation_file",
                       help="DEM file used for terrain correction, if not set, will use SRTM 1 sec ")
 
+    parser.add_option("", "--whole_dem",
+                      action="store_true", dest="whole_dem", default=False,
+                      help="pass the whole elevation_file to terrain correction, instead of clipping it to each GRD file; "
+                           "elevation_file can also be a folder of SRTM 1Sec tiles (*.SRTMGL1.hgt.zip) ")
+
     parser.add_option("-s", "--env_setting",
                       action="store", dest="env_setting", default='env_setting.json',
                       help=" the setting of the software environment  ")
 
+    parser.add_option("-x", "--extent",
+                      action="store", dest="extent",
+                      help="a shapefile or a WKT polygon (lon lat) of the area of interest, "
+                           "only process the part of GRD files within it, skip GRD files not overlapping it ")
+
+    parser.add_option("", "--min_overlap",
+                      action="store", dest="min_overlap", type=float, default=0.0,
+                      help="skip GRD files covering less than this fraction of the extent ")
+
+    parser.add_option("-a", "--slice_assembly",
+                      action="store_true", dest="slice_assembly", default=False,
+                      help="assemble consecutive slices of the same pass (mission, orbit, and data take) after calibration ")
+
+    parser.add_option("-m", "--process_mode",
+                      action="store", dest="process_mode", default='graph', choices=['graph', 'stages'],
+                      help="graph: run all the steps in a single gpt graph; stages: run each step in a separate gpt run ")
+
+    parser.add_option("-w", "--workers",
+                      action="store", dest="workers", type=int, default=1,
+                      help="the number of GRD files processed in parallel, 0 for deciding it from cores, memory, "
+                           "and the peak memory of gpt in earlier runs ")
+
+    parser.add_option("", "--gpt_defaults",
+                      action="store_true", dest="gpt_defaults", default=False,
+                      help="run gpt with the settings in gpt.vmoptions, instead of the threads (-q), tile cache (-c), "
+                           "and heap (-J-Xmx) planned for this host ")
+
+    parser.add_option("-f", "--export_format",
+                      action="store", dest="export_format", default='cog', choices=['cog', 'gtiff', 'vrt'],
+                      help="cog: Cloud-Optimized GeoTIFFs written in-process; gtiff: plain GeoTIFFs by gdal_translate; "
+                           "vrt: keep the ENVI rasters of Terrain-Correction and write VRT files pointing to them ")
+
+    parser.add_option("-c", "--compress",
+                      action="store", dest="compress", default='DEFLATE', choices=['DEFLATE', 'ZSTD', 'LZW', 'NONE'],
+                      help="the compression of Cloud-Optimized GeoTIFFs ")
+
+    parser.add_option("", "--gdal_num_threads",
+                      action="store", dest="gdal_num_threads", default='ALL_CPUS',
+                      help="GDAL_NUM_THREADS for writing Cloud-Optimized GeoTIFFs, a number or ALL_CPUS ")
+
+    parser.add_option("", "--stage_timeouts",
+                      action="store", dest="stage_timeouts",
+                      help="timeouts of stages in seconds, a command running longer is killed, "
+                           "e.g., graph=10800,terrain_correction=7200,default=3600 ")
+
+    parser.add_option("", "--orbit_cache_dir",
+                      action="store", dest="orbit_cache_dir",
+                      help="the folder caching orbit files (POEORB and RESORB), prefetched before processing, "
+                           "default is the orbit folder of SNAP (~/.snap/auxdata/Orbits/Sentinel-1) ")
+
+    parser.add_option("", "--orbit_source",
+                      action="store", dest="orbit_source",
+                      help="a URL or a local mirror folder of orbit files, default is %s " %
+                           RTC_v3.orbit_cache.default_source)
+
+    parser.add_option("", "--offline",
+                      action="store_true", dest="offline", default=False,
+                      help="do not download orbit files, only use the cache and the local mirror, "
+                           "GRD files without orbit files are not processed ")
+
+    parser.add_option("", "--nrt_mode",
+                      action="store_true", dest="nrt_mode", default=False,
+                      help="near-real-time mode, use restituted orbits (or the orbit state vectors in products) if "
+                           "precise orbits are not available yet, these granules are reprocessed in a later run "
+                           "once precise orbits are available ")
+
+    parser.add_option("", "--snap_worker",
+                      action="store_true", dest="snap_worker", default=False,
+                      help="run graphs in a long-lived SNAP worker (esa_snappy or snappy) instead of starting gpt for each GRD file ")
+
+    parser.add_option("", "--compare_modes",
+                      action="store_true", dest="compare_modes", default=False,
+                      help="process the first GRD file in both process modes and check the outputs are the same ")
+
 
     (options, args) = parser.parse_args()
     if len(sys.argv) < 2 or len(args) < 1:
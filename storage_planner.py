@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+# Filename: storage_planner.py
+"""
+introduction: place the intermediate data of each granule on a fast local target (tmpfs or local SSD) if it fits,
+              otherwise fall back to the next target (e.g., temp_dir on a network file system).
+
+              The peak intermediate footprint of a granule is estimated from the size of its zip file.
+              Space is reserved by writing a small file in each target, so parallel workers (processes)
+              do not over-commit the same target.
+
+add time: 18 October, 2026
+"""
+
+import os
+import json
+import fcntl
+import shutil
+import socket
+from datetime import datetime
+
+reservation_folder = '.s1_reservations'
+
+# the peak size of intermediate data (including exported files) as a multiple of the zip size
+peak_factors = {'stages': 12.0, 'graph': 6.0}
+
+def get_zip_size(grd):
+    # grd is a GRD zip file, or a list of slices to be assembled
+    if isinstance(grd, list):
+        return sum([os.path.getsize(item) for item in grd])
+    return os.path.getsize(grd)
+
+def estimate_peak_bytes(grd, process_mode='graph'):
+    return int(get_zip_size(grd) * peak_factors.get(process_mode, peak_factors['stages']))
+
+def is_process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+class StoragePlanner(object):
+    def __init__(self, targets, min_free_fraction=0.05):
+        '''
+        :param targets: folders ordered by preference, e.g., ['/dev/shm/s1', '/mnt/nvme/s1', temp_dir],
+        the last one is the fallback
+        :param min_free_fraction: keep this fraction of each file system free
+        '''
+        self.targets = [os.path.abspath(item) for item in targets]
+        self.min_free_fraction = min_free_fraction
+
+    def _reservation_dir(self, target):
+        res_dir = os.path.join(target, reservation_folder)
+        if os.path.isdir(res_dir) is False:
+            os.makedirs(res_dir, exist_ok=True)
+        return res_dir
+
+    def _reserved_bytes(self, res_dir):
+        total = 0
+        hostname = socket.gethostname()
+        for name in os.listdir(res_dir):
+            path = os.path.join(res_dir, name)
+            if name.startswith('.') or os.path.isfile(path) is False:
+                continue
+            try:
+                with open(path) as f_obj:
+                    info = json.load(f_obj)
+            except (ValueError, OSError):
+                continue
+            # remove reservations left by crashed processes
+            if info['host'] == hostname and is_process_alive(info['pid']) is False:
+                os.remove(path)
+                continue
+            total += info['bytes']
+        return total
+
+    def _write_reservation(self, res_dir, granule, nbytes):
+        with open(os.path.join(res_dir, granule), 'w') as f_obj:
+            json.dump({'bytes': nbytes, 'pid': os.getpid(), 'host': socket.gethostname(),
+                       'time': str(datetime.now())}, f_obj)
+
+    def reserve(self, granule, nbytes):
+        '''
+        choose a target for the intermediate data of a granule, and reserve space on it
+        :return: the target folder
+        '''
+        # resume on the target having the intermediate data of a previous run
+        for target in self.targets:
+            if os.path.isdir(os.path.join(target, granule + '_Processed')):
+                self._write_reservation(self._reservation_dir(target), granule, nbytes)
+                print(datetime.now(), 'intermediate data of %s exist in %s, resume there' % (granule, target))
+                return target
+
+        for idx, target in enumerate(self.targets):
+            b_last = idx == len(self.targets) - 1
+            try:
+                res_dir = self._reservation_dir(target)
+            except OSError as e:
+                print('Warning, cannot use %s: %s' % (target, str(e)))
+                continue
+            with open(os.path.join(res_dir, '.lock'), 'w') as lock_obj:
+                fcntl.flock(lock_obj, fcntl.LOCK_EX)
+                usage = shutil.disk_usage(target)
+                available = usage.free - self._reserved_bytes(res_dir) - usage.total * self.min_free_fraction
+                if available >= nbytes or b_last:
+                    if available < nbytes:
+                        print('Warning, %s may not have enough space (%.2f GB) for %s (%.2f GB)' %
+                              (target, available / 1e9, granule, nbytes / 1e9))
+                    self._write_reservation(res_dir, granule, nbytes)
+                    print(datetime.now(), 'intermediate data of %s (%.2f GB) will be saved to %s' %
+                          (granule, nbytes / 1e9, target))
+                    return target
+        raise IOError('No storage target available for %s' % granule)
+
+    def release(self, granule, target):
+        res_path = os.path.join(target, reservation_folder, granule)
+        if os.path.isfile(res_path):
+            os.remove(res_path)
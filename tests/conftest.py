@@ -0,0 +1,23 @@
+import os, sys
+
+import pytest
+
+tests_dir = os.path.dirname(os.path.abspath(__file__))
+repo_dir = os.path.dirname(tests_dir)
+bench_dir = os.path.join(repo_dir, 'benchmark')
+for path in [repo_dir, bench_dir]:
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+@pytest.fixture
+def fake_tools(monkeypatch):
+    # the stand-in gpt and GDAL tools of the benchmark, with short delays, restored after the test
+    import run_benchmark
+    import RTC.RTC_v3 as RTC_v3
+    config = {'gpt_startup': 0.0, 'gpt_op_delay': 0.0, 'gdal_delay': 0.0, 'band_mb': 0.01}
+    for name in ['FAKE_GPT_STARTUP', 'FAKE_GPT_OP_DELAY', 'FAKE_GDAL_DELAY', 'FAKE_BAND_MB']:
+        monkeypatch.setenv(name, '0')
+    for name in ['baseSNAP', 'gdal_translate', 'gdalbuildvrt']:
+        monkeypatch.setattr(RTC_v3, name, getattr(RTC_v3, name))
+    run_benchmark.set_fake_tools(config)
+    return RTC_v3
@@ -0,0 +1,168 @@
+import os
+import io
+import hashlib
+import zipfile
+import threading
+import http.server
+
+import pytest
+
+import download_tools
+
+class RangeHandler(http.server.BaseHTTPRequestHandler):
+    """
+    serve files from server.files (name -> bytes) with Range support, server.modes sets the behavior of a file:
+    truncate: the first response is closed in the middle; ignore_range: always answer 200 with the whole file;
+    unavailable: answer 503 to the first two requests
+    """
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        name = self.path.lstrip('/')
+        self.server.requests.append((name, self.headers.get('Range')))
+        if name not in self.server.files:
+            self.send_error(404)
+            return
+        data = self.server.files[name]
+        mode = self.server.modes.get(name)
+        if mode == 'unavailable' and len([item for item in self.server.requests if item[0] == name]) <= 2:
+            self.send_error(503)
+            return
+        start = 0
+        if self.headers.get('Range') is not None and mode != 'ignore_range':
+            start = int(self.headers.get('Range').split('=')[1].split('-')[0])
+            if start >= len(data):
+                self.send_response(416)
+                self.send_header('Content-Range', 'bytes */%d' % len(data))
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes %d-%d/%d' % (start, len(data) - 1, len(data)))
+        else:
+            self.send_response(200)
+        body = data[start:]
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if mode == 'truncate' and len([item for item in self.server.requests if item[0] == name]) == 1:
+            self.wfile.write(body[:len(body) // 2])
+            self.wfile.flush()
+            self.close_connection = True
+            return
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+@pytest.fixture
+def server():
+    httpd = http.server.ThreadingHTTPServer(('127.0.0.1', 0), RangeHandler)
+    httpd.files = {}
+    httpd.modes = {}
+    httpd.requests = []
+    httpd.url = 'http://127.0.0.1:%d/' % httpd.server_address[1]
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+@pytest.fixture(autouse=True)
+def fast_retries(monkeypatch):
+    monkeypatch.setattr(download_tools, 'chunk_size', 16384)
+    monkeypatch.setattr(download_tools, 'backoff_seconds', 0.01)
+    monkeypatch.setattr(download_tools, 'max_retries', 2)
+
+def add_file(server, name, size, mode=None):
+    data = os.urandom(size)
+    server.files[name] = data
+    if mode is not None:
+        server.modes[name] = mode
+    return data, hashlib.md5(data).hexdigest()
+
+def test_resume_after_truncation(server, tmp_path):
+    data, md5 = add_file(server, 'a.zip', 300000, mode='truncate')
+    save_path = str(tmp_path / 'a.zip')
+    download_tools.download_file(download_tools.create_session(), server.url + 'a.zip', save_path,
+                                 expected_size=len(data), expected_md5=md5)
+    assert open(save_path, 'rb').read() == data
+    assert os.path.exists(save_path + download_tools.part_suffix) is False
+    # the second request resumes from the bytes already written
+    ranges = [item[1] for item in server.requests]
+    assert ranges[0] is None and ranges[1] is not None and ranges[1] != 'bytes=0-'
+
+def test_server_ignoring_range(server, tmp_path):
+    data, md5 = add_file(server, 'b.zip', 100000, mode='ignore_range')
+    save_path = str(tmp_path / 'b.zip')
+    # a stale part file, the whole file is written again when the server answers 200
+    with open(save_path + download_tools.part_suffix, 'wb') as f_obj:
+        f_obj.write(b'x' * 5000)
+    download_tools.download_file(download_tools.create_session(), server.url + 'b.zip', save_path,
+                                 expected_size=len(data), expected_md5=md5)
+    assert open(save_path, 'rb').read() == data
+
+def test_md5_mismatch(server, tmp_path):
+    data, _ = add_file(server, 'c.zip', 50000)
+    save_path = str(tmp_path / 'c.zip')
+    with pytest.raises(download_tools.DownloadError):
+        download_tools.download_file(download_tools.create_session(), server.url + 'c.zip', save_path,
+                                     expected_size=len(data), expected_md5='0' * 32)
+    assert os.path.exists(save_path) is False
+    # downloaded again after each mismatch
+    assert len(server.requests) == download_tools.max_retries + 1
+
+def test_batch_continues_after_errors(server, tmp_path):
+    data, md5 = add_file(server, 'd.zip', 50000)
+    ok_path = str(tmp_path / 'd.zip')
+    url_path_list = [(server.url + 'd.zip', ok_path, len(data), md5),
+                     (server.url + 'missing.zip', str(tmp_path / 'missing.zip')),
+                     ('http://[invalid', str(tmp_path / 'invalid.zip'))]
+    results = download_tools.download_files(download_tools.create_session(), url_path_list, threads=3)
+    assert results[ok_path] is None
+    assert results[str(tmp_path / 'missing.zip')] is not None
+    assert results[str(tmp_path / 'invalid.zip')] is not None
+    # complete files are skipped
+    server.requests.clear()
+    results = download_tools.download_files(download_tools.create_session(), url_path_list[:1])
+    assert results[ok_path] is None and len(server.requests) == 0
+
+def test_range_beyond_file(server, tmp_path):
+    data, md5 = add_file(server, 'e.zip', 20000)
+    save_path = str(tmp_path / 'e.zip')
+    # a part file longer than the file (e.g., the file changed on the server), 416, then start again
+    with open(save_path + download_tools.part_suffix, 'wb') as f_obj:
+        f_obj.write(b'x' * 30000)
+    download_tools.download_file(download_tools.create_session(), server.url + 'e.zip', save_path,
+                                 expected_size=len(data), expected_md5=md5)
+    assert open(save_path, 'rb').read() == data
+    assert [item[1] for item in server.requests] == ['bytes=30000-', None]
+
+def test_backoff_on_server_errors(server, tmp_path, monkeypatch):
+    data, _ = add_file(server, 'f.zip', 20000, mode='unavailable')
+    sleeps = []
+    monkeypatch.setattr(download_tools.time, 'sleep', lambda seconds: sleeps.append(seconds))
+    save_path = str(tmp_path / 'f.zip')
+    download_tools.download_file(download_tools.create_session(), server.url + 'f.zip', save_path)
+    assert open(save_path, 'rb').read() == data
+    assert sleeps == [download_tools.backoff_seconds, download_tools.backoff_seconds * 2]
+
+def test_not_found_is_not_retried(server, tmp_path):
+    with pytest.raises(download_tools.DownloadError) as error:
+        download_tools.download_file(download_tools.create_session(), server.url + 'none.zip', str(tmp_path / 'none.zip'))
+    assert error.value.status_code == 404
+    assert len(server.requests) == 1
+
+def test_invalid_cached_zip_is_downloaded_again(server, tmp_path):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w') as zip_obj:
+        zip_obj.writestr('N29W096.hgt', os.urandom(10000))
+    server.files['N29W096.SRTMGL1.hgt.zip'] = buffer.getvalue()
+    save_path = str(tmp_path / 'N29W096.SRTMGL1.hgt.zip')
+    # a truncated zip from an old download
+    with open(save_path, 'wb') as f_obj:
+        f_obj.write(buffer.getvalue()[:1000])
+    results = download_tools.download_files(download_tools.create_session(),
+                                            [(server.url + 'N29W096.SRTMGL1.hgt.zip', save_path)],
+                                            validate=download_tools.is_valid_zip)
+    assert results[save_path] is None
+    assert download_tools.is_valid_zip(save_path)
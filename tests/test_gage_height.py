@@ -0,0 +1,41 @@
+import os, sys, types
+from datetime import datetime
+
+import pandas as pd
+import pytest
+
+import download_gageHeight_nwis
+
+class FakeNWIS(object):
+    # daily values of the requested dates, a column for each site
+    def get_gageheight(self, site_list, dates_str):
+        index = pd.date_range(dates_str[0], dates_str[1], freq='D', tz='UTC')
+        return pd.DataFrame(dict([('USGS-' + site_no, range(len(index))) for site_no in site_list]), index=index)
+
+def fixed_datetime(now):
+    class FixedDatetime(datetime):
+        @classmethod
+        def now(cls, tz=None):
+            return cls(now.year, now.month, now.day, now.hour)
+    return FixedDatetime
+
+# the month containing today is in progress (on its last day too),
+# the daily values of the last days of the previous month may not be published in the first days of a month
+@pytest.mark.parametrize('now, expected', [(datetime(2026, 10, 3, 12), {8: True, 9: False, 10: False}),
+                                           (datetime(2026, 10, 31, 12), {8: True, 9: True, 10: False})])
+def test_months_cached_after_publication(tmp_path, monkeypatch, now, expected):
+    exceptions = types.ModuleType('pygeohydro.exceptions')
+    exceptions.ZeroMatchedError = type('ZeroMatchedError', (ValueError,), {})
+    monkeypatch.setitem(sys.modules, 'pygeohydro', types.ModuleType('pygeohydro'))
+    monkeypatch.setitem(sys.modules, 'pygeohydro.exceptions', exceptions)
+    monkeypatch.setattr(download_gageHeight_nwis, 'datetime', fixed_datetime(now))
+    cache_dir = str(tmp_path)
+
+    cached = {}
+    for month_start, month_end in download_gageHeight_nwis.month_ranges(datetime(2026, 8, 10), now):
+        site_tables, message = download_gageHeight_nwis.download_month(FakeNWIS(), ['08068720'], month_start,
+                                                                       month_end, cache_dir)
+        assert message is None and len(site_tables['08068720']) > 0
+        cache_path = download_gageHeight_nwis.month_cache_path(cache_dir, '08068720', month_start)
+        cached[month_start.month] = os.path.isfile(cache_path)
+    assert cached == expected
@@ -0,0 +1,27 @@
+import RTC.RTC_v3 as RTC_v3
+
+def slice_path(mission, start, stop, absolute_orbit, datatake, unique_id):
+    return '/data/grd/%s_IW_GRDH_1SDV_20190401T%s_20190401T%s_%s_%s_%s.zip' % (mission, start, stop, absolute_orbit,
+                                                                             datatake, unique_id)
+
+def test_group_consecutive_slices():
+    a1 = slice_path('S1A', '000523', '000548', '026600', '02FC4A', '0001')
+    a2 = slice_path('S1A', '000548', '000613', '026600', '02FC4A', '0002')
+    # the same pass, after a gap of 47 seconds
+    a3 = slice_path('S1A', '000700', '000725', '026600', '02FC4A', '0003')
+    # right after a2, but another data take, or another satellite
+    b1 = slice_path('S1A', '000613', '000638', '026600', '02FC4B', '0004')
+    c1 = slice_path('S1B', '000613', '000638', '026600', '02FC4A', '0005')
+
+    grouped = RTC_v3.group_consecutive_slices([a3, b1, a2, c1, a1])
+    assert sorted([item if isinstance(item, list) else [item] for item in grouped]) == \
+           sorted([[a1, a2], [a3], [b1], [c1]])
+    assert RTC_v3.get_granule_name([a1, a2]) == 'S1A_IW_GRDH_1SDV_20190401T000523_20190401T000613_026600_02FC4A_0001'
+
+def test_gap_limit():
+    a1 = slice_path('S1A', '000523', '000548', '026600', '02FC4A', '0001')
+    a2 = slice_path('S1A', '000553', '000618', '026600', '02FC4A', '0002')
+    a3 = slice_path('S1A', '000624', '000649', '026600', '02FC4A', '0003')
+    # 5 seconds between a1 and a2 are allowed, 6 seconds between a2 and a3 are not
+    assert RTC_v3.group_consecutive_slices([a1, a2, a3]) == [[a1, a2], a3]
+    assert RTC_v3.group_consecutive_slices([a1, a2, a3], max_gap_seconds=0) == [a1, a2, a3]
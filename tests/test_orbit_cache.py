@@ -0,0 +1,77 @@
+import os, sys
+from datetime import datetime
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'RTC'))
+import orbit_cache
+
+def orbit_name(orbit_type, produced, valid_start, valid_stop, mission='S1A'):
+    return '%s_OPER_AUX_%s_OPOD_%s_V%s_%s.EOF.zip' % (mission, orbit_type, produced, valid_start, valid_stop)
+
+# a precise orbit file starting in March, covering 1 April
+poeorb_march = orbit_name('POEORB', '20190421T120654', '20190331T225942', '20190402T005942')
+poeorb_old = orbit_name('POEORB', '20190420T120654', '20190331T225942', '20190402T005942')
+resorb_april_1 = orbit_name('RESORB', '20190401T030000', '20190331T233000', '20190401T030000')
+resorb_april_5 = orbit_name('RESORB', '20190405T130000', '20190405T083000', '20190405T113000')
+# ends 30 seconds after the acquisition, the margin is 60 seconds
+resorb_short = orbit_name('RESORB', '20190406T130000', '20190406T083000', '20190406T100055')
+
+@pytest.fixture
+def mirror(tmp_path, monkeypatch):
+    # a local mirror of any layout, an empty cache, and the orbit folder of SNAP
+    monkeypatch.setattr(orbit_cache, 'snap_orbit_dir', str(tmp_path / 'snap'))
+    mirror_dir = tmp_path / 'mirror' / 'all'
+    mirror_dir.mkdir(parents=True)
+    for name in [poeorb_march, poeorb_old, resorb_april_1, resorb_april_5, resorb_short]:
+        (mirror_dir / name).write_bytes(name.encode())
+    return str(tmp_path / 'mirror'), str(tmp_path / 'cache')
+
+def test_precise_orbit_preferred(mirror):
+    source, cache_dir = mirror
+    cache = orbit_cache.OrbitCache(cache_dir=cache_dir, source=source, offline=True)
+    granule = 'S1A_IW_GRDH_1SDV_20190401T000523_20190401T000548_026600_02FC4A_5A2B'
+    orbit_type, path = cache.fetch(granule)
+    # the newest precise orbit file, saved in the folder of its validity start month
+    assert orbit_type == 'POEORB' and os.path.basename(path) == poeorb_march
+    assert os.path.dirname(path) == orbit_cache.month_folder(cache_dir, 'POEORB', 'S1A', datetime(2019, 3, 31))
+    # only restituted orbits
+    assert cache.fetch(granule, orbit_types=('RESORB',)) == \
+           ('RESORB', os.path.join(orbit_cache.month_folder(cache_dir, 'RESORB', 'S1A', datetime(2019, 3, 31)),
+                                   resorb_april_1))
+
+def test_restituted_orbit_by_validity_window(mirror):
+    source, cache_dir = mirror
+    cache = orbit_cache.OrbitCache(cache_dir=cache_dir, source=source, offline=True)
+    # no precise orbit file covers 5 April yet
+    orbit_type, path = cache.fetch('S1A_IW_GRDH_1SDV_20190405T100000_20190405T100025_026665_02FE9C_1A2B')
+    assert orbit_type == 'RESORB' and os.path.basename(path) == resorb_april_5
+    # the window ends within the margin after the acquisition
+    assert cache.fetch('S1A_IW_GRDH_1SDV_20190406T100000_20190406T100025_026680_02FF2C_3C4D') == (None, None)
+    # another satellite
+    assert cache.fetch('S1B_IW_GRDH_1SDV_20190405T100000_20190405T100025_015761_01DA3C_5E6F') == (None, None)
+
+def test_window_across_month_boundary(mirror):
+    source, cache_dir = mirror
+    granules = ['S1A_IW_GRDH_1SDV_20190401T000523_20190401T000548_026600_02FC4A_5A2B']
+    orbits = orbit_cache.prefetch_orbits(granules, cache_dir=cache_dir, source=source, offline=True)
+    # installed in the folder of the acquisition month, where SNAP looks for it
+    orbit_type, path = orbits[granules[0]]
+    assert orbit_type == 'POEORB'
+    assert os.path.dirname(path) == orbit_cache.month_folder(orbit_cache.snap_orbit_dir, 'POEORB', 'S1A',
+                                                             datetime(2019, 4, 1))
+    assert orbit_cache.find_snap_orbit(granules[0], 'POEORB') == path
+    assert orbit_cache.find_snap_orbit(granules[0], 'RESORB') is None
+
+def test_url_listing_of_previous_month(tmp_path, monkeypatch):
+    cache = orbit_cache.OrbitCache(cache_dir=str(tmp_path / 'cache'), source='https://example.com/orbits')
+    listed = []
+    def list_url(orbit_type, mission, time):
+        listed.append((orbit_type, time.month))
+        url = 'https://example.com/orbits/%s/%s/%04d/%02d/' % (orbit_type, mission, time.year, time.month)
+        names = [poeorb_march, poeorb_old] if (orbit_type, time.month) == ('POEORB', 3) else []
+        return [(name, url + name) for name in names]
+    monkeypatch.setattr(cache, '_list_url', list_url)
+    url = cache._find_in_url('S1A', 'POEORB', datetime(2019, 4, 1, 0, 5, 23), datetime(2019, 4, 1, 0, 5, 48))
+    assert url == 'https://example.com/orbits/POEORB/S1A/2019/03/' + poeorb_march
+    assert listed == [('POEORB', 3), ('POEORB', 4)]
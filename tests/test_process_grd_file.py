@@ -0,0 +1,23 @@
+import os
+
+import synthetic_grd
+import RTC.RTC_v3 as RTC_v3
+
+def test_process_grd_file_records_and_skips(tmp_path, fake_tools):
+    zip_list = synthetic_grd.make_synthetic_grd_list(str(tmp_path / 'grd'), 2, size_mb=0.1)
+    output_dir = str(tmp_path / 'out')
+    os.makedirs(output_dir)
+    args = {'pixsize': 10.0, 'output_dir': output_dir}
+
+    assert RTC_v3.Process_GRD_File(args, zip_list) >= 0
+
+    final_dir = os.path.join(output_dir, 'final')
+    ledger = RTC_v3.stage_ledger.open_ledger(output_dir, final_dir)
+    for zip_path in zip_list:
+        granule = RTC_v3.get_granule_name(zip_path)
+        assert ledger.is_granule_complete(granule)
+        assert len([item for item in os.listdir(final_dir) if item.startswith(granule)]) > 0
+
+    # completed granules are skipped, no gpt runs
+    fake_tools.baseSNAP = 'false'
+    assert RTC_v3.Process_GRD_File(args, zip_list) >= 0
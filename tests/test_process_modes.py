@@ -0,0 +1,79 @@
+import os, shlex
+import xml.etree.ElementTree as ET
+
+import synthetic_grd
+import RTC.RTC_v3 as RTC_v3
+
+def read_graph_nodes(graph_xml):
+    # a list of (id, operator, sources in the order of sourceProduct, sourceProduct.1, ..., parameters)
+    nodes = []
+    for node in ET.parse(graph_xml).getroot().findall('node'):
+        sources = sorted([(item.tag, item.get('refid')) for item in node.find('sources')],
+                         key=lambda item: 0 if item[0] == 'sourceProduct' else int(item[0].split('.')[1]))
+        parameters = dict([(item.tag, item.text) for item in node.find('parameters')])
+        nodes.append((node.get('id'), node.find('operator').text, [refid for _, refid in sources], parameters))
+    return nodes
+
+def parse_gpt_args(args):
+    # (operator, target, source paths in order, parameters) of a gpt command written by applyStages
+    args = args[len(shlex.split(RTC_v3.baseSNAP)):]
+    operator, target, sources, parameters = args[0], None, [], {}
+    idx = 1
+    while idx < len(args):
+        if args[idx] == '-t':
+            target = args[idx + 1]
+            idx += 1
+        elif args[idx] in ['-q', '-c']:
+            idx += 1
+        elif args[idx].startswith('-P'):
+            key, value = args[idx][2:].split('=', 1)
+            parameters[key] = value
+        elif args[idx].startswith('-S'):
+            sources.append(args[idx].split('=', 1)[1])
+        else:
+            sources.append(args[idx])
+        idx += 1
+    return operator, target, sources, parameters
+
+def test_graph_matches_stages(tmp_path, fake_tools, monkeypatch):
+    zip_list = synthetic_grd.make_synthetic_grd_list(str(tmp_path / 'grd'), 2, size_mb=0.1, consecutive=True)
+    granule = RTC_v3.get_granule_name(zip_list)
+    geo_region = RTC_v3.granule_footprint(zip_list).buffer(-0.5).wkt
+
+    commands = []
+    run_pOpen = RTC_v3.run_pOpen
+    def record_pOpen(cmd, log_path=None, timeout=None):
+        commands.append(cmd)
+        return run_pOpen(cmd, log_path=log_path, timeout=timeout)
+    monkeypatch.setattr(RTC_v3, 'run_pOpen', record_pOpen)
+
+    graph_dir = RTC_v3.output_dir(str(tmp_path / 'graph'), granule)
+    graph_tc = RTC_v3.applyGraph(graph_dir, zip_list, granule, 10.0, ' ', geo_region=geo_region)
+    stages_dir = RTC_v3.output_dir(str(tmp_path / 'stages'), granule)
+    commands.clear()
+    stages_tc = RTC_v3.applyStages(stages_dir, zip_list, granule, 10.0, ' ', geo_region=geo_region)
+    assert os.path.isfile(graph_tc) and os.path.isfile(stages_tc)
+
+    nodes = read_graph_nodes(os.path.join(graph_dir, granule + '_graph.xml'))
+    read_files = dict([(node_id, parameters['file']) for node_id, operator, _, parameters in nodes
+                       if operator == 'Read'])
+    op_nodes = [node for node in nodes if node[1] not in ['Read', 'Write']]
+    stages = [parse_gpt_args(args) for args in commands]
+
+    # the same operators in the same order
+    assert [node[1] for node in op_nodes] == [stage[0] for stage in stages]
+    assert [node[1] for node in op_nodes] == ['Apply-Orbit-File', 'Remove-GRD-Border-Noise', 'Calibration',
+                                              'Apply-Orbit-File', 'Remove-GRD-Border-Noise', 'Calibration',
+                                              'SliceAssembly', 'Subset', 'Speckle-Filter', 'Terrain-Correction']
+    # the sources of a graph node are the products of the stages of its source nodes, in the same order
+    stage_outputs = dict([(node[0], stage[1] + '.dim') for node, stage in zip(op_nodes, stages)])
+    stage_outputs.update(read_files)
+    for node, stage in zip(op_nodes, stages):
+        assert [stage_outputs[refid] for refid in node[2]] == stage[2], node[0]
+        assert node[3] == stage[3], node[0]
+    assert op_nodes[6][2] == ['Calibration', 'Calibration(2)']
+    assert sorted(read_files.values()) == sorted(zip_list)
+
+    # the graph writes the terrain corrected product
+    write_node = [node for node in nodes if node[1] == 'Write'][0]
+    assert write_node[2] == ['Terrain-Correction'] and write_node[3]['file'] == graph_tc
@@ -0,0 +1,29 @@
+import threading
+
+import pytest
+
+import synthetic_grd
+import snap_GRD_process
+import RTC.RTC_v3 as RTC_v3
+
+@pytest.mark.parametrize('with_input, slice_assembly', [(False, False), (True, True)])
+def test_requeued_slices_are_assembled(tmp_path, fake_tools, monkeypatch, with_input, slice_assembly):
+    monkeypatch.setattr(snap_GRD_process, '_ledger_local', threading.local())
+    monkeypatch.setattr(RTC_v3, 'log_dir', None)
+    monkeypatch.setattr(RTC_v3.stage_metrics, 'metrics_path', None)
+    # precise orbit files are available now
+    monkeypatch.setattr(RTC_v3.orbit_cache, 'find_snap_orbit', lambda granule, orbit_type: granule + '.EOF')
+    zip_list = synthetic_grd.make_synthetic_grd_list(str(tmp_path / 'grd'), 2, size_mb=0.1, consecutive=True)
+    save_dir = str(tmp_path / 'save')
+    granule = RTC_v3.get_granule_name(zip_list)
+    ledger = snap_GRD_process.get_ledger(save_dir)
+    ledger.queue_reprocess(granule, zip_list, 'restituted orbit')
+
+    grd_list = zip_list if with_input else []
+    results = snap_GRD_process.GRD_file_preProcessing(grd_list, str(tmp_path / 'temp'), save_dir, 10.0,
+                                                      export_opts={'export_format': 'gtiff'},
+                                                      slice_assembly=slice_assembly)
+    # one assembled product, not one product for each slice
+    assert [(grd, status) for grd, status, _, _ in results] == [(zip_list, 'success')]
+    assert ledger.is_granule_complete(granule)
+    assert ledger.reprocess_list() == []
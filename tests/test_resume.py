@@ -0,0 +1,88 @@
+import os, shutil, threading
+
+import pytest
+
+import synthetic_grd
+import snap_GRD_process
+import RTC.RTC_v3 as RTC_v3
+
+def copy_band(img_path, save_path, compress='DEFLATE', num_threads='ALL_CPUS'):
+    # the COG driver needs rasterio, copying the raster is enough for checking the resume
+    shutil.copyfile(img_path, save_path)
+    return save_path
+
+@pytest.fixture
+def granule_env(tmp_path, fake_tools, monkeypatch):
+    # a new ledger for each test, the ledger of a thread is kept in snap_GRD_process
+    monkeypatch.setattr(snap_GRD_process, '_ledger_local', threading.local())
+    monkeypatch.setattr(RTC_v3, 'band_2_cog', copy_band)
+    zip_path = synthetic_grd.make_synthetic_grd_list(str(tmp_path / 'grd'), 1, size_mb=0.1)[0]
+    save_dir = tmp_path / 'save'
+    save_dir.mkdir()
+    return zip_path, str(tmp_path / 'temp'), str(save_dir)
+
+def process_granule(grd, temp_dir, save_dir, process_mode, export_format):
+    return snap_GRD_process.process_one_granule(grd, temp_dir, save_dir, 10.0, process_mode=process_mode,
+                                                export_opts={'export_format': export_format})
+
+def resume_without_gpt(grd, temp_dir, save_dir, process_mode, export_format):
+    # gpt fails if it runs again
+    RTC_v3.baseSNAP = 'false'
+    _, status, _, message = process_granule(grd, temp_dir, save_dir, process_mode, export_format)
+    assert status == 'success', message
+    ledger = snap_GRD_process.get_ledger(save_dir)
+    assert ledger.is_granule_complete(RTC_v3.get_granule_name(grd))
+
+@pytest.mark.parametrize('process_mode', ['graph', 'stages'])
+@pytest.mark.parametrize('export_format', ['gtiff', 'cog', 'vrt'])
+def test_resume_after_failed_clean_dirs(granule_env, monkeypatch, process_mode, export_format):
+    grd, temp_dir, save_dir = granule_env
+    final_dir = os.path.join(save_dir, 'final')
+    move = shutil.move
+    def failed_move(src, dst):
+        # after the intermediate data have been removed, the final folder is not writable
+        if os.path.dirname(dst) == final_dir:
+            raise OSError('no space left on device')
+        return move(src, dst)
+    monkeypatch.setattr(shutil, 'move', failed_move)
+    _, status, _, _ = process_granule(grd, temp_dir, save_dir, process_mode, export_format)
+    assert status == 'failed'
+
+    monkeypatch.setattr(shutil, 'move', move)
+    resume_without_gpt(grd, temp_dir, save_dir, process_mode, export_format)
+
+def fail_export(monkeypatch, export_format):
+    # the tool of the export fails once
+    if export_format == 'gtiff':
+        monkeypatch.setattr(RTC_v3, 'gdal_translate', 'false')
+    elif export_format == 'vrt':
+        monkeypatch.setattr(RTC_v3, 'gdalbuildvrt', 'false')
+    else:
+        def failed_band(img_path, save_path, compress='DEFLATE', num_threads='ALL_CPUS'):
+            raise IOError('failed to write %s' % save_path)
+        monkeypatch.setattr(RTC_v3, 'band_2_cog', failed_band)
+
+@pytest.mark.parametrize('process_mode', ['graph', 'stages'])
+@pytest.mark.parametrize('export_format', ['gtiff', 'cog', 'vrt'])
+def test_resume_after_failed_export(granule_env, monkeypatch, process_mode, export_format):
+    grd, temp_dir, save_dir = granule_env
+    tools = (RTC_v3.gdal_translate, RTC_v3.gdalbuildvrt)
+    fail_export(monkeypatch, export_format)
+    _, status, _, _ = process_granule(grd, temp_dir, save_dir, process_mode, export_format)
+    assert status == 'failed'
+
+    RTC_v3.gdal_translate, RTC_v3.gdalbuildvrt = tools
+    monkeypatch.setattr(RTC_v3, 'band_2_cog', copy_band)
+    resume_without_gpt(grd, temp_dir, save_dir, process_mode, export_format)
+
+def test_vrt_keeps_terrain_corrected_product(granule_env):
+    grd, temp_dir, save_dir = granule_env
+    _, status, _, message = process_granule(grd, temp_dir, save_dir, 'graph', 'vrt')
+    assert status == 'success', message
+    # the rasters and their orbit tags in the final folder
+    final_dir = os.path.join(save_dir, 'final')
+    granule = RTC_v3.get_granule_name(grd)
+    for band in RTC_v3.Sigma0_bands:
+        for ext in ['.img', '.hdr', '.vrt', '.img.aux.xml']:
+            assert os.path.isfile(os.path.join(final_dir, granule + '_' + band + ext))
+    assert RTC_v3.orbit_metadata_key in open(os.path.join(final_dir, granule + '_Sigma0_VV.img.aux.xml')).read()
@@ -0,0 +1,32 @@
+import os
+
+import synthetic_grd
+import snap_GRD_process
+import RTC.RTC_v3 as RTC_v3
+
+def test_unreadable_zip_is_reported(tmp_path):
+    zip_list = synthetic_grd.make_synthetic_grd_list(str(tmp_path / 'grd'), 2, size_mb=0.1)
+    # a partial download
+    with open(zip_list[1], 'r+b') as f_obj:
+        f_obj.truncate(1000)
+    save_dir = tmp_path / 'save'
+    save_dir.mkdir()
+    extent = RTC_v3.granule_footprint(zip_list[0]).wkt
+
+    selected, geo_regions, unreadable = snap_GRD_process.select_grd_by_extent(zip_list, extent, str(save_dir))
+    assert selected == [zip_list[0]]
+    assert unreadable == [zip_list[1]]
+
+def test_missing_file_is_reported(tmp_path):
+    zip_list = synthetic_grd.make_synthetic_grd_list(str(tmp_path / 'grd'), 2, size_mb=0.1)
+    # a broken link, e.g., the file in the granule store was removed
+    missing = str(tmp_path / 'grd' / 'missing.zip')
+    os.symlink(str(tmp_path / 'none.zip'), missing)
+    save_dir = tmp_path / 'save'
+    save_dir.mkdir()
+    extent = RTC_v3.granule_footprint(zip_list[0]).wkt
+
+    selected, geo_regions, unreadable = snap_GRD_process.select_grd_by_extent(zip_list + [missing], extent,
+                                                                              str(save_dir))
+    assert zip_list[0] in selected and missing not in selected
+    assert unreadable == [missing]
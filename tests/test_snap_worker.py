@@ -0,0 +1,73 @@
+import os, sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'RTC'))
+import snap_worker
+import proc_runner
+
+# a stand-in of esa_snappy: a graph file containing "hang" never finishes, others print a message and finish
+fake_snappy = '''
+import time
+
+class Any(object):
+    def __init__(self, *args):
+        self.args = args
+    def __getattr__(self, name):
+        return Any()
+    def __call__(self, *args):
+        return Any(*args)
+
+class FileReader(Any):
+    def close(self):
+        pass
+
+class GraphIO(object):
+    @staticmethod
+    def read(reader):
+        return open(reader.args[0]).read()
+
+class GraphProcessor(object):
+    def executeGraph(self, graph, pm):
+        print('processing ' + graph.strip())
+        if 'hang' in graph:
+            time.sleep(600)
+
+class jpy(object):
+    @staticmethod
+    def get_type(name):
+        return {'org.esa.snap.core.gpf.graph.GraphIO': GraphIO, 'java.io.FileReader': FileReader,
+                'org.esa.snap.core.gpf.graph.GraphProcessor': GraphProcessor}.get(name, Any())
+'''
+
+@pytest.fixture
+def worker_env(tmp_path, monkeypatch):
+    package_dir = tmp_path / 'fake_snappy' / 'esa_snappy'
+    package_dir.mkdir(parents=True)
+    (package_dir / '__init__.py').write_text(fake_snappy)
+    monkeypatch.setenv('PYTHONPATH', str(tmp_path / 'fake_snappy'))
+    monkeypatch.setattr(snap_worker, '_worker', None)
+    yield tmp_path
+    if snap_worker._worker is not None:
+        snap_worker._worker.close()
+
+def test_worker_logs_and_kills_hung_graph(worker_env):
+    ok_graph = worker_env / 'ok.xml'
+    ok_graph.write_text('ok graph')
+    hang_graph = worker_env / 'hang.xml'
+    hang_graph.write_text('hang graph')
+    log_path = str(worker_env / 'granule.log')
+
+    worker = snap_worker.get_snap_worker()
+    worker.run_graph(str(ok_graph), log_path=log_path, timeout=30)
+    assert 'processing ok graph' in open(log_path).read()
+
+    with pytest.raises(proc_runner.CommandError) as error:
+        worker.run_graph(str(hang_graph), log_path=log_path, timeout=1)
+    assert error.value.timed_out
+    assert worker.is_alive() is False
+
+    # a new worker for the next graph
+    new_worker = snap_worker.get_snap_worker()
+    assert new_worker is not worker
+    new_worker.run_graph(str(ok_graph), log_path=log_path, timeout=30)
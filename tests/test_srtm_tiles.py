@@ -0,0 +1,21 @@
+from shapely.geometry import MultiPolygon, box
+
+import downloadSRTM
+
+def tile_names(tiles):
+    return sorted([tile.split('.')[0] for tile in tiles])
+
+def test_tiles_across_equator_and_prime_meridian():
+    poly = MultiPolygon([box(-0.5, -0.5, 0.5, 0.5), box(2.2, 2.2, 2.8, 2.8)])
+    tiles = downloadSRTM.extent_to_1degree_tiles(poly)
+    assert tile_names(tiles) == ['N00E000', 'N00W001', 'N02E002', 'S01E000', 'S01W001']
+    assert downloadSRTM.srtm_tile_name(-1, -1) == 'S01W001.SRTMGL1.hgt.zip'
+
+def test_tiles_outside_polygons_not_selected():
+    poly = MultiPolygon([box(-0.5, -0.5, 0.5, 0.5), box(2.2, 2.2, 2.8, 2.8)])
+    tiles = tile_names(downloadSRTM.extent_to_1degree_tiles(poly))
+    # 16 tiles in the bounding box, between the two polygons
+    for name in ['N01E001', 'N01E000', 'N00E001', 'N02W001', 'S01E002', 'N01E002']:
+        assert name not in tiles
+    # a polygon on the tile edges does not need the neighbouring tiles
+    assert tile_names(downloadSRTM.extent_to_1degree_tiles(box(0, 0, 1, 1))) == ['N00E000']
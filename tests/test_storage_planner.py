@@ -0,0 +1,60 @@
+import os, json, shutil, subprocess, sys
+from collections import namedtuple
+
+import pytest
+
+import storage_planner
+
+GB = 1000 ** 3
+Usage = namedtuple('Usage', ['total', 'used', 'free'])
+
+@pytest.fixture
+def targets(tmp_path, monkeypatch):
+    # a small fast disk (100 GB, 30 GB free) and a large slow disk (1000 GB, 900 GB free)
+    fast, slow = str(tmp_path / 'fast'), str(tmp_path / 'slow')
+    usages = {fast: Usage(100 * GB, 70 * GB, 30 * GB), slow: Usage(1000 * GB, 100 * GB, 900 * GB)}
+    monkeypatch.setattr(shutil, 'disk_usage', lambda path: usages[path])
+    return fast, slow, usages
+
+def test_reservations_are_counted(targets):
+    fast, slow, _ = targets
+    planner = storage_planner.StoragePlanner([fast, slow])
+    # 25 GB available on the fast disk, 5 GB of it kept free
+    assert planner.reserve('g1', 10 * GB) == fast
+    assert planner.reserve('g2', 10 * GB) == fast
+    assert planner.reserve('g3', 10 * GB) == slow
+    res_dir = os.path.join(fast, storage_planner.reservation_folder)
+    assert sorted([name for name in os.listdir(res_dir) if not name.startswith('.')]) == ['g1', 'g2']
+    with open(os.path.join(res_dir, 'g1')) as f_obj:
+        assert json.load(f_obj)['bytes'] == 10 * GB
+
+    planner.release('g1', fast)
+    assert os.path.isfile(os.path.join(res_dir, 'g1')) is False
+    assert planner.reserve('g4', 10 * GB) == fast
+
+def test_reservation_of_dead_process_is_removed(targets):
+    fast, slow, _ = targets
+    planner = storage_planner.StoragePlanner([fast, slow])
+    proc = subprocess.Popen([sys.executable, '-c', 'pass'])
+    proc.wait()
+    res_dir = planner._reservation_dir(fast)
+    with open(os.path.join(res_dir, 'crashed'), 'w') as f_obj:
+        json.dump({'bytes': 20 * GB, 'pid': proc.pid, 'host': storage_planner.socket.gethostname(), 'time': ''},
+                  f_obj)
+    assert planner.reserve('g1', 20 * GB) == fast
+    assert os.path.isfile(os.path.join(res_dir, 'crashed')) is False
+
+def test_fallback_when_fast_disk_is_full(targets):
+    fast, slow, usages = targets
+    usages[fast] = Usage(100 * GB, 96 * GB, 4 * GB)
+    planner = storage_planner.StoragePlanner([fast, slow])
+    assert planner.reserve('g1', 1 * GB) == slow
+    # the last target is used even if the granule may not fit
+    usages[slow] = Usage(1000 * GB, 999 * GB, 1 * GB)
+    assert planner.reserve('g2', 10 * GB) == slow
+
+def test_resume_on_target_with_intermediate_data(targets):
+    fast, slow, _ = targets
+    os.makedirs(os.path.join(slow, 'g1_Processed'))
+    planner = storage_planner.StoragePlanner([fast, slow])
+    assert planner.reserve('g1', 10 * GB) == slow
@@ -8,10 +8,13 @@ email:huanglingcao@gmail.com
 add time: 31 October, 2022
 """
 
+import os
 import geopandas as gpd
 from packaging import version
 
 from shapely import geometry
+from shapely import wkt
+from shapely.ops import unary_union
 import re
 import pandas as pd
 
@@ -177,6 +180,20 @@ def read_shape_gpd_to_NewPrj(shp_path, prj_str):
 
     return polygons
 
+def read_extent_polygon(extent_shp_or_wkt):
+    '''
+    read the area of interest from a shapefile or a WKT string
+    :param extent_shp_or_wkt: a shapefile path, or a polygon in WKT (lon lat)
+    :return: a polygon (or multi-polygon) in (lon, lat), the union of all polygons in the shapefile
+    '''
+    if os.path.isfile(extent_shp_or_wkt):
+        polygons = read_shape_gpd_to_NewPrj(extent_shp_or_wkt, 'EPSG:4326')
+        if len(polygons) < 1:
+            raise ValueError('No polygons in %s' % extent_shp_or_wkt)
+        return unary_union(list(polygons))
+    else:
+        return wkt.loads(extent_shp_or_wkt)
+
 def save_shape_to_files(data_frame, geometry_name, wkt_string, save_path,format='ESRI Shapefile'):
     '''
     :param data_frame: include polygon list and the corresponding attributes